@@ -9,8 +9,16 @@ from routes.image_caption_route import image_caption_routes
 from routes.auth_route import auth_routes
 from controllers.group_caption_controller import group_caption_bp
 from controllers.location_controller import location_bp
+from controllers.health_controller import health_bp
+from controllers.metrics_controller import metrics_bp
+from services.image_caption_service import ImageCaptionService
+from services.caption_job_service import CaptionJobService
+from services.translation_service import TranslationService
+from services.metrics_service import MetricsService
+from services.near_duplicate_service import NearDuplicateService
 from flask_jwt_extended import JWTManager
 import datetime
+import multiprocessing
 import os
 from dotenv import load_dotenv
 
@@ -28,8 +36,8 @@ app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(days=1)
 # Khởi tạo JWT
 jwt = JWTManager(app)
 
-# Khởi tạo cơ sở dữ liệu
-initialize_db(app)
+# Đo số request và độ trễ HTTP theo blueprint cho /metrics
+MetricsService.init_app(app)
 
 # Đăng ký blueprints
 app.register_blueprint(auth_routes, url_prefix="/api/auth")
@@ -39,6 +47,33 @@ app.register_blueprint(admin_routes, url_prefix="/api/admin")
 app.register_blueprint(image_caption_routes, url_prefix="/api/image-caption")
 app.register_blueprint(group_caption_bp)
 app.register_blueprint(location_bp)
+app.register_blueprint(health_bp)
+app.register_blueprint(metrics_bp)
+
+# Tiến trình suy luận (CAPTION_WORKERS) dùng start method "spawn" nên import lại module chính khi chạy `python app.py`;
+# chỉ tiến trình web mới kết nối cơ sở dữ liệu, tải trước mô hình và khởi chạy các tác vụ nền
+if multiprocessing.parent_process() is None:
+    # Đo thời gian các lệnh MongoDB (phải đăng ký trước khi tạo kết nối)
+    MetricsService.register_mongo_listener()
+
+    # Khởi tạo cơ sở dữ liệu
+    initialize_db(app)
+
+    # Tải trước và warm-up mô hình ở background để /readyz chỉ báo sẵn sàng khi worker đã "nóng"
+    preload_models = [name.strip() for name in os.getenv("CAPTION_PRELOAD_MODELS", "").split(",") if name.strip()]
+    if preload_models:
+        ImageCaptionService.preload_models(preload_models, warmup=os.getenv("CAPTION_WARMUP", "1") != "0", background=True)
+
+    # Tải trước mô hình dịch Anh -> Việt để caption tiếng Việt không phải chờ tải mô hình ở request đầu tiên
+    if os.getenv("CAPTION_TRANSLATION_PRELOAD", "0") == "1":
+        TranslationService.preload(warmup=os.getenv("CAPTION_WARMUP", "1") != "0", background=True)
+
+    # Dựng chỉ mục ảnh gần trùng (pHash) từ collection images ở background
+    if NearDuplicateService.is_enabled():
+        NearDuplicateService.rebuild_in_background()
+
+    # Thread nền xử lý job caption bất đồng bộ (tiếp tục các job còn dang dở trước khi khởi động lại)
+    CaptionJobService.start_workers()
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
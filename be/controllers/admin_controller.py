@@ -2,6 +2,9 @@
 from flask import request, jsonify
 from services.user_service import UserService
 from services.image_service import ImageService
+from services.image_caption_service import ImageCaptionService
+from services.image_blob_service import ImageBlobService
+from services.near_duplicate_service import NearDuplicateService
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
 from models.image import Image
@@ -29,12 +32,17 @@ def get_all_users():
     is_active = request.args.get('is_active')  # "true", "false", hoặc None
     role = request.args.get('role')           # "admin", "user", hoặc None
     
-    users_data = UserService.get_all_users(
-        page=page,
-        per_page=per_page,
-        is_active=is_active,
-        role=role
-    )
+    try:
+        users_data = UserService.get_all_users(
+            page=page,
+            per_page=per_page,
+            is_active=is_active,
+            role=role,
+            cursor=request.args.get('cursor'),
+            total=request.args.get('total')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'items': [
@@ -50,9 +58,7 @@ def get_all_users():
             }
             for user in users_data['items']
         ],
-        'total': users_data['total'],
-        'pages': users_data['pages'],
-        'page': users_data['page']
+        **{key: value for key, value in users_data.items() if key != 'items'}
     }), 200
 
 @jwt_required()
@@ -146,29 +152,33 @@ def get_all_images():
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
     
-    images = ImageService.get_all_images(page, per_page)
+    try:
+        images = ImageService.get_all_images(page, per_page, cursor=request.args.get('cursor'), total=request.args.get('total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Người upload của cả trang được lấy trong một truy vấn
+    uploaders = ImageService.get_users_by_id([img.uploaded_by for img in images.items], 'username', 'full_name', 'role')
     
     return jsonify({
         'images': [
             {
-                'id': str(img.id),
-                'description': img.description,
-                'url': f"/api/images/file/{str(img.id)}",  # Sửa để sử dụng ID thay vì file_path
-                'created_at': img.created_at.isoformat() if hasattr(img, 'created_at') and img.created_at else None,
-                'location': img.location if hasattr(img, 'location') else None,
-                'uploaded_by': {
-                    'id': str(img.uploaded_by.id) if img.uploaded_by else None,
-                    'username': img.uploaded_by.username if img.uploaded_by else None,
-                    'full_name': img.uploaded_by.full_name if img.uploaded_by else None,
-                    'role': img.uploaded_by.role if img.uploaded_by else None
-                }
+                **ImageService.to_summary(img),
+                'uploaded_by': _uploader_summary(img.uploaded_by, uploaders)
             } for img in images.items
         ],
-        'total': images.total,
-        'pages': images.pages,
-        'page': images.page
+        **images.meta()
     }), 200
 
+def _uploader_summary(ref, uploaders):
+    """Thông tin người upload của ảnh từ kết quả get_users_by_id"""
+    uploader = uploaders.get(ref.id) if ref else None
+    return {
+        'id': str(ref.id) if ref else None,
+        'username': uploader.username if uploader else None,
+        'full_name': uploader.full_name if uploader else None,
+        'role': uploader.role if uploader else None
+    }
+
 @jwt_required()
 @admin_required
 def admin_delete_image(image_id):
@@ -185,7 +195,13 @@ def get_reports():
     per_page = int(request.args.get('per_page', 20))
     status = request.args.get('status', None)
     
-    reports = ImageService.get_reports(page, per_page, status)
+    try:
+        reports = ImageService.get_reports(page, per_page, status, cursor=request.args.get('cursor'), total=request.args.get('total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Ảnh và người báo cáo của cả trang được lấy trong hai truy vấn, không tải dữ liệu ảnh
+    images = ImageService.get_images_by_id([report.image for report in reports.items], 'id', 'description')
+    reporters = ImageService.get_users_by_id([report.reported_by for report in reports.items], 'username')
     
     return jsonify({
         'reports': [
@@ -193,17 +209,15 @@ def get_reports():
                 'id': str(report.id),
                 'image_id': str(report.image.id),
                 'image_url': f"/api/images/file/{str(report.image.id)}",  # Sửa để sử dụng ID thay vì file_path
-                'image_description': report.image.description,
+                'image_description': images[report.image.id].description if report.image.id in images else None,
                 'reported_by': str(report.reported_by.id),
-                'reporter_username': report.reported_by.username if hasattr(report.reported_by, 'username') else "Unknown",
+                'reporter_username': reporters[report.reported_by.id].username if report.reported_by.id in reporters else "Unknown",
                 'reason': report.reason,
                 'status': report.status,
                 'created_at': report.created_at.isoformat() if hasattr(report, 'created_at') and report.created_at else None
             } for report in reports.items
         ],
-        'total': reports.total,
-        'pages': reports.pages,
-        'page': reports.page
+        **reports.meta()
     }), 200
 
 @jwt_required()
@@ -235,5 +249,27 @@ def get_stats():
     return jsonify({
         'users': user_count,
         'images': image_count,
-        'pending_reports': pending_reports_count
-    }), 200
\ No newline at end of file
+        'pending_reports': pending_reports_count,
+        'image_storage': ImageBlobService.get_stats()
+    }), 200
+
+@jwt_required()
+@admin_required
+def get_caption_stats():
+    """Thống kê vận hành của dịch vụ tạo caption (kích thước batch, thời gian chờ hàng đợi)"""
+    return jsonify(ImageCaptionService.get_stats()), 200
+
+@jwt_required()
+@admin_required
+def rebuild_near_duplicate_index():
+    """Dựng lại chỉ mục ảnh gần trùng từ collection images ở background; backfill=1 để tính pHash cho ảnh cũ trước"""
+    backfill = request.args.get('backfill', '0').lower() in ('1', 'true', 'yes')
+    NearDuplicateService.rebuild_in_background(backfill=backfill)
+    return jsonify({'message': 'Đang dựng lại chỉ mục ảnh gần trùng', 'backfill': backfill}), 202
+
+@jwt_required()
+@admin_required
+def prune_caption_cache():
+    """Xóa cache caption thuộc phiên bản mô hình cũ khỏi MongoDB (thay cho việc mỗi worker tự xóa khi khởi động)"""
+    deleted = ImageCaptionService.prune_caption_cache()
+    return jsonify({'message': 'Đã dọn cache caption của phiên bản mô hình cũ', 'deleted': deleted}), 200
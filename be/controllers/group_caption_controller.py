@@ -16,8 +16,8 @@ def create_group_caption():
                 'error': 'Vui lòng chọn từ 2 đến 4 ảnh'
             }), 400
             
-        # Lấy thông tin ảnh từ database
-        images = Image.objects(id__in=image_ids)
+        # Lấy mô tả và địa điểm của ảnh từ database (không tải dữ liệu ảnh)
+        images = Image.objects(id__in=image_ids).only('description', 'location')
         if not images:
             return jsonify({
                 'error': 'Không tìm thấy ảnh'
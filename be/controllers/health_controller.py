@@ -0,0 +1,24 @@
+from flask import Blueprint, jsonify
+from services.image_caption_service import ImageCaptionService
+from services.background_executor import BackgroundExecutor
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """Tiến trình đang chạy; kèm trạng thái tải và độ trễ warm-up của từng mô hình và hàng đợi tác vụ nền"""
+    background = BackgroundExecutor.shared().get_stats()
+    return jsonify({
+        'status': 'ok',
+        'models': ImageCaptionService.get_model_status(),
+        'background': {key: background[key] for key in ('queue_depth', 'max_queue', 'running', 'dropped', 'rejected', 'failed')}
+    }), 200
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """Chỉ trả về 200 khi mọi mô hình cần tải trước đã sẵn sàng và đã warm-up"""
+    ready = ImageCaptionService.is_ready()
+    return jsonify({
+        'ready': ready,
+        'models': ImageCaptionService.get_model_status()
+    }), 200 if ready else 503
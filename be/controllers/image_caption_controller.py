@@ -1,15 +1,36 @@
 # controllers/image_caption_controller.py
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context, send_file
 from services.image_service import ImageService
 from services.image_caption_service import ImageCaptionService
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.caption_job_service import CaptionJobService
+from services.batch_upload_service import BatchUploadService
+from services.decoding_preset_service import DecodingPresetService
+from services.tts_service import TTSService
+from models.user import User
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 import json
-import threading
 import os
-import openpyxl
-import nltk
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-nltk.download('punkt', quiet=True)
+
+# Mặc định upload chờ tạo caption xong; client có thể gửi async=1 để nhận job_id ngay
+ASYNC_UPLOAD_DEFAULT = os.getenv("CAPTION_ASYNC_UPLOAD", "0") == "1"
+# Batch upload có nhiều ảnh hơn ngưỡng này luôn chạy bằng job nền để request không bị quá thời gian chờ
+BATCH_SYNC_MAX_FILES = int(os.getenv("CAPTION_BATCH_SYNC_MAX_FILES", "16"))
+
+def _decoding_options(data):
+    """
+    Đọc preset giải mã và ngân sách độ trễ (ms) từ form/JSON của request.
+    Giá trị không hợp lệ được bỏ qua để dùng cấu hình mặc định.
+    """
+    preset = data.get('preset')
+    if preset not in DecodingPresetService.preset_names():
+        preset = None
+    try:
+        latency_budget_ms = float(data['latency_budget_ms']) if data.get('latency_budget_ms') not in (None, '') else None
+    except (TypeError, ValueError):
+        latency_budget_ms = None
+    if latency_budget_ms is not None and latency_budget_ms < 0:
+        latency_budget_ms = None
+    return preset, latency_budget_ms
 
 @jwt_required()
 def upload_with_caption():
@@ -17,6 +38,9 @@ def upload_with_caption():
     API để tải lên ảnh và tự động tạo caption
     - Lưu ảnh vào MongoDB
     - Tạo caption tự động và lưu vào trường description
+    - Nếu async=1 (form hoặc query string): tạo job caption chạy nền và trả về 202 kèm job_id ngay
+    - preset (fast, balanced, quality) và latency_budget_ms (tùy chọn) quyết định num_beams/max_length;
+      preset thực tế được trả về trong trường "preset"
     """
     try:
         user_id = get_jwt_identity()
@@ -52,66 +76,142 @@ def upload_with_caption():
             file=image_file,
             description="",  # Mô tả trống, sẽ được cập nhật sau
             user_id=user_id,
-            location=location
+            location=location,
+            original_file_name=img_name
         )
         
         # Lấy loại mô hình từ form data (mặc định hoặc du lịch)
         model_type = request.form.get('model_type', 'default')
-        if model_type not in ['default', 'travel']:
+        if model_type not in ImageCaptionService.available_model_types():
             model_type = 'default'
         
         # Lấy ngôn ngữ từ form data (tiếng Anh hoặc tiếng Việt)
         language = request.form.get('language', 'en')
         if language not in ['en', 'vi']:
             language = 'en'
-            
-        # 2. Tạo caption từ dữ liệu nhị phân với mô hình đã chọn và ngôn ngữ được chọn
-        caption = ImageCaptionService.generate_caption_from_binary(image.image_data, speak=False, model_type=model_type, language=language)
-        
-        # Bỏ log hash ảnh vào file caption log
-        # img_hash = image.image_hash
-        # ImageCaptionService.log_to_file(f"Hash ảnh: {img_hash}")
-        # --- BLEU LOGIC ---
-        try:
-            test_path = os.path.join(os.path.dirname(__file__), '../test.xlsx')
-            if os.path.exists(test_path):
-                wb = openpyxl.load_workbook(test_path)
-                ws = wb.active
-                gt_dict = {}
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    gt_dict[str(row[0]).strip()] = str(row[1]).strip()
-                if image.image_hash in gt_dict:
-                    ref = gt_dict[image.image_hash]
-                    ref_tokens = nltk.word_tokenize(ref)
-                    hyp_tokens = nltk.word_tokenize(caption)
-                    bleu1 = sentence_bleu([ref_tokens], hyp_tokens, weights=(1, 0, 0, 0), smoothing_function=SmoothingFunction().method1)
-                    bleu2 = sentence_bleu([ref_tokens], hyp_tokens, weights=(0.5, 0.5, 0, 0), smoothing_function=SmoothingFunction().method1)
-                    log_str = f"BLEU-1: {bleu1:.4f} | BLEU-2: {bleu2:.4f}\nRef: {ref}\nHyp: {caption}"
-                    print(log_str)
-                    ImageCaptionService.log_to_file(log_str)
-        except Exception as e:
-            print(f"[BLEU] Error: {e}")
-        # --- END BLEU LOGIC ---
-        
-        # Tạo thread riêng để phát âm mô tả ở background
-        def speak_in_background():
-            try:
-                ImageCaptionService.speak_caption(caption, lang=language)
-            except Exception as e:
-                print(f"Lỗi khi phát âm ở background: {e}")
-                
-        # Khởi chạy thread phát âm ở background
-        threading.Thread(target=speak_in_background, daemon=True).start()
         
-        # 3. Cập nhật mô tả của ảnh với caption vừa tạo
-        ImageService.update_image(str(image.id), user_id, caption)
+        preset, latency_budget_ms = _decoding_options(request.form)
+            
+        # Chế độ bất đồng bộ: đưa vào hàng đợi job và trả về ngay
+        async_flag = request.form.get('async', request.args.get('async'))
+        run_async = ASYNC_UPLOAD_DEFAULT if async_flag is None else async_flag.lower() in ('1', 'true', 'yes')
+        if run_async:
+            job = CaptionJobService.enqueue(
+                image, user_id, model_type=model_type, language=language,
+                preset=preset, latency_budget_ms=latency_budget_ms
+            )
+            return jsonify({
+                "success": True,
+                "id": str(image.id),
+                "job_id": str(job.id),
+                "status": job.status,
+                "status_url": f"/api/image-caption/jobs/{str(job.id)}",
+                "location": image.location
+            }), 202
+            
+        # 2-3. Tạo caption với mô hình và ngôn ngữ đã chọn, sau đó cập nhật mô tả của ảnh
+        caption, decoding = CaptionJobService.caption_image(
+            image, user_id, model_type=model_type, language=language,
+            preset=preset, latency_budget_ms=latency_budget_ms
+        )
         
         # 4. Trả về kết quả
         return jsonify({
             "success": True,
             "id": str(image.id),
             "description": caption,
-            "location": image.location
+            "location": image.location,
+            "preset": decoding["preset"],
+            "audio_url": TTSService.audio_url(str(image.id), caption, language)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+        
+    except Exception as e:
+        print(f"Lỗi không mong đợi: {e}")
+        return jsonify({"error": "Lỗi máy chủ nội bộ"}), 500
+
+@jwt_required()
+def upload_batch_with_caption():
+    """
+    API để tải lên nhiều ảnh trong một request và tạo caption theo lô
+    - Ảnh gửi trong nhiều trường "images" và/hoặc trong tệp zip ở trường "archive"
+    - Các ảnh được lưu lần lượt, sau đó tạo caption đồng thời để được gom vào cùng lô suy luận
+    - Chế độ đồng bộ trả về kết quả từng file; async=1 (hoặc batch lớn hơn CAPTION_BATCH_SYNC_MAX_FILES ảnh)
+      trả về 202 kèm batch_id để theo dõi qua /jobs/batch/<batch_id>
+    - location, model_type, language, preset, latency_budget_ms giống API upload một ảnh và áp dụng cho mọi ảnh
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        files = request.files.getlist('images')
+        archives = request.files.getlist('archive')
+        if not any(f.filename for f in files + archives):
+            return jsonify({"error": "Không tìm thấy file ảnh hoặc tệp zip trong request"}), 400
+        
+        location = request.form.get('location') or 'Không rõ'
+        
+        model_type = request.form.get('model_type', 'default')
+        if model_type not in ImageCaptionService.available_model_types():
+            model_type = 'default'
+        
+        language = request.form.get('language', 'en')
+        if language not in ['en', 'vi']:
+            language = 'en'
+        
+        preset, latency_budget_ms = _decoding_options(request.form)
+        
+        async_flag = request.form.get('async', request.args.get('async'))
+        run_async = ASYNC_UPLOAD_DEFAULT if async_flag is None else async_flag.lower() in ('1', 'true', 'yes')
+        # Số ảnh chỉ biết sau khi đọc zip; batch lớn được chuyển sang job nền sau khi lưu,
+        # nên chỉ giữ trong bộ nhớ dữ liệu của tối đa CAPTION_BATCH_SYNC_MAX_FILES ảnh đầu tiên
+        images, results = BatchUploadService.upload_files(
+            files, archives, user_id, allowed_file, location=location,
+            keep_first=0 if run_async else BATCH_SYNC_MAX_FILES
+        )
+        if not images:
+            return jsonify({"error": "Không có ảnh hợp lệ nào trong request", "results": results}), 400
+        
+        if run_async or len(images) > BATCH_SYNC_MAX_FILES:
+            for image in images:
+                image._blob_data = None
+            batch_id = CaptionJobService.enqueue_batch(
+                images, user_id, model_type=model_type, language=language,
+                preset=preset, latency_budget_ms=latency_budget_ms
+            )
+            return jsonify({
+                "success": True,
+                "batch_id": batch_id,
+                "total": len(images),
+                "status_url": f"/api/image-caption/jobs/batch/{batch_id}",
+                "results": results
+            }), 202
+        
+        captions = CaptionJobService.caption_images(
+            images, user_id, model_type=model_type, language=language,
+            preset=preset, latency_budget_ms=latency_budget_ms
+        )
+        by_id = {str(image.id): outcome for image, outcome in zip(images, captions)}
+        for result in results:
+            outcome = by_id.get(result.get("id"))
+            if outcome is None:
+                continue
+            if isinstance(outcome, Exception):
+                result["error"] = "Không thể tạo mô tả cho ảnh"
+                continue
+            caption, decoding = outcome
+            result.update({
+                "description": caption,
+                "preset": decoding["preset"],
+                "audio_url": TTSService.audio_url(result["id"], caption, language)
+            })
+        
+        return jsonify({
+            "success": True,
+            "total": len(images),
+            "location": location,
+            "results": results
         }), 200
         
     except ValueError as e:
@@ -180,26 +280,27 @@ def regenerate_caption(image_id):
         # Lấy loại mô hình và ngôn ngữ từ request JSON
         data = request.get_json() or {}
         model_type = data.get('model_type', 'default')
-        if model_type not in ['default', 'travel']:
+        if model_type not in ImageCaptionService.available_model_types():
             model_type = 'default'
             
         # Lấy ngôn ngữ từ request JSON (tiếng Anh hoặc tiếng Việt)
         language = data.get('language', 'en')
         if language not in ['en', 'vi']:
             language = 'en'
+        
+        # Chọn num_beams/max_length theo preset và ngân sách độ trễ
+        preset, latency_budget_ms = _decoding_options(data)
+        decoding = DecodingPresetService.resolve(model_type, preset, latency_budget_ms)
             
         # Tạo caption mới từ dữ liệu nhị phân trong MongoDB với mô hình đã chọn và ngôn ngữ được chọn
-        caption = ImageCaptionService.generate_caption_from_binary(image.image_data, speak=False, model_type=model_type, language=language)
+        caption = ImageCaptionService.generate_caption_from_binary(
+            image.get_image_data(), max_length=decoding["max_length"], num_beams=decoding["num_beams"],
+            speak=False, model_type=model_type, language=language, image_hash=image.image_hash,
+            perceptual_hash=image.perceptual_hash
+        )
         
-        # Tạo thread riêng để phát âm mô tả ở background
-        def speak_in_background():
-            try:
-                ImageCaptionService.speak_caption(caption, lang=language)
-            except Exception as e:
-                print(f"Lỗi khi phát âm ở background: {e}")
-                
-        # Khởi chạy thread phát âm ở background
-        threading.Thread(target=speak_in_background, daemon=True).start()
+        # Tạo sẵn audio đọc caption ở background để client phát qua GET /<image_id>/audio
+        TTSService.prefetch(caption, language)
         
         # Cập nhật mô tả với caption mới
         ImageService.update_image(image_id, user_id, caption)
@@ -212,7 +313,9 @@ def regenerate_caption(image_id):
                 "description": caption,
                 "url": f"/api/images/file/{str(image.id)}",
                 "created_at": image.created_at.isoformat() if hasattr(image, 'created_at') else None
-            }
+            },
+            "preset": decoding["preset"],
+            "audio_url": TTSService.audio_url(str(image.id), caption, language)
         }), 200
         
     except ValueError as e:
@@ -222,6 +325,223 @@ def regenerate_caption(image_id):
         print(f"Lỗi không mong đợi: {e}")
         return jsonify({"error": "Lỗi máy chủ nội bộ"}), 500
 
+def _sse(event, data):
+    """Định dạng một sự kiện server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@jwt_required()
+def upload_with_caption_stream():
+    """
+    API tải lên ảnh và trả về caption dần dần qua server-sent events (text/event-stream)
+    - event "start": {stream_id, id} - id của ảnh đã lưu, stream_id dùng để hủy
+    - event "partial": {caption} - caption tạm thời trong lúc giải mã
+    - event "done": {id, description, preset, num_beams, max_length} - caption hoàn chỉnh, đã lưu vào mô tả của ảnh;
+      preset là "custom" khi num_beams gửi kèm khác preset
+    - event "error": {error}
+    Client ngắt kết nối hoặc gọi POST /stream/<stream_id>/cancel để dừng giải mã trên server.
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        if 'image' not in request.files:
+            return jsonify({"error": "Không tìm thấy file ảnh trong request"}), 400
+            
+        image_file = request.files['image']
+        
+        if image_file.filename == '':
+            return jsonify({"error": "Không có file nào được chọn"}), 400
+        
+        if not allowed_file(image_file.filename):
+            return jsonify({"error": "Định dạng file không được hỗ trợ"}), 400
+        
+        location = request.form.get('location')
+        if not location:
+            location = 'Không rõ'
+        
+        # Lấy tên file gốc nếu client gửi lên, nếu không thì lấy tên file upload
+        original_filename = request.form.get('original_filename')
+        if original_filename:
+            img_name = os.path.basename(original_filename)
+        else:
+            img_name = os.path.basename(image_file.filename)
+        
+        image = ImageService.upload_image(
+            file=image_file,
+            description="",
+            user_id=user_id,
+            location=location,
+            original_file_name=img_name
+        )
+        
+        model_type = request.form.get('model_type', 'default')
+        if model_type not in ImageCaptionService.available_model_types():
+            model_type = 'default'
+        
+        language = request.form.get('language', 'en')
+        if language not in ['en', 'vi']:
+            language = 'en'
+        
+        # Preset "fast" (greedy) mặc định để token đầu tiên xuất hiện sớm nhất; num_beams gửi kèm vẫn được ưu tiên
+        preset, latency_budget_ms = _decoding_options(request.form)
+        decoding = DecodingPresetService.resolve(model_type, preset or "fast", latency_budget_ms)
+        num_beams = decoding["num_beams"]
+        if request.form.get('num_beams'):
+            try:
+                num_beams = int(request.form['num_beams'])
+            except ValueError:
+                pass
+        num_beams = ImageCaptionService.stream_num_beams(num_beams)
+        # num_beams gửi kèm (hoặc giới hạn beam khi stream) khác preset: báo "custom" cùng tham số thực tế
+        preset_used = decoding["preset"] if num_beams == decoding["num_beams"] else "custom"
+        
+        stream_id, cancel_event = ImageCaptionService.open_stream(user_id)
+        image_id = str(image.id)
+        
+        def generate():
+            try:
+                yield _sse("start", {"stream_id": stream_id, "id": image_id, "location": image.location})
+                events = ImageCaptionService.stream_caption(
+                    image.get_image_data(), max_length=decoding["max_length"], num_beams=num_beams, model_type=model_type,
+                    language=language, cancel_event=cancel_event, image_hash=image.image_hash
+                )
+                for event in events:
+                    if event["type"] == "ping":
+                        yield ": ping\n\n"
+                    elif event["type"] == "partial":
+                        yield _sse("partial", {"caption": event["caption"]})
+                    else:
+                        caption = event["caption"]
+                        ImageService.update_image(image_id, user_id, caption)
+                        TTSService.prefetch(caption, language)
+                        yield _sse("done", {
+                            "success": True,
+                            "id": image_id,
+                            "description": caption,
+                            "location": image.location,
+                            "preset": preset_used,
+                            "num_beams": num_beams,
+                            "max_length": decoding["max_length"],
+                            "audio_url": TTSService.audio_url(image_id, caption, language)
+                        })
+                if cancel_event.is_set():
+                    print(f"Stream caption {stream_id} đã bị hủy")
+            except Exception as e:
+                print(f"Lỗi khi stream caption: {e}")
+                yield _sse("error", {"error": "Lỗi máy chủ nội bộ"})
+            finally:
+                cancel_event.set()
+                ImageCaptionService.close_stream(stream_id)
+        
+        return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Tắt buffer của nginx để sự kiện tới client ngay
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+        
+    except Exception as e:
+        print(f"Lỗi không mong đợi: {e}")
+        return jsonify({"error": "Lỗi máy chủ nội bộ"}), 500
+
+@jwt_required()
+def cancel_caption_stream(stream_id):
+    """API hủy một phiên stream caption đang chạy (dừng giải mã trên server)"""
+    user_id = get_jwt_identity()
+    if not ImageCaptionService.cancel_stream(stream_id, user_id):
+        return jsonify({"error": "Không tìm thấy phiên stream"}), 404
+    return jsonify({"success": True}), 200
+
+@jwt_required()
+def get_caption_job(job_id):
+    """
+    API để client kiểm tra trạng thái job tạo caption bất đồng bộ
+    Trạng thái: queued, running, done (kèm description) hoặc failed (kèm error)
+    """
+    try:
+        user_id = get_jwt_identity()
+        job = CaptionJobService.get_job(job_id)
+        
+        if not job:
+            return jsonify({"error": "Không tìm thấy job"}), 404
+            
+        # Chỉ chủ sở hữu ảnh hoặc admin được xem job
+        if not job.user or str(job.user.id) != user_id:
+            user = User.objects(id=user_id).first()
+            if not user or user.role != 'admin':
+                return jsonify({"error": "Không có quyền truy cập job này"}), 403
+        
+        return jsonify(CaptionJobService.to_dict(job)), 200
+        
+    except Exception as e:
+        print(f"Lỗi không mong đợi: {e}")
+        return jsonify({"error": "Lỗi máy chủ nội bộ"}), 500
+
+@jwt_required()
+def get_caption_batch(batch_id):
+    """
+    API để client theo dõi một batch upload chạy nền: số job theo trạng thái và trạng thái từng ảnh
+    """
+    try:
+        user_id = get_jwt_identity()
+        jobs = CaptionJobService.get_batch_jobs(batch_id)
+        
+        if not jobs:
+            return jsonify({"error": "Không tìm thấy batch"}), 404
+        
+        # Chỉ người upload hoặc admin được xem batch
+        if not jobs[0].user or str(jobs[0].user.id) != user_id:
+            user = User.objects(id=user_id).first()
+            if not user or user.role != 'admin':
+                return jsonify({"error": "Không có quyền truy cập batch này"}), 403
+        
+        return jsonify(CaptionJobService.batch_to_dict(batch_id, jobs)), 200
+        
+    except Exception as e:
+        print(f"Lỗi không mong đợi: {e}")
+        return jsonify({"error": "Lỗi máy chủ nội bộ"}), 500
+
+def get_caption_audio(image_id):
+    """
+    API trả về audio đọc caption hiện tại của ảnh (client tự phát, server không phát âm thanh)
+    - lang: Ngôn ngữ đọc ("en" hoặc "vi", mặc định đoán theo caption)
+    - v: Khóa nội dung trong audio_url; nếu khớp caption hiện tại, audio được cache vĩnh viễn ở client
+    Audio được tạo một lần cho mỗi (caption, ngôn ngữ) và dùng lại từ cache TTS.
+    Request không có JWT (vd: thẻ <audio> phát audio_url) chỉ nhận audio đã có trong cache; tạo audio mới cần đăng nhập.
+    """
+    # Token sai/hết hạn vẫn bị từ chối bởi flask_jwt_extended như các API khác
+    verify_jwt_in_request(optional=True)
+    can_synthesize = get_jwt_identity() is not None
+    try:
+        image = ImageService.get_image_by_id(image_id)
+        if not image:
+            return jsonify({"error": "Không tìm thấy ảnh"}), 404
+        if not image.description:
+            return jsonify({"error": "Ảnh chưa có mô tả"}), 404
+        
+        try:
+            audio = TTSService.get_audio(image.description, request.args.get('lang'), synthesize=can_synthesize)
+        except LookupError:
+            return jsonify({"error": "Audio chưa được tạo, cần đăng nhập để tạo audio"}), 401
+        
+        response = send_file(audio["path"], mimetype=audio["mimetype"])
+        response.set_etag(audio["key"])
+        # Chỉ khóa đúng như TTSService.audio_url tạo ra mới được cache vĩnh viễn
+        if request.args.get('v') == audio["key"][:16]:
+            # URL có khóa nội dung: caption đổi thì URL cũng đổi
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            # URL không có khóa: client phải hỏi lại server (ETag) vì caption có thể đã được sửa
+            response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+        
+    except Exception as e:
+        print(f"Lỗi khi tạo audio: {e}")
+        return jsonify({"error": "Không thể tạo audio"}), 503
+
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     return '.' in filename and \
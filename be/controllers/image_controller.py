@@ -42,21 +42,14 @@ def get_all_images():
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
     
-    images = ImageService.get_all_images(page, per_page)
+    try:
+        images = ImageService.get_all_images(page, per_page, cursor=request.args.get('cursor'), total=request.args.get('total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'images': [
-            {
-                'id': str(img.id),
-                'description': img.description,
-                'url': f"/api/images/file/{str(img.id)}",
-                'created_at': img.created_at.isoformat() if hasattr(img, 'created_at') else None,
-                'location': img.location if hasattr(img, 'location') else None
-            } for img in images.items
-        ],
-        'total': images.total,
-        'pages': images.pages,
-        'page': images.page
+        'images': [ImageService.to_summary(img) for img in images.items],
+        **images.meta()
     }), 200
 
 @jwt_required()
@@ -65,21 +58,14 @@ def get_user_images():
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
     
-    images = ImageService.get_user_images(user_id, page, per_page)
+    try:
+        images = ImageService.get_user_images(user_id, page, per_page, cursor=request.args.get('cursor'), total=request.args.get('total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'images': [
-            {
-                'id': str(img.id),
-                'description': img.description,
-                'url': f"/api/images/file/{str(img.id)}",
-                'created_at': img.created_at.isoformat() if hasattr(img, 'created_at') else None,
-                'location': img.location if hasattr(img, 'location') else None
-            } for img in images.items
-        ],
-        'total': images.total,
-        'pages': images.pages,
-        'page': images.page
+        'images': [ImageService.to_summary(img) for img in images.items],
+        **images.meta()
     }), 200
 
 @jwt_required()
@@ -151,7 +137,11 @@ def get_reports():
         per_page = int(request.args.get('per_page', 20))
         status = request.args.get('status')
         
-        reports = ImageService.get_reports(page, per_page, status)
+        try:
+            reports = ImageService.get_reports(page, per_page, status, cursor=request.args.get('cursor'), total=request.args.get('total'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        reporters = ImageService.get_users_by_id([report.reported_by for report in reports.items], 'username')
         
         return jsonify({
             'reports': [
@@ -160,15 +150,13 @@ def get_reports():
                     'image_id': str(report.image.id),
                     'image_url': f"/api/images/file/{str(report.image.id)}",
                     'reported_by': str(report.reported_by.id),
-                    'reporter_name': f"{report.reported_by.first_name} {report.reported_by.last_name}" if hasattr(report.reported_by, 'first_name') else report.reported_by.username,
+                    'reporter_name': getattr(reporters.get(report.reported_by.id), 'username', None),
                     'reason': report.reason,
                     'status': report.status,
                     'created_at': report.created_at.isoformat()
                 } for report in reports.items
             ],
-            'total': reports.total,
-            'pages': reports.pages,
-            'page': reports.page
+            **reports.meta()
         }), 200
         
     except Exception as e:
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify
 from models.image import Image
+from services.image_service import ImageService
 from mongoengine.queryset.visitor import Q
 
 location_bp = Blueprint('location', __name__)
@@ -46,16 +47,13 @@ def get_images_by_location(location_id):
         selected_location = locations[int(location_id)]
         
         # Lấy tất cả ảnh có địa điểm tương ứng
-        images = Image.objects(location=selected_location)
+        images = ImageService.get_images_by_location(selected_location)
         
         # Chuyển đổi kết quả thành danh sách
         image_list = [
             {
-                'id': str(img.id),
-                'url': img.url,
-                'caption': img.caption,
-                'location': img.location,
-                'created_at': img.created_at.isoformat()
+                **ImageService.to_summary(img),
+                'caption': img.description
             }
             for img in images
         ]
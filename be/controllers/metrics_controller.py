@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from services.metrics_service import MetricsService
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Số liệu vận hành của tiến trình theo định dạng văn bản của Prometheus"""
+    return Response(MetricsService.render(), mimetype=None, content_type=MetricsService.registry.CONTENT_TYPE)
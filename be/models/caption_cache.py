@@ -0,0 +1,20 @@
+from database.set_up import db
+import datetime
+
+class CaptionCacheEntry(db.Document):
+    key = db.StringField(required=True, unique=True)  # Hash của ảnh + tham số giải mã + phiên bản mô hình
+    caption = db.StringField(required=True)
+    model_type = db.StringField(required=True)
+    model_version = db.StringField(required=True)  # Dấu vân tay của mô hình trên đĩa
+    language = db.StringField()
+    hits = db.IntField(default=0)
+    created_at = db.DateTimeField(default=datetime.datetime.now)
+    last_hit_at = db.DateTimeField()
+
+    meta = {
+        'collection': 'caption_cache',
+        'indexes': [
+            {'fields': ['key'], 'unique': True},
+            {'fields': ['model_type', 'model_version']}
+        ]
+    }
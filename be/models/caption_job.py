@@ -0,0 +1,35 @@
+# models/caption_job.py
+from database.set_up import db
+import datetime
+
+class CaptionJob(db.Document):
+    image = db.ReferenceField('Image', required=True)
+    user = db.ReferenceField('User')
+    batch_id = db.StringField()  # Các job của cùng một lần upload nhiều ảnh
+    model_type = db.StringField(default="default")
+    language = db.StringField(default="en")
+    preset = db.StringField()  # Preset giải mã được yêu cầu (None = mặc định)
+    latency_budget_ms = db.FloatField()
+    preset_used = db.StringField()  # Preset thực tế sau khi áp dụng ngân sách độ trễ
+    status = db.StringField(default="queued", choices=["queued", "running", "done", "failed"])
+    caption = db.StringField()
+    error = db.StringField()
+    attempts = db.IntField(default=0)
+    worker = db.StringField()  # Tiến trình/thread đang xử lý job
+    claim_token = db.StringField()  # Đổi ở mỗi lần nhận job; chỉ lần nhận hiện tại được gia hạn lease và ghi kết quả
+    lease_expires_at = db.DateTimeField()  # Hết hạn thì job "running" được coi là bị bỏ dở và được xử lý lại
+    created_at = db.DateTimeField(default=datetime.datetime.now)
+    started_at = db.DateTimeField()
+    finished_at = db.DateTimeField()
+    queue_seconds = db.FloatField()  # Thời gian chờ trong hàng đợi
+    run_seconds = db.FloatField()  # Thời gian xử lý
+
+    meta = {
+        'collection': 'caption_jobs',
+        'indexes': [
+            {'fields': ['status', 'created_at']},
+            {'fields': ['image']},
+            {'fields': ['user']},
+            {'fields': ['batch_id']}
+        ]
+    }
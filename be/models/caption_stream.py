@@ -0,0 +1,18 @@
+# models/caption_stream.py
+from database.set_up import db
+import datetime
+
+class CaptionStream(db.Document):
+    stream_id = db.StringField(required=True, unique=True)
+    user_id = db.StringField(required=True)  # Chỉ chủ phiên được hủy
+    cancelled = db.BooleanField(default=False)  # Cờ hủy dùng chung: worker đang stream đọc định kỳ
+    created_at = db.DateTimeField(default=datetime.datetime.now)
+
+    meta = {
+        'collection': 'caption_streams',
+        'indexes': [
+            {'fields': ['stream_id'], 'unique': True},
+            # Phiên của worker bị dừng đột ngột (không kịp xóa) tự hết hạn sau một ngày
+            {'fields': ['created_at'], 'expireAfterSeconds': 86400}
+        ]
+    }
@@ -7,7 +7,10 @@ class Image(db.Document):
     file_name = db.StringField(required=True)  # Tên file hệ thống đặt
     original_file_name = db.StringField()  # Tên file gốc khi upload
     content_type = db.StringField(required=True)  # Loại MIME của file
-    image_data = db.BinaryField(required=True)  # Dữ liệu nhị phân của ảnh
+    image_data = db.BinaryField()  # Dữ liệu nhị phân của ảnh (chỉ có ở ảnh cũ chưa chạy tools.migrate_blobs)
+    image_hash = db.StringField()  # SHA-256 của nội dung ảnh, khóa của ImageBlob (tham chiếu tới dữ liệu ảnh)
+    perceptual_hash = db.StringField()  # pHash 64 bit (hex) để tìm ảnh gần trùng
+    phash_at = db.DateTimeField()  # Thời điểm pHash được ghi (ngay trước khi lưu/backfill), để worker khác đọc thêm vào chỉ mục
     uploaded_by = db.ReferenceField('User')
     created_at = db.DateTimeField(default=datetime.datetime.now)
     location = db.StringField()  # Lưu tên địa điểm
@@ -15,7 +18,25 @@ class Image(db.Document):
     meta = {
         'collection': 'images',
         'indexes': [
-            {'fields': ['uploaded_by']},
-            {'fields': ['created_at']}
+            # Khớp thứ tự (created_at, _id) giảm dần của phân trang theo cursor
+            {'fields': ['uploaded_by', '-created_at', '-id']},
+            {'fields': ['-created_at', '-id']},
+            {'fields': ['image_hash']},
+            {'fields': ['phash_at']}
         ]
-    }
\ No newline at end of file
+    }
+
+    def get_image_data(self):
+        """Dữ liệu nhị phân của ảnh: lấy từ blob storage dùng chung, hoặc từ image_data với ảnh cũ"""
+        if self.image_data:
+            return self.image_data
+        data = getattr(self, '_blob_data', None)
+        if data is None and self.image_hash:
+            from services.image_blob_service import ImageBlobService
+            data = ImageBlobService.read(self.image_hash)
+        if data is None and self.pk is not None:
+            # Ảnh cũ được nạp bằng projection không có image_data
+            legacy = Image.objects(id=self.pk, image_data__exists=True).only('image_data').first()
+            data = legacy.image_data if legacy else None
+        self._blob_data = data
+        return data
@@ -0,0 +1,22 @@
+# models/image_blob.py
+from database.set_up import db
+import datetime
+
+class ImageBlob(db.Document):
+    """Thông tin dữ liệu ảnh dùng chung cho mọi bản ghi Image có cùng nội dung; dữ liệu nằm ở backend storage"""
+    sha256 = db.StringField(primary_key=True)  # SHA-256 của nội dung ảnh (hex), cũng là khóa chính
+    storage = db.StringField(default="mongo")  # Backend chứa dữ liệu: mongo (trường data), gridfs hoặc local
+    data = db.BinaryField()  # Chỉ dùng với storage="mongo"
+    size = db.IntField(default=0)
+    content_type = db.StringField()
+    ref_count = db.IntField(default=0)  # Số bản ghi Image đang dùng blob này
+    state = db.StringField()  # "deleting": đang xóa dữ liệu (tombstone), upload cùng nội dung phải chờ xóa xong
+    deleting_at = db.DateTimeField()
+    created_at = db.DateTimeField(default=datetime.datetime.now)
+
+    meta = {
+        'collection': 'image_blobs',
+        'indexes': [
+            {'fields': ['storage']}
+        ]
+    }
@@ -13,7 +13,8 @@ class Report(db.Document):
         'collection': 'reports',
         'indexes': [
             {'fields': ['image']},
-            {'fields': ['status']},
-            {'fields': ['created_at']}
+            # Khớp thứ tự (created_at, _id) giảm dần của phân trang theo cursor, có/không lọc theo status
+            {'fields': ['status', '-created_at', '-id']},
+            {'fields': ['-created_at', '-id']}
         ]
     }
@@ -20,6 +20,10 @@ class User(Document):
         'indexes': [
             {'fields': ['username'], 'unique': True},
             {'fields': ['email'], 'unique': True},
-            {'fields': ['reset_password_token']}
+            {'fields': ['reset_password_token']},
+            # Khớp thứ tự (created_at, _id) giảm dần của phân trang theo cursor, có/không lọc theo role/is_active
+            {'fields': ['-created_at', '-id']},
+            {'fields': ['role', '-created_at', '-id']},
+            {'fields': ['is_active', '-created_at', '-id']}
         ]
     }
@@ -3,7 +3,8 @@ from flask import Blueprint
 from controllers.admin_controller import (
     get_all_users, update_user, delete_user, get_all_images, 
     admin_delete_image, get_reports, update_report, get_stats,
-    toggle_user_status, change_user_role
+    toggle_user_status, change_user_role, get_caption_stats, rebuild_near_duplicate_index,
+    prune_caption_cache
 )
 
 admin_routes = Blueprint('admin_routes', __name__)
@@ -20,3 +21,6 @@ admin_routes.route('/reports', methods=['GET'])(get_reports)
 admin_routes.route('/reports/<report_id>', methods=['PUT'])(update_report)
 
 admin_routes.route('/stats', methods=['GET'])(get_stats)
+admin_routes.route('/caption-stats', methods=['GET'])(get_caption_stats)
+admin_routes.route('/near-duplicates/rebuild', methods=['POST'])(rebuild_near_duplicate_index)
+admin_routes.route('/caption-cache/prune', methods=['POST'])(prune_caption_cache)
@@ -1,9 +1,16 @@
 # routes/image_caption_routes.py
 from flask import Blueprint
-from controllers.image_caption_controller import upload_with_caption, update_caption, regenerate_caption
+from controllers.image_caption_controller import upload_with_caption, update_caption, regenerate_caption, get_caption_job, \
+    upload_with_caption_stream, cancel_caption_stream, get_caption_audio, upload_batch_with_caption, get_caption_batch
 
 image_caption_routes = Blueprint('image_caption_routes', __name__)
 
 image_caption_routes.route('/upload', methods=['POST'])(upload_with_caption)
 image_caption_routes.route('/caption/<image_id>', methods=['PUT'])(update_caption)
 image_caption_routes.route('/<image_id>/regenerate', methods=['POST'])(regenerate_caption)
+image_caption_routes.route('/jobs/<job_id>', methods=['GET'])(get_caption_job)
+image_caption_routes.route('/upload/batch', methods=['POST'])(upload_batch_with_caption)
+image_caption_routes.route('/jobs/batch/<batch_id>', methods=['GET'])(get_caption_batch)
+image_caption_routes.route('/upload/stream', methods=['POST'])(upload_with_caption_stream)
+image_caption_routes.route('/stream/<stream_id>/cancel', methods=['POST'])(cancel_caption_stream)
+image_caption_routes.route('/<image_id>/audio', methods=['GET'])(get_caption_audio)
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+
+class BackgroundQueueFull(RuntimeError):
+    """Tác vụ nền bị từ chối hoặc bị bỏ vì hàng đợi đã đầy"""
+
+
+class BackgroundExecutor:
+    """
+    Bộ thực thi tác vụ nền dùng chung cho các việc "chạy rồi quên" (tạo audio, tính BLEU, ghi cache):
+    - Số thread cố định (max_workers) và hàng đợi có giới hạn (max_queue) nên một đợt upload dồn dập
+      không thể tạo ra vô số thread hay chiếm hết bộ nhớ.
+    - Khi hàng đợi đầy: chính sách "drop_oldest" bỏ tác vụ cũ nhất đang chờ, "reject" từ chối tác vụ mới.
+      Tác vụ bị bỏ/từ chối nhận lỗi BackgroundQueueFull trong Future của nó.
+    - Lỗi của tác vụ được đặt vào Future, ghi ra log kèm tên tác vụ và gọi on_error nếu có.
+    - Thống kê độ sâu hàng đợi, số tác vụ đang chạy, hoàn thành, lỗi, bị bỏ và bị từ chối.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    REJECT = "reject"
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_workers=4, max_queue=1000, policy=DROP_OLDEST, name="background"):
+        """
+        Tham số:
+            max_workers: Số thread xử lý tác vụ tối đa
+            max_queue: Số tác vụ chờ tối đa trong hàng đợi
+            policy: "drop_oldest" hoặc "reject" khi hàng đợi đầy
+            name: Tên bộ thực thi (dùng cho tên thread và thống kê)
+        """
+        if policy not in (self.DROP_OLDEST, self.REJECT):
+            raise ValueError(f"Chính sách hàng đợi không hợp lệ: {policy}")
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(1, int(max_queue))
+        self.policy = policy
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._queue = deque()  # (name, fn, args, kwargs, future, on_error, enqueued_at)
+        self._workers = []
+        self._idle = 0
+        self._running = 0
+        self._shutdown = False
+
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "rejected": 0,
+            "peak_queue_depth": 0
+        }
+        self._by_name = {}
+        self._recent_errors = deque(maxlen=20)
+        self._queue_waits = deque(maxlen=1000)
+
+    @classmethod
+    def shared(cls):
+        """Bộ thực thi dùng chung của ứng dụng, cấu hình qua biến môi trường CAPTION_BACKGROUND_*"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(
+                        max_workers=int(os.getenv("CAPTION_BACKGROUND_WORKERS", "4")),
+                        max_queue=int(os.getenv("CAPTION_BACKGROUND_QUEUE_SIZE", "1000")),
+                        policy=os.getenv("CAPTION_BACKGROUND_POLICY", cls.DROP_OLDEST)
+                    )
+        return cls._shared
+
+    def submit(self, fn, *args, name=None, on_error=None, **kwargs):
+        """
+        Đưa một tác vụ vào hàng đợi, trả về Future (không bao giờ chặn người gọi).
+
+        Tham số:
+            fn: Hàm cần chạy với *args, **kwargs
+            name: Tên tác vụ dùng trong log và thống kê (mặc định là tên hàm)
+            on_error: Hàm on_error(exception) được gọi khi tác vụ lỗi, bị bỏ hoặc bị từ chối
+        """
+        name = name or getattr(fn, "__name__", "task")
+        future = Future()
+        dropped = None
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError(f"Bộ thực thi {self.name} đã dừng")
+            self._stats["submitted"] += 1
+            self._count(name, "submitted")
+
+            if len(self._queue) >= self.max_queue:
+                if self.policy == self.REJECT:
+                    self._stats["rejected"] += 1
+                    self._count(name, "rejected")
+                    dropped = (name, future, on_error, "bị từ chối")
+                else:
+                    oldest = self._queue.popleft()
+                    self._stats["dropped"] += 1
+                    self._count(oldest[0], "dropped")
+                    dropped = (oldest[0], oldest[4], oldest[5], "bị bỏ")
+
+            if dropped is None or dropped[1] is not future:
+                self._queue.append((name, fn, args, kwargs, future, on_error, time.monotonic()))
+                self._stats["peak_queue_depth"] = max(self._stats["peak_queue_depth"], len(self._queue))
+                self._ensure_worker()
+                self._cond.notify()
+
+        if dropped is not None:
+            dropped_name, dropped_future, dropped_on_error, reason = dropped
+            error = BackgroundQueueFull(f"Tác vụ nền {dropped_name} {reason} vì hàng đợi {self.name} đã đầy ({self.max_queue})")
+            print(error)
+            self._fail(dropped_future, dropped_on_error, error)
+        return future
+
+    def _count(self, name, field):
+        counts = self._by_name.setdefault(name, {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0, "rejected": 0})
+        counts[field] += 1
+
+    def _ensure_worker(self):
+        """
+        Tạo thêm thread khi số tác vụ đang chờ nhiều hơn số thread rảnh và chưa đạt max_workers (gọi khi đang giữ _cond).
+        Thread rảnh vừa được đánh thức vẫn được tính là rảnh cho tới khi lấy tác vụ, nên không thể chỉ so _idle với 0.
+        """
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        if len(self._queue) > self._idle and len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"{self.name}-{len(self._workers)}",
+                daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    @staticmethod
+    def _fail(future, on_error, error):
+        if future.set_running_or_notify_cancel():
+            future.set_exception(error)
+        if on_error is not None:
+            try:
+                on_error(error)
+            except Exception as e:
+                print(f"Lỗi trong on_error của tác vụ nền: {e}")
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                self._idle -= 1
+                if not self._queue:
+                    return
+                name, fn, args, kwargs, future, on_error, enqueued_at = self._queue.popleft()
+                self._running += 1
+                self._queue_waits.append(time.monotonic() - enqueued_at)
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"Lỗi trong tác vụ nền {name}: {e}")
+                    with self._cond:
+                        self._stats["failed"] += 1
+                        self._count(name, "failed")
+                        self._recent_errors.append({
+                            "task": name,
+                            "error": str(e),
+                            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "traceback": traceback.format_exc(limit=5)
+                        })
+                    future.set_exception(e)
+                    if on_error is not None:
+                        try:
+                            on_error(e)
+                        except Exception as callback_error:
+                            print(f"Lỗi trong on_error của tác vụ nền {name}: {callback_error}")
+                else:
+                    with self._cond:
+                        self._stats["completed"] += 1
+                        self._count(name, "completed")
+                    future.set_result(result)
+
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def wait_idle(self, timeout=None):
+        """Chờ đến khi hàng đợi rỗng và không còn tác vụ đang chạy; trả về False nếu hết thời gian"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True, timeout=None):
+        """Dừng nhận tác vụ mới; các tác vụ đang chờ vẫn được chạy hết"""
+        if wait:
+            self.wait_idle(timeout)
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            waits = sorted(self._queue_waits)
+            return {
+                "name": self.name,
+                "policy": self.policy,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "workers": len([worker for worker in self._workers if worker.is_alive()]),
+                "queue_depth": len(self._queue),
+                "running": self._running,
+                **self._stats,
+                "queue_wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 2) if waits else 0.0,
+                "tasks": {name: dict(counts) for name, counts in self._by_name.items()},
+                "recent_errors": [{key: value for key, value in error.items() if key != "traceback"} for error in self._recent_errors]
+            }
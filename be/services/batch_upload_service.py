@@ -0,0 +1,112 @@
+# services/batch_upload_service.py
+import mimetypes
+import os
+import zipfile
+from werkzeug.datastructures import FileStorage
+from services.image_service import ImageService
+
+
+class BatchUploadService:
+    """
+    Nhận nhiều ảnh trong một request (nhiều file và/hoặc tệp zip) và lưu lần lượt từng ảnh:
+    - File trong zip được đọc thẳng từ tệp zip (không giải nén ra đĩa), bỏ qua thư mục, file ẩn và định dạng không hỗ trợ.
+    - Mỗi ảnh được lưu ngay khi đọc xong; lỗi của một file không làm hỏng cả batch.
+    - Mỗi file (trong zip hay gửi trực tiếp) không được vượt quá CAPTION_BATCH_UPLOAD_MAX_FILE_MB.
+    """
+
+    _max_files = int(os.getenv("CAPTION_BATCH_UPLOAD_MAX_FILES", "200"))
+    _max_file_bytes = int(float(os.getenv("CAPTION_BATCH_UPLOAD_MAX_FILE_MB", "20")) * 1024 * 1024)
+
+    @staticmethod
+    def _stream_size(stream):
+        """Kích thước còn lại của stream upload (không đọc dữ liệu), None nếu stream không seek được"""
+        try:
+            position = stream.tell()
+            size = stream.seek(0, os.SEEK_END) - position
+            stream.seek(position)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return size
+
+    @classmethod
+    def iter_files(cls, files, archives, is_allowed):
+        """
+        Duyệt các ảnh trong request theo thứ tự gửi lên, trả về (tên file, FileStorage hoặc None, lỗi hoặc None).
+        is_allowed(filename) quyết định định dạng được chấp nhận.
+        """
+        for file in files:
+            if not file or file.filename == '':
+                continue
+            if not is_allowed(file.filename):
+                yield os.path.basename(file.filename), None, "Định dạng file không được hỗ trợ"
+                continue
+            size = cls._stream_size(file.stream)
+            if size is not None and size > cls._max_file_bytes:
+                yield os.path.basename(file.filename), None, "File vượt quá dung lượng cho phép"
+                continue
+            yield os.path.basename(file.filename), file, None
+
+        for archive in archives:
+            if not archive or archive.filename == '':
+                continue
+            try:
+                zip_file = zipfile.ZipFile(archive.stream)
+            except zipfile.BadZipFile:
+                yield os.path.basename(archive.filename), None, "Tệp zip không hợp lệ"
+                continue
+            with zip_file:
+                for info in zip_file.infolist():
+                    name = os.path.basename(info.filename)
+                    # Bỏ qua thư mục và file ẩn/siêu dữ liệu (vd: __MACOSX/._IMG_0001.jpg)
+                    if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                        continue
+                    if not is_allowed(name):
+                        continue
+                    if info.file_size > cls._max_file_bytes:
+                        yield name, None, "File vượt quá dung lượng cho phép"
+                        continue
+                    try:
+                        # File mã hóa (RuntimeError) hoặc nén theo phương thức không hỗ trợ (NotImplementedError)
+                        stream = zip_file.open(info)
+                    except (RuntimeError, NotImplementedError, zipfile.BadZipFile, OSError) as e:
+                        print(f"Không thể đọc {info.filename} trong {archive.filename}: {e}")
+                        yield name, None, "Không thể đọc file trong tệp zip"
+                        continue
+                    with stream:
+                        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                        yield name, FileStorage(stream=stream, filename=name, content_type=content_type), None
+
+    @classmethod
+    def upload_files(cls, files, archives, user_id, is_allowed, location=None, keep_first=None):
+        """
+        Lưu các ảnh trong request. Trả về (images, results):
+        - images: các Image đã lưu, theo thứ tự
+        - results: kết quả cho từng file theo thứ tự gửi lên, {"file_name", "id"} hoặc {"file_name", "error"}
+        keep_first=N chỉ giữ dữ liệu của N ảnh đầu tiên trong bộ nhớ để tạo caption ngay (None: giữ tất cả);
+        các ảnh còn lại bỏ dữ liệu ngay sau khi lưu, caption được tạo bởi job nền từ blob đã lưu.
+        """
+        images = []
+        results = []
+        for name, file, error in cls.iter_files(files, archives, is_allowed):
+            if not error and len(images) >= cls._max_files:
+                error = f"Vượt quá số ảnh tối đa của một batch ({cls._max_files})"
+            if error:
+                results.append({"file_name": name, "error": error})
+                continue
+            try:
+                image = ImageService.upload_image(
+                    file=file,
+                    description="",
+                    user_id=user_id,
+                    location=location,
+                    original_file_name=name
+                )
+            except Exception as e:
+                print(f"Lỗi khi lưu ảnh {name} trong batch: {e}")
+                results.append({"file_name": name, "error": "Không thể lưu ảnh"})
+                continue
+            if keep_first is not None and len(images) >= keep_first:
+                image._blob_data = None
+            images.append(image)
+            results.append({"file_name": name, "id": str(image.id)})
+        return images, results
@@ -0,0 +1,168 @@
+# services/blob_store.py
+import os
+import tempfile
+import threading
+
+try:
+    import gridfs
+    from gridfs.errors import FileExists, NoFile
+except ImportError:  # pymongo luôn kèm gridfs, phòng khi môi trường thiếu
+    gridfs = None
+
+
+class BlobStore:
+    """
+    Nơi lưu dữ liệu nhị phân của ảnh theo khóa nội dung (SHA-256 hex).
+    Khóa là hash của nội dung nên put với khóa đã có là thao tác lặp lại vô hại.
+    """
+
+    name = None
+
+    def put(self, key, data, content_type=None):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Dữ liệu của khóa, None nếu không có"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Khóa đã có dữ liệu hay chưa (không đọc dữ liệu)"""
+        raise NotImplementedError
+
+
+class MongoBlobStore(BlobStore):
+    """Dữ liệu nằm ngay trong trường data của ImageBlob (cách lưu cũ, giới hạn 16 MB mỗi document)"""
+
+    name = "mongo"
+
+    def put(self, key, data, content_type=None):
+        from models.image_blob import ImageBlob
+        ImageBlob.objects(sha256=key).update_one(set__data=data)
+
+    def get(self, key):
+        from models.image_blob import ImageBlob
+        blob = ImageBlob.objects(sha256=key).only('data').first()
+        return bytes(blob.data) if blob and blob.data is not None else None
+
+    def delete(self, key):
+        # Dữ liệu bị xóa cùng document ImageBlob
+        pass
+
+    def exists(self, key):
+        from models.image_blob import ImageBlob
+        return ImageBlob.objects(sha256=key, data__exists=True).count() > 0
+
+
+class GridFSBlobStore(BlobStore):
+    """Dữ liệu được chia thành các chunk trong GridFS (bucket image_files), _id của file là SHA-256"""
+
+    name = "gridfs"
+
+    def __init__(self, collection="image_files"):
+        if gridfs is None:
+            raise RuntimeError("Cần pymongo (gridfs) để dùng IMAGE_BLOB_STORE=gridfs")
+        self._collection = collection
+        self._fs = None
+        self._lock = threading.Lock()
+
+    def _get_fs(self):
+        if self._fs is None:
+            with self._lock:
+                if self._fs is None:
+                    from mongoengine.connection import get_db
+                    self._fs = gridfs.GridFS(get_db(), collection=self._collection)
+        return self._fs
+
+    def put(self, key, data, content_type=None):
+        try:
+            self._get_fs().put(data, _id=key, content_type=content_type)
+        except FileExists:
+            pass
+
+    def get(self, key):
+        try:
+            return self._get_fs().get(key).read()
+        except NoFile:
+            return None
+
+    def delete(self, key):
+        self._get_fs().delete(key)
+
+    def exists(self, key):
+        return self._get_fs().exists(key)
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Dữ liệu là file trên đĩa: <thư mục>/<2 ký tự đầu>/<2 ký tự tiếp>/<sha256>.
+    Ghi vào file tạm rồi đổi tên nên không có file ghi dở. Thư mục phải dùng chung nếu chạy nhiều máy chủ.
+    """
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+
+_current_dir = os.path.dirname(os.path.abspath(__file__))
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(name=None):
+    """
+    Lấy backend lưu dữ liệu ảnh theo tên (mongo, gridfs, local); mặc định theo IMAGE_BLOB_STORE.
+    Mỗi backend chỉ được tạo một lần.
+    """
+    name = name or os.getenv("IMAGE_BLOB_STORE", "gridfs")
+    if name not in _stores:
+        with _stores_lock:
+            if name not in _stores:
+                if name == "mongo":
+                    _stores[name] = MongoBlobStore()
+                elif name == "gridfs":
+                    _stores[name] = GridFSBlobStore()
+                elif name == "local":
+                    root = os.getenv("IMAGE_BLOB_DIR", os.path.join(_current_dir, "..", "storage", "blobs"))
+                    _stores[name] = LocalBlobStore(root)
+                else:
+                    raise ValueError(f"Backend lưu ảnh không hợp lệ: {name}")
+    return _stores[name]
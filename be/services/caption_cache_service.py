@@ -0,0 +1,280 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import datetime
+from collections import OrderedDict
+
+from services.background_executor import BackgroundExecutor
+
+
+class CaptionCacheService:
+    """
+    Bộ nhớ đệm caption theo nội dung ảnh:
+    - Khóa = SHA-256 của dữ liệu ảnh + model_type + max_length + num_beams + language + phiên bản mô hình.
+    - Tầng 1: LRU trong tiến trình, giới hạn theo tổng số byte.
+    - Tầng 2: Collection caption_cache trong MongoDB, dùng chung giữa các worker và giữ lại sau khi khởi động lại.
+    - Khi mô hình trên đĩa thay đổi (phiên bản khác), các mục cũ của mô hình đó trong bộ nhớ bị xóa;
+      các mục cũ trong MongoDB được admin dọn (prune) vì collection dùng chung giữa nhiều máy chủ.
+    """
+
+    _memory_budget = int(os.getenv("CAPTION_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+    _persistent_enabled = os.getenv("CAPTION_CACHE_PERSISTENT", "1") != "0"
+    _enabled = os.getenv("CAPTION_CACHE", "1") != "0"
+    _version_check_interval = float(os.getenv("CAPTION_CACHE_VERSION_CHECK_SECONDS", "30"))
+    _entry_overhead = 128  # Ước lượng chi phí bộ nhớ của mỗi mục ngoài key và caption
+
+    _lock = threading.Lock()
+    _memory = OrderedDict()  # key -> (caption, model_type, size)
+    _memory_bytes = 0
+
+    _model_versions = {}  # model_type -> (version, checked_at)
+    _file_digests = {}  # (đường dẫn, kích thước, mtime) -> digest nội dung của file mô hình
+    _full_hash_max_bytes = 16 * 1024 * 1024
+    _sample_bytes = 1024 * 1024
+    _sample_count = 8
+
+    _stats = {
+        "memory_hits": 0,
+        "persistent_hits": 0,
+        "misses": 0,
+        "writes": 0,
+        "evictions": 0,
+        "invalidations": 0,
+        "errors": 0
+    }
+
+    @staticmethod
+    def hash_image(image_data):
+        """SHA-256 của dữ liệu nhị phân ảnh"""
+        return hashlib.sha256(image_data).hexdigest()
+
+    @staticmethod
+    def make_key(image_hash, model_type, max_length, num_beams, language, model_version):
+        """Tạo khóa cache từ hash ảnh và các tham số ảnh hưởng tới caption"""
+        raw = f"{image_hash}|{model_type}|{int(max_length)}|{int(num_beams)}|{language}|{model_version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def fingerprint_model_dir(cls, model_path):
+        """
+        Dấu vân tay của thư mục mô hình theo nội dung: tên, kích thước và digest của các file.
+        File nhỏ (config, tokenizer) được hash toàn bộ; file trọng số lớn được hash theo các đoạn rải đều trong file.
+        Không dùng thời gian sửa đổi nên cùng một mô hình chép sang máy khác (hoặc deploy lại) vẫn cho cùng dấu vân tay.
+        Chỉ xét các file ở cấp trên cùng (trọng số, config, tokenizer); thư mục con chứa artifact phát sinh bị bỏ qua.
+        """
+        if not model_path or not os.path.isdir(model_path):
+            return f"remote:{model_path}"
+
+        digest = hashlib.sha1()
+        for name in sorted(os.listdir(model_path)):
+            file_path = os.path.join(model_path, name)
+            if not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            digest.update(f"{name}:{stat.st_size}:{cls._file_digest(file_path, stat)};".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def _file_digest(cls, file_path, stat):
+        """
+        Digest nội dung của một file, được nhớ theo (đường dẫn, kích thước, mtime) trong tiến trình
+        để các lần kiểm tra phiên bản định kỳ chỉ cần stat file.
+        """
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        cached = cls._file_digests.get(memo_key)
+        if cached is not None:
+            return cached
+
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            if stat.st_size <= cls._full_hash_max_bytes:
+                for chunk in iter(lambda: f.read(cls._sample_bytes), b""):
+                    digest.update(chunk)
+            else:
+                # Đọc các đoạn rải đều từ đầu tới cuối file thay vì toàn bộ vài trăm MB trọng số
+                last_offset = stat.st_size - cls._sample_bytes
+                for i in range(cls._sample_count):
+                    f.seek(last_offset * i // (cls._sample_count - 1))
+                    digest.update(f.read(cls._sample_bytes))
+        value = digest.hexdigest()
+        cls._file_digests[memo_key] = value
+        return value
+
+    @classmethod
+    def model_version(cls, model_type, model_path):
+        """
+        Lấy phiên bản hiện tại của mô hình trên đĩa (được kiểm tra lại định kỳ).
+        Nếu phiên bản thay đổi, chỉ tầng LRU của tiến trình bị xóa; các mục MongoDB của phiên bản cũ không còn
+        được tra tới (khóa chứa phiên bản) và được dọn bởi admin (POST /api/admin/caption-cache/prune).
+        """
+        now = time.monotonic()
+        cached = cls._model_versions.get(model_type)
+        if cached and now - cached[1] < cls._version_check_interval:
+            return cached[0]
+
+        version = cls.fingerprint_model_dir(model_path)
+        cls._model_versions[model_type] = (version, now)
+        if cached is not None and cached[0] != version:
+            print(f"Mô hình {model_type} đã thay đổi trên đĩa, xóa cache caption cũ trong bộ nhớ")
+            cls._forget(model_type)
+        return version
+
+    @classmethod
+    def get(cls, key):
+        """Tra cứu caption, trả về None nếu không có trong cache"""
+        if not cls._enabled:
+            return None
+
+        with cls._lock:
+            entry = cls._memory.get(key)
+            if entry is not None:
+                cls._memory.move_to_end(key)
+                cls._stats["memory_hits"] += 1
+                return entry[0]
+
+        if cls._persistent_enabled:
+            try:
+                from models.caption_cache import CaptionCacheEntry
+                doc = CaptionCacheEntry.objects(key=key).first()
+                if doc is not None:
+                    # Bộ đếm lượt dùng chỉ phục vụ thống kê/dọn dẹp nên được ghi ở background
+                    BackgroundExecutor.shared().submit(
+                        cls._record_hit, key, datetime.datetime.now(), name="caption_cache_hit"
+                    )
+                    cls._remember(key, doc.caption, doc.model_type)
+                    with cls._lock:
+                        cls._stats["persistent_hits"] += 1
+                    return doc.caption
+            except Exception as e:
+                print(f"Lỗi khi đọc cache caption từ MongoDB: {e}")
+                with cls._lock:
+                    cls._stats["errors"] += 1
+
+        with cls._lock:
+            cls._stats["misses"] += 1
+        return None
+
+    @classmethod
+    def put(cls, key, caption, model_type, model_version, language=None):
+        """Lưu caption vào cả hai tầng cache"""
+        if not cls._enabled or not caption:
+            return
+
+        cls._remember(key, caption, model_type)
+        with cls._lock:
+            cls._stats["writes"] += 1
+
+        if cls._persistent_enabled:
+            # Ghi MongoDB ở background: tầng LRU đã có caption nên request không cần chờ
+            BackgroundExecutor.shared().submit(
+                cls._persist, key, caption, model_type, model_version, language, name="caption_cache_write"
+            )
+
+    @classmethod
+    def _persist(cls, key, caption, model_type, model_version, language):
+        try:
+            from models.caption_cache import CaptionCacheEntry
+            CaptionCacheEntry.objects(key=key).update_one(
+                set__caption=caption,
+                set__model_type=model_type,
+                set__model_version=model_version,
+                set__language=language,
+                set_on_insert__created_at=datetime.datetime.now(),
+                upsert=True
+            )
+        except Exception:
+            # Lỗi được bộ thực thi tác vụ nền ghi lại
+            with cls._lock:
+                cls._stats["errors"] += 1
+            raise
+
+    @staticmethod
+    def _record_hit(key, hit_at):
+        from models.caption_cache import CaptionCacheEntry
+        CaptionCacheEntry.objects(key=key).update_one(inc__hits=1, set__last_hit_at=hit_at)
+
+    @classmethod
+    def _remember(cls, key, caption, model_type):
+        """Thêm vào tầng LRU trong bộ nhớ và loại bỏ các mục cũ nhất khi vượt ngân sách byte"""
+        size = len(key) + len(caption.encode("utf-8")) + cls._entry_overhead
+        if size > cls._memory_budget:
+            return
+
+        with cls._lock:
+            previous = cls._memory.pop(key, None)
+            if previous is not None:
+                cls._memory_bytes -= previous[2]
+            cls._memory[key] = (caption, model_type, size)
+            cls._memory_bytes += size
+
+            while cls._memory_bytes > cls._memory_budget and cls._memory:
+                _, (_, _, evicted_size) = cls._memory.popitem(last=False)
+                cls._memory_bytes -= evicted_size
+                cls._stats["evictions"] += 1
+
+    @classmethod
+    def invalidate(cls, model_type=None, keep_version=None):
+        """
+        Xóa cache của một mô hình (hoặc toàn bộ nếu model_type là None).
+        Nếu có keep_version, các mục MongoDB thuộc phiên bản đó (so theo tiền tố) được giữ lại.
+        Trả về số mục MongoDB đã xóa. Chỉ gọi từ thao tác của admin, không gọi trong request.
+        """
+        cls._forget(model_type)
+
+        deleted = 0
+        if cls._persistent_enabled:
+            try:
+                from models.caption_cache import CaptionCacheEntry
+                query = {}
+                if model_type is not None:
+                    query["model_type"] = model_type
+                if keep_version is not None:
+                    # Phiên bản được lưu có thêm hậu tố (biến thể suy luận, tiền xử lý) sau dấu vân tay của mô hình
+                    query["model_version"] = {"$not": re.compile(f"^{re.escape(keep_version)}")}
+                deleted = CaptionCacheEntry.objects(__raw__=query).delete()
+            except Exception as e:
+                print(f"Lỗi khi xóa cache caption trong MongoDB: {e}")
+                with cls._lock:
+                    cls._stats["errors"] += 1
+        return deleted
+
+    @classmethod
+    def prune(cls, current_versions):
+        """
+        Xóa các mục MongoDB không thuộc phiên bản hiện tại của mô hình nào (mô hình đã đổi trên đĩa hoặc đã bỏ).
+        current_versions: model_type -> dấu vân tay hiện tại. Trả về số mục đã xóa.
+        """
+        if not cls._persistent_enabled:
+            return 0
+        from models.caption_cache import CaptionCacheEntry
+        current = [
+            {"model_type": model_type, "model_version": re.compile(f"^{re.escape(version)}")}
+            for model_type, version in current_versions.items()
+        ]
+        query = {"$nor": current} if current else {}
+        return CaptionCacheEntry.objects(__raw__=query).delete()
+
+    @classmethod
+    def _forget(cls, model_type=None):
+        """Xóa các mục của một mô hình (hoặc tất cả) khỏi tầng LRU trong bộ nhớ"""
+        with cls._lock:
+            keys = [key for key, entry in cls._memory.items() if model_type is None or entry[1] == model_type]
+            for key in keys:
+                cls._memory_bytes -= cls._memory.pop(key)[2]
+            cls._stats["invalidations"] += 1
+
+    @classmethod
+    def get_stats(cls):
+        """Bộ đếm hit/miss và mức sử dụng bộ nhớ của cache"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["memory_entries"] = len(cls._memory)
+            stats["memory_bytes"] = cls._memory_bytes
+        stats["memory_budget_bytes"] = cls._memory_budget
+        stats["enabled"] = cls._enabled
+        stats["persistent_enabled"] = cls._persistent_enabled
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,313 @@
+# services/caption_job_service.py
+import datetime
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from mongoengine.queryset.visitor import Q
+from models.caption_job import CaptionJob
+from models.user import User
+from services.image_service import ImageService
+from services.image_caption_service import ImageCaptionService
+from services.evaluation_service import EvaluationService
+from services.decoding_preset_service import DecodingPresetService
+from services.tts_service import TTSService
+from services.background_executor import BackgroundExecutor
+
+class CaptionJobService:
+    """
+    Hàng đợi job tạo caption bất đồng bộ, lưu trong collection caption_jobs của MongoDB:
+    - Upload lưu ảnh, tạo job ở trạng thái "queued" và trả về ngay.
+    - Các thread nền nhận job bằng thao tác cập nhật nguyên tử nên nhiều worker/tiến trình không xử lý trùng.
+    - Worker gia hạn lease trong lúc xử lý; job "running" quá thời hạn lease (vd: tiến trình bị khởi động lại)
+      được nhận xử lý lại, tối đa max_attempts lần. Kết quả chỉ được ghi nếu job vẫn thuộc lần nhận của worker.
+    - Job của cùng một batch upload được nhận theo nhóm (tối đa CAPTION_JOB_CLAIM_BATCH job) và chạy đồng thời
+      để bộ gom batch của ImageCaptionService chạy chúng trong cùng một lô suy luận.
+    """
+
+    _worker_count = int(os.getenv("CAPTION_JOB_WORKERS", "2"))
+    _poll_interval = float(os.getenv("CAPTION_JOB_POLL_SECONDS", "2"))
+    _lease_seconds = float(os.getenv("CAPTION_JOB_LEASE_SECONDS", "300"))
+    _max_attempts = int(os.getenv("CAPTION_JOB_MAX_ATTEMPTS", "3"))
+    _claim_batch_size = int(os.getenv("CAPTION_JOB_CLAIM_BATCH", os.getenv("CAPTION_BATCH_MAX_SIZE", "8")))
+
+    _workers = []
+    _workers_lock = threading.Lock()
+    _wakeup = threading.Event()
+
+    @staticmethod
+    def caption_image(image, user_id, model_type="default", language="en", preset=None, latency_budget_ms=None):
+        """
+        Quy trình tạo caption cho ảnh vừa upload, dùng chung cho chế độ đồng bộ và job nền:
+        chọn preset giải mã, tạo caption, ghi BLEU nếu ảnh có trong tập test, tạo sẵn audio ở background
+        và cập nhật mô tả của ảnh.
+
+        Trả về (caption, decoding): decoding là kết quả của DecodingPresetService.resolve
+        """
+        decoding = DecodingPresetService.resolve(model_type, preset, latency_budget_ms)
+        caption = ImageCaptionService.generate_caption_from_binary(
+            image.get_image_data(), max_length=decoding["max_length"], num_beams=decoding["num_beams"],
+            speak=False, model_type=model_type, language=language, image_hash=image.image_hash,
+            perceptual_hash=image.perceptual_hash
+        )
+
+        # Tính BLEU ở background (lỗi được ghi lại bởi bộ thực thi tác vụ nền)
+        BackgroundExecutor.shared().submit(CaptionJobService._log_bleu, image, caption, name="bleu")
+
+        # Tạo sẵn audio đọc caption ở background để client phát qua GET /<image_id>/audio
+        TTSService.prefetch(caption, language)
+
+        # Cập nhật mô tả của ảnh với caption vừa tạo
+        ImageService.update_image(str(image.id), user_id, caption)
+        return caption, decoding
+
+    @staticmethod
+    def _log_bleu(image, caption):
+        """Ghi BLEU-1/2 của caption nếu ảnh có trong tập test (so khớp theo tên file gốc, chạy ở background)"""
+        ref = EvaluationService.find_reference(image.original_file_name, image.file_name)
+        if ref is not None:
+            bleu1, bleu2 = EvaluationService.sentence_bleu_scores(ref, caption)
+            print(f"BLEU-1: {bleu1:.4f} | BLEU-2: {bleu2:.4f}\nRef: {ref}\nHyp: {caption}")
+            ImageCaptionService.log_event(
+                "bleu", image_id=str(image.id), bleu1=round(bleu1, 4), bleu2=round(bleu2, 4), ref=ref, hyp=caption
+            )
+
+    @classmethod
+    def enqueue(cls, image, user_id, model_type="default", language="en", preset=None, latency_budget_ms=None):
+        """Tạo job caption cho ảnh đã lưu, trả về job"""
+        job = CaptionJob(
+            image=image,
+            user=User.objects(id=user_id).first(),
+            model_type=model_type,
+            language=language,
+            preset=preset,
+            latency_budget_ms=latency_budget_ms
+        )
+        job.save()
+        cls.start_workers()
+        cls._wakeup.set()
+        return job
+
+    @classmethod
+    def enqueue_batch(cls, images, user_id, model_type="default", language="en", preset=None, latency_budget_ms=None):
+        """Tạo job caption cho nhiều ảnh trong một lệnh ghi, trả về batch_id"""
+        batch_id = uuid.uuid4().hex
+        user = User.objects(id=user_id).first()
+        jobs = [
+            CaptionJob(
+                image=image,
+                user=user,
+                batch_id=batch_id,
+                model_type=model_type,
+                language=language,
+                preset=preset,
+                latency_budget_ms=latency_budget_ms
+            )
+            for image in images
+        ]
+        if jobs:
+            CaptionJob.objects.insert(jobs, load_bulk=False)
+            cls.start_workers()
+            cls._wakeup.set()
+        return batch_id
+
+    @classmethod
+    def caption_images(cls, images, user_id, model_type="default", language="en", preset=None, latency_budget_ms=None):
+        """
+        Tạo caption đồng bộ cho nhiều ảnh: các ảnh được chạy đồng thời để được gom vào cùng lô suy luận.
+        Trả về danh sách (caption, decoding) hoặc Exception cho từng ảnh, theo thứ tự.
+        """
+        def run(image):
+            try:
+                return cls.caption_image(image, user_id, model_type, language, preset, latency_budget_ms)
+            except Exception as e:
+                print(f"Lỗi khi tạo caption cho ảnh {image.id}: {e}")
+                return e
+
+        if not images:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(images), max(1, cls._claim_batch_size)), thread_name_prefix="caption-batch") as pool:
+            return list(pool.map(run, images))
+
+    @staticmethod
+    def get_job(job_id):
+        """Lấy job theo ID (không nạp ảnh và người dùng được tham chiếu, chỉ cần ID của chúng)"""
+        return CaptionJob.objects(id=job_id).no_dereference().first()
+
+    @staticmethod
+    def get_batch_jobs(batch_id):
+        """Các job của một batch upload, theo thứ tự tạo"""
+        # Không nạp các Image được tham chiếu (chỉ cần ID), tránh một truy vấn cho mỗi job
+        return list(CaptionJob.objects(batch_id=batch_id).no_dereference().order_by("created_at", "id"))
+
+    @classmethod
+    def batch_to_dict(cls, batch_id, jobs):
+        """Trạng thái batch trả về cho client: số job theo trạng thái và trạng thái từng job"""
+        counts = {status: 0 for status in ("queued", "running", "done", "failed")}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "batch_id": batch_id,
+            "total": len(jobs),
+            "counts": counts,
+            "finished": counts["queued"] == 0 and counts["running"] == 0,
+            "jobs": [cls.to_dict(job) for job in jobs]
+        }
+
+    @staticmethod
+    def to_dict(job):
+        """Trạng thái job trả về cho client"""
+        return {
+            "job_id": str(job.id),
+            "image_id": str(job.image.id) if job.image else None,
+            "status": job.status,
+            "description": job.caption,
+            "error": job.error,
+            "model_type": job.model_type,
+            "language": job.language,
+            "preset": job.preset_used or job.preset or DecodingPresetService.default_preset(),
+            "attempts": job.attempts,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            "queue_seconds": job.queue_seconds,
+            "run_seconds": job.run_seconds,
+            "audio_url": TTSService.audio_url(str(job.image.id), job.caption, job.language) if job.status == "done" and job.image else None
+        }
+
+    @classmethod
+    def start_workers(cls, count=None):
+        """Khởi động (một lần) các thread nền xử lý job"""
+        count = cls._worker_count if count is None else count
+        # Tiến trình con (vd: tiến trình suy luận) không nhận job
+        if multiprocessing.parent_process() is not None:
+            return
+        with cls._workers_lock:
+            if cls._workers or count <= 0:
+                return
+            for index in range(count):
+                worker = threading.Thread(target=cls._worker_loop, args=(index,), name=f"caption-job-{index}", daemon=True)
+                worker.start()
+                cls._workers.append(worker)
+        print(f"Đã khởi động {count} thread xử lý job caption")
+
+    @classmethod
+    def _claim_next(cls, worker_name, batch_id=None):
+        """Nhận nguyên tử job cũ nhất đang chờ (hoặc job có lease đã hết hạn), trả về None nếu không có"""
+        now = datetime.datetime.now()
+        query = (Q(status="queued") | Q(status="running", lease_expires_at__lt=now)) & Q(attempts__lt=cls._max_attempts)
+        if batch_id is not None:
+            query &= Q(batch_id=batch_id)
+        return CaptionJob.objects(query).order_by("created_at").modify(
+            new=True,
+            set__status="running",
+            set__worker=worker_name,
+            set__claim_token=uuid.uuid4().hex,
+            set__started_at=now,
+            set__lease_expires_at=now + datetime.timedelta(seconds=cls._lease_seconds),
+            inc__attempts=1
+        )
+
+    @classmethod
+    def _claim_siblings(cls, worker_name, job):
+        """Nhận thêm các job đang chờ của cùng batch upload (cùng mô hình, ngôn ngữ và preset) để chạy chung"""
+        siblings = []
+        if not job.batch_id:
+            return siblings
+        while len(siblings) + 1 < cls._claim_batch_size:
+            sibling = cls._claim_next(worker_name, batch_id=job.batch_id)
+            if sibling is None:
+                break
+            siblings.append(sibling)
+        return siblings
+
+    @classmethod
+    def _fail_abandoned(cls):
+        """Đánh dấu thất bại các job đã bị bỏ dở quá số lần thử cho phép"""
+        CaptionJob.objects(
+            status="running",
+            lease_expires_at__lt=datetime.datetime.now(),
+            attempts__gte=cls._max_attempts
+        ).update(set__status="failed", set__error="Job bị gián đoạn quá số lần thử cho phép")
+
+    @classmethod
+    def _renew_leases(cls, jobs, stop):
+        """Gia hạn lease của các job đang xử lý (mỗi 1/3 thời hạn lease) cho tới khi stop được đặt"""
+        interval = max(cls._lease_seconds / 3, 1.0)
+        while not stop.wait(interval):
+            lease_expires_at = datetime.datetime.now() + datetime.timedelta(seconds=cls._lease_seconds)
+            for job in jobs:
+                try:
+                    CaptionJob.objects(id=job.id, status="running", claim_token=job.claim_token).update_one(
+                        set__lease_expires_at=lease_expires_at
+                    )
+                except Exception as e:
+                    print(f"Không gia hạn được lease của job caption {job.id}: {e}")
+
+    @classmethod
+    def _worker_loop(cls, index):
+        worker_name = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        while True:
+            try:
+                job = cls._claim_next(worker_name)
+                if job is None:
+                    cls._fail_abandoned()
+                    cls._wakeup.wait(cls._poll_interval)
+                    cls._wakeup.clear()
+                    continue
+                jobs = [job] + cls._claim_siblings(worker_name, job)
+                stop = threading.Event()
+                threading.Thread(
+                    target=cls._renew_leases, args=(jobs, stop), name=f"caption-job-{index}-lease", daemon=True
+                ).start()
+                try:
+                    if len(jobs) == 1:
+                        cls._process(job)
+                    else:
+                        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix=f"caption-job-{index}") as pool:
+                            list(pool.map(cls._process, jobs))
+                finally:
+                    stop.set()
+            except Exception as e:
+                print(f"Lỗi trong thread xử lý job caption: {e}")
+                time.sleep(cls._poll_interval)
+
+    @classmethod
+    def _process(cls, job):
+        """Chạy quy trình tạo caption cho một job và ghi lại kết quả, thời gian"""
+        started = time.time()
+        queue_seconds = (job.started_at - job.created_at).total_seconds() if job.created_at else None
+        try:
+            image = job.image
+            if image is None:
+                raise ValueError("Ảnh của job không còn tồn tại")
+            if job.user is None:
+                raise ValueError("Job không có người dùng nên không thể cập nhật mô tả ảnh")
+            caption, decoding = cls.caption_image(
+                image, str(job.user.id), job.model_type, job.language, job.preset, job.latency_budget_ms
+            )
+            updated = CaptionJob.objects(id=job.id, claim_token=job.claim_token).update_one(
+                set__status="done",
+                set__caption=caption,
+                set__preset_used=decoding["preset"],
+                set__error=None,
+                set__finished_at=datetime.datetime.now(),
+                set__queue_seconds=queue_seconds,
+                set__run_seconds=time.time() - started
+            )
+            if not updated:
+                print(f"Job caption {job.id} đã được worker khác nhận lại, bỏ qua kết quả của lần nhận này")
+                return
+            print(f"Job caption {job.id} hoàn thành sau {time.time() - started:.2f}s (chờ {queue_seconds or 0:.2f}s)")
+        except Exception as e:
+            print(f"Job caption {job.id} thất bại (lần {job.attempts}): {e}")
+            CaptionJob.objects(id=job.id, claim_token=job.claim_token).update_one(
+                set__status="failed",
+                set__error=str(e),
+                set__finished_at=datetime.datetime.now(),
+                set__queue_seconds=queue_seconds,
+                set__run_seconds=time.time() - started
+            )
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+
+class DecodingPresetService:
+    """
+    Các preset giải mã có tên (fast / balanced / quality) và ngân sách độ trễ cho từng request:
+    - Mỗi preset quy định num_beams và max_length.
+    - Thời gian sinh caption thực tế (gồm cả thời gian chờ gom batch) được đo theo (mô hình, max_length, num_beams)
+      và làm mượt bằng trung bình trượt hàm mũ (EWMA).
+    - Khi có ngân sách độ trễ, dịch vụ chọn preset chất lượng cao nhất (không vượt preset được yêu cầu)
+      có thời gian ước lượng nằm trong ngân sách; không preset nào vừa thì dùng preset nhanh nhất.
+    - Số đo cũ hơn CAPTION_LATENCY_STALE_SECONDS bị bỏ qua để preset chất lượng cao được thử lại sau giờ cao điểm.
+    """
+
+    # Thứ tự từ nhanh nhất đến chất lượng cao nhất
+    PRESETS = {
+        "fast": {"num_beams": 1, "max_length": 20},
+        "balanced": {"num_beams": 3, "max_length": 30},
+        "quality": {"num_beams": 5, "max_length": 30}
+    }
+
+    _default_preset = os.getenv("CAPTION_DEFAULT_PRESET", "quality")
+    _default_budget_ms = float(os.getenv("CAPTION_LATENCY_BUDGET_MS", "0"))
+    _stale_seconds = float(os.getenv("CAPTION_LATENCY_STALE_SECONDS", "120"))
+    _ewma_alpha = 0.2
+
+    _lock = threading.Lock()
+    _timings = {}  # (model_type, max_length, num_beams) -> {"seconds", "samples", "updated_at"}
+
+    _stats = {
+        "resolved": 0,
+        "downgraded": 0,
+        "over_budget": 0
+    }
+
+    @classmethod
+    def preset_names(cls):
+        return list(cls.PRESETS)
+
+    @classmethod
+    def default_preset(cls):
+        return cls._default_preset if cls._default_preset in cls.PRESETS else "quality"
+
+    @classmethod
+    def record(cls, model_type, max_length, num_beams, seconds):
+        """Ghi nhận thời gian sinh caption của một request"""
+        key = (model_type, int(max_length), int(num_beams))
+        now = time.time()
+        with cls._lock:
+            entry = cls._timings.get(key)
+            if entry is None or now - entry["updated_at"] > cls._stale_seconds:
+                cls._timings[key] = {"seconds": seconds, "samples": 1, "updated_at": now}
+            else:
+                entry["seconds"] += cls._ewma_alpha * (seconds - entry["seconds"])
+                entry["samples"] += 1
+                entry["updated_at"] = now
+
+    @classmethod
+    def estimate(cls, model_type, max_length, num_beams):
+        """
+        Ước lượng thời gian (giây) sinh caption với tham số giải mã cho trước, None nếu chưa có số đo nào.
+        Cấu hình chưa được đo thì suy ra từ cấu hình đã đo gần nhất của cùng mô hình,
+        với chi phí xấp xỉ tỉ lệ với max_length * num_beams.
+        """
+        now = time.time()
+        cost = max_length * num_beams
+        with cls._lock:
+            fresh = {
+                key: entry["seconds"] for key, entry in cls._timings.items()
+                if key[0] == model_type and now - entry["updated_at"] <= cls._stale_seconds
+            }
+        exact = fresh.get((model_type, int(max_length), int(num_beams)))
+        if exact is not None:
+            return exact
+        if not fresh:
+            return None
+        nearest = min(fresh, key=lambda key: abs(key[1] * key[2] - cost))
+        return fresh[nearest] * cost / (nearest[1] * nearest[2])
+
+    @classmethod
+    def resolve(cls, model_type, preset=None, latency_budget_ms=None):
+        """
+        Chọn tham số giải mã cho một request.
+
+        Tham số:
+            preset: Tên preset được yêu cầu (None hoặc không hợp lệ = preset mặc định)
+            latency_budget_ms: Ngân sách độ trễ cho bước sinh caption (None = CAPTION_LATENCY_BUDGET_MS, 0 = không giới hạn)
+
+        Trả về dict: preset, requested_preset, num_beams, max_length, latency_budget_ms, estimated_ms
+        """
+        requested = preset if preset in cls.PRESETS else cls.default_preset()
+        budget_ms = cls._default_budget_ms if latency_budget_ms is None else float(latency_budget_ms)
+
+        names = cls.preset_names()
+        # Chỉ hạ cấp, không bao giờ chọn preset chất lượng cao hơn preset được yêu cầu
+        candidates = list(reversed(names[:names.index(requested) + 1]))
+        chosen, estimated = candidates[0], None
+        if budget_ms > 0:
+            for name in candidates:
+                chosen = name
+                estimated = cls.estimate(model_type, cls.PRESETS[name]["max_length"], cls.PRESETS[name]["num_beams"])
+                if estimated is None or estimated * 1000 <= budget_ms:
+                    break
+
+        with cls._lock:
+            cls._stats["resolved"] += 1
+            if chosen != requested:
+                cls._stats["downgraded"] += 1
+            if estimated is not None and estimated * 1000 > budget_ms > 0:
+                cls._stats["over_budget"] += 1
+
+        return {
+            "preset": chosen,
+            "requested_preset": requested,
+            "num_beams": cls.PRESETS[chosen]["num_beams"],
+            "max_length": cls.PRESETS[chosen]["max_length"],
+            "latency_budget_ms": budget_ms or None,
+            "estimated_ms": round(estimated * 1000, 1) if estimated is not None else None
+        }
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            timings = {
+                f"{model_type}:{max_length}:{num_beams}": {
+                    "ewma_ms": round(entry["seconds"] * 1000, 1),
+                    "samples": entry["samples"]
+                }
+                for (model_type, max_length, num_beams), entry in cls._timings.items()
+            }
+            return {
+                **cls._stats,
+                "default_preset": cls.default_preset(),
+                "default_budget_ms": cls._default_budget_ms or None,
+                "timings": timings
+            }
@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingCacheService:
+    """
+    Bộ nhớ đệm đầu ra của vision encoder (image embedding) theo cặp (ảnh, mô hình):
+    - Khóa = SHA-256 của dữ liệu ảnh + model_type + phiên bản mô hình (gồm cả backend và độ chính xác).
+    - Embedding được lưu gọn dưới dạng mảng NumPy float16, LRU giới hạn theo tổng số byte.
+    - Khi tạo lại caption với num_beams, max_length hoặc ngôn ngữ khác, chỉ cần chạy text decoder.
+    """
+
+    _enabled = os.getenv("CAPTION_EMBEDDING_CACHE", "1") != "0"
+    _memory_budget = int(float(os.getenv("CAPTION_EMBEDDING_CACHE_MB", "256")) * 1024 * 1024)
+
+    _lock = threading.Lock()
+    _memory = OrderedDict()  # key -> (embedding float16, model_type)
+    _memory_bytes = 0
+
+    _stats = {
+        "hits": 0,
+        "misses": 0,
+        "writes": 0,
+        "evictions": 0,
+        "invalidations": 0
+    }
+
+    @classmethod
+    def is_enabled(cls):
+        return cls._enabled and cls._memory_budget > 0
+
+    @staticmethod
+    def make_key(image_hash, model_type, model_version):
+        """Tạo khóa từ hash ảnh và phiên bản mô hình; embedding không phụ thuộc tham số giải mã"""
+        return f"{image_hash}|{model_type}|{model_version}"
+
+    @staticmethod
+    def compact(image_embeds):
+        """Chuyển embedding (B, S, D) sang float16 để lưu cache"""
+        return np.ascontiguousarray(image_embeds, dtype=np.float16)
+
+    @classmethod
+    def get(cls, key):
+        """Lấy embedding float16 dạng (1, S, D), trả về None nếu không có trong cache"""
+        if not cls.is_enabled():
+            return None
+
+        with cls._lock:
+            entry = cls._memory.get(key)
+            if entry is None:
+                cls._stats["misses"] += 1
+                return None
+            cls._memory.move_to_end(key)
+            cls._stats["hits"] += 1
+            return entry[0]
+
+    @classmethod
+    def put(cls, key, embedding, model_type):
+        """Lưu embedding (1, S, D) và loại bỏ các mục cũ nhất khi vượt ngân sách byte"""
+        if not cls.is_enabled():
+            return
+
+        # Sao chép để không giữ lại cả mảng của batch khi embedding là một lát cắt
+        embedding = np.array(embedding, dtype=np.float16)
+        if embedding.nbytes > cls._memory_budget:
+            return
+
+        with cls._lock:
+            previous = cls._memory.pop(key, None)
+            if previous is not None:
+                cls._memory_bytes -= previous[0].nbytes
+            cls._memory[key] = (embedding, model_type)
+            cls._memory_bytes += embedding.nbytes
+            cls._stats["writes"] += 1
+
+            while cls._memory_bytes > cls._memory_budget and cls._memory:
+                _, (evicted, _) = cls._memory.popitem(last=False)
+                cls._memory_bytes -= evicted.nbytes
+                cls._stats["evictions"] += 1
+
+    @classmethod
+    def invalidate(cls, model_type=None):
+        """Xóa embedding của một mô hình (hoặc toàn bộ nếu model_type là None)"""
+        with cls._lock:
+            keys = [key for key, entry in cls._memory.items() if model_type is None or entry[1] == model_type]
+            for key in keys:
+                cls._memory_bytes -= cls._memory.pop(key)[0].nbytes
+            cls._stats["invalidations"] += 1
+
+    @classmethod
+    def get_stats(cls):
+        """Bộ đếm hit/miss và mức sử dụng bộ nhớ của cache embedding"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["entries"] = len(cls._memory)
+            stats["memory_bytes"] = cls._memory_bytes
+        stats["memory_budget_bytes"] = cls._memory_budget
+        stats["enabled"] = cls.is_enabled()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
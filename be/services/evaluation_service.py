@@ -0,0 +1,205 @@
+import math
+import os
+import threading
+from collections import Counter
+import openpyxl
+import nltk
+from nltk.translate.bleu_score import sentence_bleu, corpus_bleu, SmoothingFunction
+nltk.download('punkt', quiet=True)
+
+class EvaluationService:
+    """
+    Các hàm đánh giá chất lượng caption dùng chung cho controller và các công cụ dòng lệnh:
+    - Đọc ground truth từ file test.xlsx (cột 1: tên ảnh, cột 2: caption tham chiếu).
+    - Giữ chỉ mục ground truth trong bộ nhớ cho việc tính BLEU khi upload, chỉ đọc lại khi file thay đổi (mtime/kích thước).
+    - Tính BLEU cho một câu hoặc cho cả tập, và CIDEr-D cho cả tập.
+    """
+
+    _default_ground_truth_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "test.xlsx"))
+    _smoothing = SmoothingFunction().method1
+    _bleu_weights = {
+        1: (1, 0, 0, 0),
+        2: (0.5, 0.5, 0, 0),
+        3: (1 / 3, 1 / 3, 1 / 3, 0),
+        4: (0.25, 0.25, 0.25, 0.25)
+    }
+
+    @classmethod
+    def load_ground_truth(cls, path=None):
+        """Đọc file ground truth, trả về dict {tên ảnh: caption tham chiếu}"""
+        path = path or cls._default_ground_truth_path
+        if not os.path.exists(path):
+            return {}
+
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            ws = wb.active
+            gt_dict = {}
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                if not row or row[0] is None or row[1] is None:
+                    continue
+                gt_dict[str(row[0]).strip()] = str(row[1]).strip()
+            return gt_dict
+        finally:
+            wb.close()
+
+    # Chỉ mục ground truth đã nạp: đường dẫn -> ((mtime_ns, kích thước), {tên ảnh chuẩn hóa: caption tham chiếu})
+    _indexes = {}
+    _index_lock = threading.Lock()
+
+    @staticmethod
+    def normalize_name(name):
+        """Chuẩn hóa tên ảnh để so khớp: bỏ thư mục, khoảng trắng thừa và không phân biệt hoa thường"""
+        return os.path.basename(str(name).strip().replace("\\", "/")).lower()
+
+    @classmethod
+    def _build_index(cls, gt_dict):
+        index = {}
+        for name, reference in gt_dict.items():
+            key = cls.normalize_name(name)
+            index[key] = reference
+            # Cho phép so khớp cả khi tên trong file không có phần mở rộng hoặc khác phần mở rộng
+            index.setdefault(os.path.splitext(key)[0], reference)
+        return index
+
+    @classmethod
+    def get_ground_truth_index(cls, path=None):
+        """
+        Chỉ mục ground truth {tên ảnh chuẩn hóa: caption tham chiếu}, đọc file một lần và
+        chỉ đọc lại khi mtime hoặc kích thước của file thay đổi. Trả về {} nếu không có file.
+        """
+        path = path or cls._default_ground_truth_path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {}
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        cached = cls._indexes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with cls._index_lock:
+            cached = cls._indexes.get(path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            index = cls._build_index(cls.load_ground_truth(path))
+            cls._indexes[path] = (signature, index)
+            print(f"Đã nạp ground truth: {len(index)} mục từ {path}")
+            return index
+
+    @classmethod
+    def find_reference(cls, *names, path=None):
+        """Caption tham chiếu của ảnh theo tên (thử lần lượt các tên, vd: tên gốc rồi tên hệ thống), None nếu không có"""
+        index = cls.get_ground_truth_index(path)
+        if not index:
+            return None
+        for name in names:
+            if not name:
+                continue
+            key = cls.normalize_name(name)
+            reference = index.get(key) or index.get(os.path.splitext(key)[0])
+            if reference is not None:
+                return reference
+        return None
+
+    @staticmethod
+    def tokenize(text):
+        return nltk.word_tokenize(text)
+
+    @classmethod
+    def sentence_bleu_scores(cls, reference, hypothesis):
+        """BLEU-1 và BLEU-2 của một caption so với caption tham chiếu"""
+        ref_tokens = cls.tokenize(reference)
+        hyp_tokens = cls.tokenize(hypothesis)
+        bleu1 = sentence_bleu([ref_tokens], hyp_tokens, weights=cls._bleu_weights[1], smoothing_function=cls._smoothing)
+        bleu2 = sentence_bleu([ref_tokens], hyp_tokens, weights=cls._bleu_weights[2], smoothing_function=cls._smoothing)
+        return bleu1, bleu2
+
+    @classmethod
+    def corpus_bleu_scores(cls, references, hypotheses):
+        """
+        BLEU-1..4 trên toàn tập.
+
+        Tham số:
+            references: Danh sách caption tham chiếu (mỗi phần tử là một chuỗi hoặc danh sách chuỗi)
+            hypotheses: Danh sách caption sinh ra, cùng thứ tự với references
+        """
+        refs_tokens = [
+            [cls.tokenize(ref) for ref in (refs if isinstance(refs, (list, tuple)) else [refs])]
+            for refs in references
+        ]
+        hyps_tokens = [cls.tokenize(hyp) for hyp in hypotheses]
+        if not hyps_tokens:
+            return {f"bleu{n}": 0.0 for n in cls._bleu_weights}
+        return {
+            f"bleu{n}": corpus_bleu(refs_tokens, hyps_tokens, weights=weights, smoothing_function=cls._smoothing)
+            for n, weights in cls._bleu_weights.items()
+        }
+
+    @staticmethod
+    def _ngram_counts(tokens, n_max=4):
+        counts = Counter()
+        for n in range(1, n_max + 1):
+            for start in range(len(tokens) - n + 1):
+                counts[tuple(tokens[start:start + n])] += 1
+        return counts
+
+    @classmethod
+    def corpus_cider_score(cls, references, hypotheses, n_max=4, sigma=6.0):
+        """
+        CIDEr-D trên toàn tập (giống pycocoevalcap): vector TF-IDF n-gram 1..4 với IDF tính trên các caption tham chiếu,
+        giới hạn số lần lặp n-gram của caption sinh ra và phạt chênh lệch độ dài, nhân 10.
+
+        Tham số:
+            references: Danh sách caption tham chiếu (mỗi phần tử là một chuỗi hoặc danh sách chuỗi)
+            hypotheses: Danh sách caption sinh ra, cùng thứ tự với references
+        """
+        if not hypotheses:
+            return 0.0
+        refs_counts = []
+        for refs in references:
+            refs = refs if isinstance(refs, (list, tuple)) else [refs]
+            refs_counts.append([cls._ngram_counts([token.lower() for token in cls.tokenize(ref)], n_max) for ref in refs])
+        hyps_counts = [cls._ngram_counts([token.lower() for token in cls.tokenize(hyp)], n_max) for hyp in hypotheses]
+
+        # Số ảnh có n-gram xuất hiện trong ít nhất một caption tham chiếu
+        document_frequency = Counter()
+        for counts in refs_counts:
+            document_frequency.update(set(ngram for ref in counts for ngram in ref))
+        log_corpus_size = math.log(float(len(refs_counts)))
+
+        def to_vector(counts):
+            vector = [{} for _ in range(n_max)]
+            norms = [0.0] * n_max
+            length = 0
+            for ngram, tf in counts.items():
+                index = len(ngram) - 1
+                weight = float(tf) * (log_corpus_size - math.log(max(1.0, document_frequency[ngram])))
+                vector[index][ngram] = weight
+                norms[index] += weight * weight
+                # Như pycocoevalcap, độ dài câu là số bigram (số token - 1) chứ không phải số unigram
+                if len(ngram) == 2:
+                    length += tf
+            return vector, [math.sqrt(norm) for norm in norms], length
+
+        def similarity(hyp, ref):
+            (vec_hyp, norm_hyp, len_hyp), (vec_ref, norm_ref, len_ref) = hyp, ref
+            delta = float(len_hyp - len_ref)
+            values = [0.0] * n_max
+            for n in range(n_max):
+                for ngram, weight in vec_hyp[n].items():
+                    values[n] += min(weight, vec_ref[n].get(ngram, 0.0)) * vec_ref[n].get(ngram, 0.0)
+                if norm_hyp[n] != 0 and norm_ref[n] != 0:
+                    values[n] /= norm_hyp[n] * norm_ref[n]
+                values[n] *= math.e ** (-(delta ** 2) / (2 * sigma ** 2))
+            return values
+
+        scores = []
+        for hyp_counts, ref_counts in zip(hyps_counts, refs_counts):
+            hyp = to_vector(hyp_counts)
+            total = [0.0] * n_max
+            for ref in ref_counts:
+                for n, value in enumerate(similarity(hyp, to_vector(ref))):
+                    total[n] += value
+            scores.append(sum(total) / n_max / max(len(ref_counts), 1) * 10.0)
+        return sum(scores) / len(scores)
@@ -0,0 +1,161 @@
+# services/image_blob_service.py
+import datetime
+import hashlib
+import io
+import time
+from mongoengine.errors import NotUniqueError
+from models.image_blob import ImageBlob
+from services.blob_store import get_blob_store
+
+
+class ImageBlobService:
+    """
+    Lưu dữ liệu ảnh theo nội dung (content-addressed) và đếm tham chiếu:
+    - Mỗi nội dung ảnh (SHA-256) chỉ được lưu một lần; document ImageBlob chỉ giữ thông tin và backend chứa dữ liệu.
+    - Dữ liệu được ghi vào backend đặt bởi IMAGE_BLOB_STORE (gridfs, local hoặc mongo); blob cũ được đọc
+      theo backend ghi trong document nên có thể đổi backend mà không cần chuyển dữ liệu ngay.
+    - Upload trùng nội dung chỉ tăng ref_count (một lệnh cập nhật nhỏ, không gửi lại dữ liệu ảnh).
+    - Xóa ảnh giảm ref_count; blob bị xóa khi không còn bản ghi Image nào dùng. Trong lúc xóa dữ liệu, document
+      được đánh dấu state="deleting" (tombstone): upload cùng nội dung không dùng lại blob đang xóa mà chờ xóa xong
+      rồi tạo blob mới.
+    """
+
+    _chunk_size = 1024 * 1024
+    # Tombstone cũ hơn số giây này là của tiến trình bị dừng giữa lúc xóa: upload cùng nội dung sẽ dọn hộ
+    _stale_delete_seconds = 60
+    _tombstone_poll_seconds = 0.05
+
+    @classmethod
+    def read_and_hash(cls, stream):
+        """Đọc file upload theo từng khối, vừa đọc vừa tính SHA-256. Trả về (sha256 hex, dữ liệu)"""
+        digest = hashlib.sha256()
+        buffer = io.BytesIO()
+        while True:
+            chunk = stream.read(cls._chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+        return digest.hexdigest(), buffer.getvalue()
+
+    @classmethod
+    def acquire(cls, sha256, data, content_type=None):
+        """
+        Thêm một tham chiếu tới blob của nội dung sha256, tạo blob nếu chưa có.
+        Trả về True nếu blob vừa được tạo, False nếu nội dung đã tồn tại (upload trùng).
+        """
+        store = get_blob_store()
+        deadline = time.monotonic() + 2 * cls._stale_delete_seconds
+        while time.monotonic() < deadline:
+            # Đã có blob (không phải đang bị xóa): chỉ tăng bộ đếm, không gửi dữ liệu ảnh
+            if ImageBlob.objects(sha256=sha256, state__ne="deleting").update_one(inc__ref_count=1):
+                return False
+            if ImageBlob.objects(sha256=sha256, state="deleting").count():
+                # Blob đang bị xóa: chờ xóa xong; tombstone quá cũ (tiến trình xóa đã dừng) thì dọn hộ
+                cutoff = datetime.datetime.now() - datetime.timedelta(seconds=cls._stale_delete_seconds)
+                if not ImageBlob.objects(sha256=sha256, state="deleting", deleting_at__lt=cutoff).delete():
+                    time.sleep(cls._tombstone_poll_seconds)
+                continue
+            # Ghi dữ liệu trước document để document luôn trỏ tới dữ liệu đã có
+            if store.name != "mongo":
+                store.put(sha256, data, content_type)
+            try:
+                ImageBlob(
+                    sha256=sha256,
+                    storage=store.name,
+                    data=data if store.name == "mongo" else None,
+                    size=len(data),
+                    content_type=content_type,
+                    ref_count=1
+                ).save(force_insert=True)
+            except NotUniqueError:
+                # Request khác vừa tạo (hoặc bắt đầu xóa) cùng blob: thử lại
+                continue
+            # Trong lúc ghi, blob cùng nội dung có thể vừa được tạo rồi xóa hết (xóa luôn dữ liệu vừa ghi).
+            # Document mới đã có với ref_count=1 nên không lần xóa nào bắt đầu được nữa: ghi lại nếu thiếu.
+            if store.name != "mongo" and not store.exists(sha256):
+                store.put(sha256, data, content_type)
+            return True
+        raise RuntimeError(f"Không thể lưu dữ liệu ảnh {sha256}")
+
+    @staticmethod
+    def read(sha256):
+        """Dữ liệu ảnh của blob; None nếu không có"""
+        # Thường blob nằm ở backend hiện tại: đọc thẳng, không cần tra document
+        store = get_blob_store()
+        data = store.get(sha256)
+        if data is not None:
+            return data
+        # Blob được lưu trước khi đổi backend (hoặc đang được migrate)
+        blob = ImageBlob.objects(sha256=sha256).only('storage').first()
+        if blob is None or (blob.storage or "mongo") == store.name:
+            return None
+        return get_blob_store(blob.storage or "mongo").get(sha256)
+
+    @staticmethod
+    def release(sha256):
+        """Bỏ một tham chiếu tới blob, xóa blob khi không còn ảnh nào dùng. Trả về True nếu blob đã bị xóa"""
+        if not sha256:
+            return False
+        ImageBlob.objects(sha256=sha256, state__ne="deleting").update_one(dec__ref_count=1)
+        # Đánh dấu tombstone trong cùng lệnh kiểm tra ref_count <= 0: upload trùng chen vào trước đó đã tăng bộ đếm
+        # (blob được giữ), chen vào sau đó thì không tăng được bộ đếm mà chờ tới khi xóa xong
+        if not ImageBlob.objects(sha256=sha256, ref_count__lte=0, state__ne="deleting").update_one(
+                set__state="deleting", set__deleting_at=datetime.datetime.now()):
+            return False
+        blob = ImageBlob.objects(sha256=sha256, state="deleting").only('storage').first()
+        if blob is None:
+            # Tombstone đã bị dọn vì quá hạn: dữ liệu có thể đã thuộc về blob mới, không xóa
+            return False
+        try:
+            get_blob_store(blob.storage or "mongo").delete(sha256)
+        finally:
+            # Xóa document sau cùng: tới lúc này upload cùng nội dung mới tạo lại được blob
+            ImageBlob.objects(sha256=sha256, state="deleting").delete()
+        return True
+
+    @staticmethod
+    def move(blob, target):
+        """
+        Chuyển dữ liệu của một blob sang backend target (dùng khi migrate).
+        Document chỉ trỏ sang backend mới sau khi dữ liệu đã được ghi xong; dữ liệu ở backend cũ được xóa sau cùng.
+        Trả về False nếu blob đã ở target hoặc không đọc được dữ liệu.
+        """
+        source_name = blob.storage or "mongo"
+        if source_name == target.name:
+            return False
+        source = get_blob_store(source_name)
+        data = source.get(blob.sha256)
+        if data is None:
+            return False
+        target.put(blob.sha256, data, blob.content_type)
+        updates = {"set__storage": target.name}
+        if target.name == "mongo":
+            updates["set__data"] = data
+        else:
+            updates["unset__data"] = True
+        # Chỉ cập nhật nếu blob chưa bị chuyển bởi tiến trình khác và không đang bị xóa
+        # (document cũ có thể không có trường storage)
+        sources = [source_name, None] if source_name == "mongo" else [source_name]
+        if not ImageBlob.objects(sha256=blob.sha256, storage__in=sources, state__ne="deleting").update_one(**updates):
+            # Blob đã (hoặc đang) bị xóa trong lúc chuyển: bỏ bản sao vừa ghi. Không xóa ở backend hiện tại vì
+            # upload cùng nội dung có thể vừa tạo lại blob dùng đúng bản sao đó (để sót một bản sao thừa thì vô hại).
+            if target.name != get_blob_store().name and not ImageBlob.objects(sha256=blob.sha256).count():
+                target.delete(blob.sha256)
+            return False
+        source.delete(blob.sha256)
+        return True
+
+    @staticmethod
+    def get_stats():
+        """Số blob, tổng dung lượng và số tham chiếu (tổng ref_count - số blob = số ảnh trùng đã tiết kiệm), theo backend"""
+        result = list(ImageBlob.objects(state__ne="deleting").aggregate([
+            {"$group": {"_id": {"$ifNull": ["$storage", "mongo"]}, "blobs": {"$sum": 1}, "bytes": {"$sum": "$size"}, "references": {"$sum": "$ref_count"}}}
+        ]))
+        stats = {"blobs": 0, "bytes": 0, "references": 0, "by_storage": {}}
+        for row in result:
+            stats["by_storage"][row["_id"]] = {key: row[key] for key in ("blobs", "bytes", "references")}
+            for key in ("blobs", "bytes", "references"):
+                stats[key] += row[key]
+        stats["storage"] = get_blob_store().name
+        return stats
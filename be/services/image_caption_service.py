@@ -1,30 +1,88 @@
 # services/image_caption_service.py
 import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
+import numpy as np
+from transformers import BlipProcessor, BlipForConditionalGeneration, StoppingCriteria, StoppingCriteriaList
 from PIL import Image
 import os
-from googletrans import Translator
-from gtts import gTTS
-import tempfile
-import playsound
 import io
 import time
 from datetime import datetime
 import logging
+import threading
+import multiprocessing
+import queue
+import uuid
+from services.micro_batcher import MicroBatcher
+from services.caption_cache_service import CaptionCacheService
+from services.embedding_cache_service import EmbeddingCacheService
+from services.decoding_preset_service import DecodingPresetService
+from services.translation_service import TranslationService
+from services.tts_service import TTSService
+from services.near_duplicate_service import NearDuplicateService
+from services.background_executor import BackgroundExecutor
+from services.log_sink import JsonlLogSink
+from services.metrics_service import MetricsService
+from services.model_registry import ModelRegistry
+from services.model_precision import resolve_precision, load_cached_int8, apply_precision, model_dtype
+from services.onnx_caption_backend import OnnxCaptionBackend
+from services.inference_pool import InferencePool
+from services.image_preprocess import preprocess_image, PREPROCESS_VERSION
+
+
+def _model_footprint(bundle):
+    """Số byte trọng số của mô hình trong bộ nhớ (tính cả trọng số đã lượng tử hóa int8)"""
+    if hasattr(bundle[0], "footprint_bytes"):
+        return bundle[0].footprint_bytes()
+    total = 0
+    for value in bundle[0].state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def _release_memory():
+    """Thu hồi bộ nhớ sau khi một mô hình bị giải phóng"""
+    import gc
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _parse_extra_models(value, base_dir):
+    """Đọc danh sách mô hình bổ sung dạng "ten=duong_dan,ten2=duong_dan2" từ biến môi trường"""
+    models = {}
+    for entry in value.split(","):
+        if "=" not in entry:
+            continue
+        name, path = (part.strip() for part in entry.split("=", 1))
+        if name and path:
+            models[name] = path if os.path.isabs(path) else os.path.join(base_dir, path)
+    return models
+
+
+class _StepCallback(StoppingCriteria):
+    """Gọi on_step(token_ids) sau mỗi bước giải mã với beam tốt nhất; dừng sinh khi on_step trả về True"""
+
+    def __init__(self, on_step):
+        self.on_step = on_step
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = bool(self.on_step(input_ids[0].tolist()))
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
 
 class ImageCaptionService:
     """
     Lớp này chịu trách nhiệm:
     - Load mô hình BLIP và Processor từ local (một lần duy nhất).
     - Cung cấp hàm generate_caption() nhận file ảnh từ controller, trả về chuỗi caption.
-    - Nếu bật speak=True: dịch chú thích sang tiếng Việt và phát âm thanh.
+    - Nếu bật speak=True: tạo sẵn audio đọc caption (client tải qua GET /<image_id>/audio).
     - Hỗ trợ nhiều mô hình khác nhau: mặc định và du lịch.
     """
 
-    _default_model = None
-    _default_processor = None
-    _travel_model = None
-    _travel_processor = None
+    _preload_targets = []
     _device = "cuda" if torch.cuda.is_available() else "cpu"
 
     # Đường dẫn mô hình
@@ -33,265 +91,851 @@ class ImageCaptionService:
     _default_model_name = "Salesforce/blip-image-captioning-base"  # Tên mô hình mặc định từ Salesforce
     _default_model_path = os.path.join(parent_dir, "pretrain", "blip_default")  # Đường dẫn lưu mô hình mặc định
     _travel_model_path = os.path.join(parent_dir, "pretrain", "blip_trained")  # Mô hình du lịch hiện tại
+    # Các checkpoint tinh chỉnh bổ sung đặt cạnh pretrain/blip_trained, vd: CAPTION_EXTRA_MODELS="hue=pretrain/blip_hue"
+    _extra_model_paths = _parse_extra_models(os.getenv("CAPTION_EXTRA_MODELS", ""), parent_dir)
+
+    # Quản lý mô hình: ngân sách bộ nhớ (MB) và thời gian nhàn rỗi tối đa (giây), 0 = không giới hạn
+    _registry = ModelRegistry(
+        memory_budget_bytes=int(float(os.getenv("CAPTION_MODEL_MEMORY_BUDGET_MB", "0")) * 1024 * 1024) or None,
+        idle_ttl_seconds=float(os.getenv("CAPTION_MODEL_IDLE_TTL_SECONDS", "0")) or None,
+        sizer=_model_footprint,
+        on_evict=_release_memory
+    )
 
-    _is_loading_default = False
-    _is_loading_travel = False
-    _translator = Translator()  # Tái sử dụng translator
-    
-    # Đường dẫn lưu log
+    # Chế độ độ chính xác khi suy luận: fp32, int8 hoặc bf16 (có thể đặt riêng từng mô hình,
+    # vd: CAPTION_PRECISION_TRAVEL=int8)
+    _default_precision = os.getenv("CAPTION_PRECISION", "fp32")
+    _effective_precisions = {}
+
+    # Backend suy luận: torch hoặc onnx (ONNX Runtime, cần chạy tools.export_onnx trước),
+    # có thể đặt riêng từng mô hình, vd: CAPTION_BACKEND_DEFAULT=onnx
+    _default_backend = os.getenv("CAPTION_BACKEND", "torch")
+
+    # Cấu hình hàng đợi gom batch cho suy luận
+    _batching_enabled = os.getenv("CAPTION_BATCHING", "1") != "0"
+    _batch_max_size = int(os.getenv("CAPTION_BATCH_MAX_SIZE", "8"))
+    _batch_max_wait_ms = float(os.getenv("CAPTION_BATCH_MAX_WAIT_MS", "25"))
+    _batcher = None
+    _batcher_lock = threading.Lock()
+
+    # Pool tiến trình suy luận (chỉ dùng trên CPU): CAPTION_WORKERS tiến trình, mỗi tiến trình gắn với một nhóm core
+    # và dùng CAPTION_WORKER_THREADS thread torch (mặc định bằng số core được gán). 0 = suy luận ngay trong tiến trình web.
+    _worker_count = int(os.getenv("CAPTION_WORKERS", "0"))
+    _worker_threads = int(os.getenv("CAPTION_WORKER_THREADS", "0")) or None
+    _worker_timeout = float(os.getenv("CAPTION_WORKER_TIMEOUT_SECONDS", "120"))
+    _pool = None
+    _pool_lock = threading.Lock()
+    _processors = {}
+    _processors_lock = threading.Lock()
+
+    # Các phiên stream caption đang chạy trong tiến trình: stream_id -> (user_id, cancel_event).
+    # Yêu cầu hủy có thể tới worker khác, nên cờ hủy được lưu ở collection caption_streams và đọc định kỳ.
+    _streams = {}
+    _streams_lock = threading.Lock()
+    _stream_watcher = None
+    _stream_cancel_poll_seconds = float(os.getenv("CAPTION_STREAM_CANCEL_POLL_SECONDS", "1"))
+    _stream_max_beams = int(os.getenv("CAPTION_STREAM_MAX_BEAMS", "3"))
+    _stream_heartbeat_seconds = float(os.getenv("CAPTION_STREAM_HEARTBEAT_SECONDS", "10"))
+
+    # Tiền xử lý nhanh: giải mã JPEG ở độ phân giải giảm, xoay theo EXIF và chuẩn hóa bằng NumPy
+    _fast_preprocess = os.getenv("CAPTION_FAST_PREPROCESS", "1") != "0"
+
+    # Đường dẫn lưu log và bộ ghi log JSON Lines (gom lô ở background, xoay file theo ngày và kích thước)
     _log_dir = os.path.join(parent_dir, "logs")
     os.makedirs(_log_dir, exist_ok=True)
+    _log_sink = JsonlLogSink(
+        _log_dir,
+        prefix="caption_log",
+        max_bytes=int(float(os.getenv("CAPTION_LOG_MAX_MB", "50")) * 1024 * 1024),
+        flush_interval=float(os.getenv("CAPTION_LOG_FLUSH_MS", "500")) / 1000,
+        batch_size=int(os.getenv("CAPTION_LOG_BATCH", "200")),
+        max_queue=int(os.getenv("CAPTION_LOG_QUEUE_SIZE", "10000"))
+    )
 
     @classmethod
-    def _load_default_model_if_needed(cls):
-        """Tải mô hình mặc định (Salesforce BLIP) nếu cần"""
-        if cls._default_model is None or cls._default_processor is None:
-            if cls._is_loading_default:
-                import time
-                while cls._is_loading_default and (cls._default_model is None or cls._default_processor is None):
-                    time.sleep(0.5)
-                return
+    def _precision_for(cls, model_type):
+        """Chế độ độ chính xác thực tế của mô hình (sau khi kiểm tra hỗ trợ của thiết bị)"""
+        if model_type not in cls._effective_precisions:
+            configured = os.getenv(f"CAPTION_PRECISION_{model_type.upper()}", cls._default_precision)
+            cls._effective_precisions[model_type] = resolve_precision(configured, cls._device)
+        return cls._effective_precisions[model_type]
+
+    @classmethod
+    def _backend_for(cls, model_type):
+        """Backend suy luận được cấu hình cho mô hình ("torch" hoặc "onnx")"""
+        backend = os.getenv(f"CAPTION_BACKEND_{model_type.upper()}", cls._default_backend).strip().lower()
+        return backend if backend in ("torch", "onnx") else "torch"
+
+    @classmethod
+    def _model_variant(cls, model_type):
+        """Backend và độ chính xác đang dùng; caption có thể khác nhau giữa các biến thể"""
+        if cls._backend_for(model_type) == "onnx":
+            return "onnx"
+        return cls._precision_for(model_type)
+
+    @classmethod
+    def _cache_version(cls, model_type):
+        """
+        Phiên bản dùng cho cache caption và embedding: dấu vân tay mô hình trên đĩa,
+        biến thể suy luận và cách tiền xử lý ảnh (đều ảnh hưởng tới caption)
+        """
+        fingerprint = CaptionCacheService.model_version(model_type, cls._model_path(model_type))
+        preprocess = PREPROCESS_VERSION if cls._fast_preprocess else "processor"
+        return f"{fingerprint}:{cls._model_variant(model_type)}:{preprocess}"
+
+    @classmethod
+    def _preprocess(cls, image_data, processor):
+        """Chuyển dữ liệu nhị phân của ảnh thành pixel_values (1, 3, H, W) dạng NumPy float32"""
+        if cls._fast_preprocess:
+            return preprocess_image(image_data, processor)
+        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        return processor(image, return_tensors="np")["pixel_values"]
+
+    @classmethod
+    def _load_blip_model(cls, model_type, model_path, precision=None, backend=None):
+        """
+        Tải trọng số BLIP từ thư mục local theo chế độ độ chính xác.
+        Với int8, bản lượng tử hóa được lưu trên đĩa nên chỉ phải chuyển đổi một lần.
+        """
+        if (backend or cls._backend_for(model_type)) == "onnx":
+            print(f"Mô hình {model_type} chạy qua ONNX Runtime")
+            return OnnxCaptionBackend(model_path, num_threads=torch.get_num_threads())
+
+        precision = resolve_precision(precision, cls._device) if precision else cls._precision_for(model_type)
+        model_version = CaptionCacheService.fingerprint_model_dir(model_path)
+        if precision == "int8":
+            model = load_cached_int8(model_path, model_version)
+            if model is not None:
+                return model
+
+        model = BlipForConditionalGeneration.from_pretrained(model_path)
+        model = apply_precision(model, precision, cls._device, model_path, model_version)
+        print(f"Mô hình {model_type} chạy ở chế độ {precision}")
+        return model
+
+    @classmethod
+    def _load_default_model(cls):
+        """Tải mô hình mặc định (Salesforce BLIP), trả về (model, processor)"""
+        try:
+            # Kiểm tra xem mô hình đã được lưu vào thư mục local chưa
+            if os.path.exists(cls._default_model_path) and os.path.isdir(cls._default_model_path):
+                print(f"Đang tải mô hình mặc định BLIP từ thư mục local: {cls._default_model_path}...")
+                processor = BlipProcessor.from_pretrained(cls._default_model_path, use_fast=True)
+                model = cls._load_blip_model("default", cls._default_model_path)
+            else:
+                print(f"Không tìm thấy mô hình mặc định trong thư mục local, đang tải từ Hugging Face: {cls._default_model_name}...")
+                # Đảm bảo thư mục cha tồn tại
+                os.makedirs(os.path.dirname(cls._default_model_path), exist_ok=True)
 
-            cls._is_loading_default = True
-            try:
-                # Kiểm tra xem mô hình đã được lưu vào thư mục local chưa
-                if os.path.exists(cls._default_model_path) and os.path.isdir(cls._default_model_path):
-                    print(f"Đang tải mô hình mặc định BLIP từ thư mục local: {cls._default_model_path}...")
-                    model_path = cls._default_model_path
-                else:
-                    print(f"Không tìm thấy mô hình mặc định trong thư mục local, đang tải từ Hugging Face: {cls._default_model_name}...")
-                    # Đảm bảo thư mục cha tồn tại
-                    os.makedirs(os.path.dirname(cls._default_model_path), exist_ok=True)
-                    model_path = cls._default_model_name
-                
                 # Tải processor và model
-                cls._default_processor = BlipProcessor.from_pretrained(model_path, use_fast=True)
-                cls._default_model = BlipForConditionalGeneration.from_pretrained(model_path)
-                
-                # Lưu mô hình vào thư mục local nếu đang tải từ Hugging Face
-                if model_path == cls._default_model_name:
-                    print(f"Đang lưu mô hình mặc định vào thư mục local: {cls._default_model_path}...")
-                    cls._default_processor.save_pretrained(cls._default_model_path)
-                    cls._default_model.save_pretrained(cls._default_model_path)
-                    print(f"Đã lưu mô hình mặc định thành công vào: {cls._default_model_path}")
-                
-                # Chuyển mô hình sang thiết bị phù hợp
-                cls._default_model = cls._default_model.to(cls._device)
-                cls._default_model.eval()
-                print(f"Tải mô hình mặc định thành công trên thiết bị {cls._device}")
-            except Exception as e:
-                print(f"Lỗi khi tải mô hình mặc định: {e}")
-                # Nếu có lỗi khi tải từ local, thử tải trực tiếp từ Hugging Face
-                if os.path.exists(cls._default_model_path):
-                    print(f"Thử tải lại từ Hugging Face: {cls._default_model_name}...")
-                    try:
-                        cls._default_processor = BlipProcessor.from_pretrained(cls._default_model_name, use_fast=True)
-                        cls._default_model = BlipForConditionalGeneration.from_pretrained(cls._default_model_name)
-                        cls._default_model = cls._default_model.to(cls._device)
-                        cls._default_model.eval()
-                        print(f"Tải mô hình mặc định từ Hugging Face thành công")
-                    except Exception as inner_e:
-                        print(f"Lỗi khi tải mô hình từ Hugging Face: {inner_e}")
-            finally:
-                cls._is_loading_default = False
-
-    @classmethod
-    def _load_travel_model_if_needed(cls):
-        """Tải mô hình du lịch (đã được huấn luyện) nếu cần"""
-        if cls._travel_model is None or cls._travel_processor is None:
-            if cls._is_loading_travel:
-                import time
-                while cls._is_loading_travel and (cls._travel_model is None or cls._travel_processor is None):
-                    time.sleep(0.5)
-                return
+                processor = BlipProcessor.from_pretrained(cls._default_model_name, use_fast=True)
+                model = BlipForConditionalGeneration.from_pretrained(cls._default_model_name)
 
-            cls._is_loading_travel = True
-            try:
-                if not os.path.exists(cls._travel_model_path):
-                    raise FileNotFoundError(f"Không tìm thấy đường dẫn mô hình du lịch: {cls._travel_model_path}")
+                # Lưu mô hình vào thư mục local để các lần sau tải từ đĩa
+                print(f"Đang lưu mô hình mặc định vào thư mục local: {cls._default_model_path}...")
+                processor.save_pretrained(cls._default_model_path)
+                model.save_pretrained(cls._default_model_path)
+                print(f"Đã lưu mô hình mặc định thành công vào: {cls._default_model_path}")
+                model = apply_precision(
+                    model, cls._precision_for("default"), cls._device,
+                    cls._default_model_path, CaptionCacheService.fingerprint_model_dir(cls._default_model_path)
+                )
+        except Exception as e:
+            print(f"Lỗi khi tải mô hình mặc định: {e}")
+            if not os.path.exists(cls._default_model_path):
+                raise
+            # Nếu có lỗi khi tải từ local, thử tải trực tiếp từ Hugging Face
+            print(f"Thử tải lại từ Hugging Face: {cls._default_model_name}...")
+            processor = BlipProcessor.from_pretrained(cls._default_model_name, use_fast=True)
+            model = BlipForConditionalGeneration.from_pretrained(cls._default_model_name)
+            model = apply_precision(model, cls._precision_for("default"), cls._device)
 
-                print(f"Đang tải mô hình du lịch BLIP từ {cls._travel_model_path}...")
-                cls._travel_processor = BlipProcessor.from_pretrained(cls._travel_model_path, use_fast=True)
-                cls._travel_model = BlipForConditionalGeneration.from_pretrained(cls._travel_model_path)
-                cls._travel_model = cls._travel_model.to(cls._device)
-                cls._travel_model.eval()
-                print(f"Tải mô hình du lịch thành công trên thiết bị {cls._device}")
-            finally:
-                cls._is_loading_travel = False
+        print(f"Tải mô hình mặc định thành công trên thiết bị {cls._device}")
+        return model, processor
+
+    @classmethod
+    def _load_local_model(cls, model_type, model_path, precision=None, backend=None):
+        """Tải một mô hình BLIP đã huấn luyện từ thư mục local, trả về (model, processor)"""
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Không tìm thấy đường dẫn mô hình {model_type}: {model_path}")
+
+        print(f"Đang tải mô hình {model_type} BLIP từ {model_path}...")
+        processor = BlipProcessor.from_pretrained(model_path, use_fast=True)
+        model = cls._load_blip_model(model_type, model_path, precision, backend)
+        print(f"Tải mô hình {model_type} thành công trên thiết bị {cls._device}")
+        return model, processor
+
+    @classmethod
+    def _load_travel_model(cls):
+        """Tải mô hình du lịch (đã được huấn luyện), trả về (model, processor)"""
+        return cls._load_local_model("travel", cls._travel_model_path)
+
+    @staticmethod
+    def _estimate_model_bytes(model_path):
+        """Ước lượng bộ nhớ cần cho mô hình từ kích thước file trọng số trên đĩa"""
+        if not os.path.isdir(model_path):
+            return 0
+        return sum(
+            os.path.getsize(os.path.join(model_path, name))
+            for name in os.listdir(model_path)
+            if name.endswith((".safetensors", ".bin", ".pt"))
+        )
+
+    @classmethod
+    def _warmup_model(cls, bundle):
+        """Chạy một lần suy luận trên ảnh trống để khởi tạo kernel và bộ nhớ đệm của torch"""
+        model, processor = bundle
+        image = Image.new("RGB", (384, 384), color=(127, 127, 127))
+        inputs = processor(image, return_tensors="pt")
+        with torch.no_grad():
+            model.generate(pixel_values=inputs["pixel_values"].to(cls._device, dtype=model_dtype(model)), max_length=30, num_beams=5, min_length=5)
+
+    @classmethod
+    def available_model_types(cls):
+        """Danh sách model_type hợp lệ (mặc định, du lịch và các checkpoint bổ sung)"""
+        return cls._registry.names()
+
+    @classmethod
+    def _model_name(cls, model_type):
+        return model_type if model_type in cls._registry.names() else "default"
+
+    @classmethod
+    def _get_model(cls, model_type):
+        """Lấy (model, processor) theo model_type, tải một lần duy nhất qua registry"""
+        return cls._registry.get(cls._model_name(model_type))
+
+    @classmethod
+    def preload_models(cls, model_types=None, warmup=True, background=False):
+        """
+        Tải trước và warm-up các mô hình khi ứng dụng khởi động.
+
+        Tham số:
+            model_types: Danh sách model_type cần tải (mặc định: tất cả)
+            warmup: Có chạy suy luận khởi động hay không
+            background: Chạy trong thread nền để không chặn việc khởi động ứng dụng
+        """
+        # Ghi nhận danh sách trước khi tải để /readyz báo chưa sẵn sàng trong lúc đang tải
+        cls._preload_targets = list(model_types) if model_types is not None else cls._registry.names()
+        if cls._use_pool():
+            # Mỗi tiến trình suy luận tự tải và warm-up mô hình, tiến trình web chỉ cần processor
+            cls._get_pool(preload=cls._preload_targets, warmup=warmup)
+            return
+        if background:
+            threading.Thread(
+                target=cls._registry.preload,
+                args=(cls._preload_targets,),
+                kwargs={"warmup": warmup},
+                daemon=True
+            ).start()
+        else:
+            cls._registry.preload(cls._preload_targets, warmup=warmup)
+
+    @classmethod
+    def is_ready(cls):
+        """Worker sẵn sàng khi mọi mô hình cần tải trước đã tải xong và đã warm-up"""
+        if cls._use_pool():
+            return cls._pool.is_ready() if cls._pool is not None else not cls._preload_targets
+        return cls._registry.is_ready(cls._preload_targets)
+
+    @classmethod
+    def get_model_status(cls):
+        """Trạng thái tải và độ trễ warm-up của từng mô hình (hoặc của từng tiến trình suy luận)"""
+        if cls._use_pool():
+            return cls._pool.status() if cls._pool is not None else {}
+        return cls._registry.status()
+
+    @classmethod
+    def prune_caption_cache(cls):
+        """Dọn các caption trong MongoDB thuộc phiên bản mô hình cũ (hoặc mô hình không còn dùng), trả về số mục đã xóa"""
+        versions = {
+            model_type: CaptionCacheService.model_version(model_type, cls._model_path(model_type))
+            for model_type in cls.available_model_types()
+        }
+        return CaptionCacheService.prune(versions)
 
     @classmethod
     def unload_models(cls):
         """Giải phóng tất cả các mô hình khỏi bộ nhớ"""
-        if cls._default_model is not None:
-            cls._default_model = None
-            cls._default_processor = None
-
-        if cls._travel_model is not None:
-            cls._travel_model = None
-            cls._travel_processor = None
-
-        import gc
-        gc.collect()
-        if cls._device == "cuda":
-            torch.cuda.empty_cache()
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.shutdown()
+                cls._pool = None
+        cls._registry.unload_all()
+        TranslationService.unload()
+        _release_memory()
         print("Đã giải phóng tất cả mô hình khỏi bộ nhớ")
 
     @classmethod
     def speak_caption(cls, text, lang="vi"):
         """
-        Phát âm văn bản với ngôn ngữ được chỉ định.
-        Phát âm trực tiếp theo ngôn ngữ đã chọn (tiếng Anh hoặc tiếng Việt).
+        Tạo audio đọc văn bản và lưu vào cache TTS; server không phát âm thanh,
+        client tải audio qua GET /api/image-caption/<image_id>/audio.
         
         Tham số:
             text: Văn bản cần phát âm
             lang: Ngôn ngữ của văn bản ('en' hoặc 'vi')
+
+        Trả về thông tin audio (xem TTSService.get_audio) hoặc None nếu lỗi
         """
         try:
-            # Sử dụng đúng ngôn ngữ của văn bản để phát âm
             speech_lang = "en" if lang == "en" else "vi"
-            print(f" Phát âm bằng tiếng {speech_lang.upper()}")
-            
-            tts = gTTS(text, lang=speech_lang)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-                temp_path = fp.name
-                tts.save(temp_path)
-
-            try:
-                playsound.playsound(temp_path)
-            except Exception:
-                os.system(f"start {temp_path}")
-            finally:
-                os.remove(temp_path)
+            return TTSService.get_audio(text, speech_lang)
         except Exception as e:
-            print(f" Lỗi khi đọc caption: {e}")
+            print(f" Lỗi khi tạo audio cho caption: {e}")
+            return None
             
     @classmethod
     def translate_text(cls, text, src_lang="en", dest_lang="vi"):
         """
         Dịch văn bản từ ngôn ngữ nguồn sang ngôn ngữ đích.
+        Dùng mô hình dịch cục bộ (gom batch + cache), googletrans chỉ là phương án dự phòng.
         
         Tham số:
             text: Văn bản cần dịch
             src_lang: Ngôn ngữ nguồn ('en' hoặc 'vi')
             dest_lang: Ngôn ngữ đích ('en' hoặc 'vi')
+
+        Trả về None nếu không dịch được.
         """
-        try:
-            if src_lang == dest_lang:
-                return text
-                
-            translation = cls._translator.translate(text, src=src_lang, dest=dest_lang)
-            return translation.text
-        except Exception as e:
-            print(f"Lỗi khi dịch văn bản: {e}")
-            return text
+        return TranslationService.translate(text, src_lang=src_lang, dest_lang=dest_lang)
 
     @classmethod
-    def log_to_file(cls, log_message, filename=None):
+    def log_event(cls, event, **fields):
         """
-        Ghi log vào file txt
+        Ghi một bản ghi log có cấu trúc (JSON Lines, logs/caption_log_YYYY-MM-DD.jsonl), không chặn request
         
         Tham số:
-            log_message: Nội dung log cần ghi
-            filename: Tên file log (mặc định là ngày hiện tại)
+            event: Loại bản ghi, vd: "caption", "stream", "bleu"
+            fields: Các trường của bản ghi (phải chuyển được sang JSON)
         """
         try:
-            if filename is None:
-                # Sử dụng ngày hiện tại làm tên file mặc định
-                filename = f"caption_log_{datetime.now().strftime('%Y-%m-%d')}.txt"
-            
-            log_path = os.path.join(cls._log_dir, filename)
-            
-            # Ghi log vào file
-            with open(log_path, "a", encoding="utf-8") as log_file:
-                log_file.write(f"{log_message}\n\n")
-                
-            return True
+            cls._log_sink.emit({"event": event, **fields})
         except Exception as e:
-            print(f"Lỗi khi ghi log vào file: {e}")
-            return False
-    
+            print(f"Lỗi khi ghi log: {e}")
+
+    @classmethod
+    def log_to_file(cls, log_message):
+        """Ghi một dòng log dạng văn bản (bản ghi "message"), giữ lại cho mã cũ"""
+        cls.log_event("message", message=log_message)
+
+    @classmethod
+    def _use_pool(cls):
+        """Có chuyển suy luận sang pool tiến trình hay không (không áp dụng bên trong chính tiến trình suy luận)"""
+        return cls._worker_count > 0 and cls._device == "cpu" and multiprocessing.parent_process() is None
+
+    @classmethod
+    def _get_pool(cls, preload=None, warmup=True):
+        """Khởi tạo (một lần) pool tiến trình suy luận"""
+        if cls._pool is None:
+            with cls._pool_lock:
+                if cls._pool is None:
+                    pool = InferencePool(
+                        cls._worker_count,
+                        threads_per_worker=cls._worker_threads,
+                        preload=preload,
+                        warmup=warmup,
+                        task_timeout=cls._worker_timeout
+                    )
+                    pool.start()
+                    cls._pool = pool
+        return cls._pool
+
+    @classmethod
+    def _get_processor(cls, model_type):
+        """
+        Lấy processor của mô hình. Khi dùng pool tiến trình, tiến trình web chỉ tải processor
+        (không tải trọng số) để tiền xử lý ảnh.
+        """
+        if not cls._use_pool():
+            return cls._get_model(model_type)[1]
+
+        name = cls._model_name(model_type)
+        processor = cls._processors.get(name)
+        if processor is None:
+            with cls._processors_lock:
+                processor = cls._processors.get(name)
+                if processor is None:
+                    processor = BlipProcessor.from_pretrained(cls._model_path(name), use_fast=True)
+                    cls._processors[name] = processor
+        return processor
+
+    @classmethod
+    def _get_batcher(cls):
+        """Khởi tạo (một lần) hàng đợi gom batch dùng chung cho mọi request"""
+        if cls._batcher is None:
+            with cls._batcher_lock:
+                if cls._batcher is None:
+                    cls._batcher = MicroBatcher(
+                        run_batch=cls._run_generate_batch,
+                        max_batch_size=cls._batch_max_size,
+                        max_wait_ms=cls._batch_max_wait_ms,
+                        name="caption",
+                        # Mỗi tiến trình suy luận chạy một batch tại một thời điểm
+                        concurrency=cls._worker_count if cls._use_pool() else 1
+                    )
+        return cls._batcher
+
+    @classmethod
+    def _encode_images(cls, model, pixel_values):
+        """
+        Chạy vision encoder, trả về image_embeds (B, S, D) dạng NumPy float32.
+        Embedding vừa tính được giải mã ở độ chính xác đầy đủ; chỉ bản lưu trong cache được làm tròn về float16.
+        """
+        if isinstance(model, OnnxCaptionBackend):
+            return np.asarray(model.encode(pixel_values), dtype=np.float32)
+
+        pixel_values = torch.from_numpy(pixel_values).to(cls._device, dtype=model_dtype(model))
+        with torch.no_grad():
+            image_embeds = model.vision_model(pixel_values=pixel_values)[0]
+        return image_embeds.float().cpu().numpy()
+
+    @classmethod
+    def _decode_embeds(cls, model, image_embeds, max_length, num_beams, on_step=None):
+        """
+        Chạy text decoder trên image_embeds, trả về các chuỗi token id.
+        Tương đương BlipForConditionalGeneration.generate nhưng bỏ qua vision encoder.
+        on_step(token_ids): Gọi sau mỗi bước với beam tốt nhất của ảnh đầu tiên; trả về True để dừng sớm.
+        """
+        if isinstance(model, OnnxCaptionBackend):
+            return model.generate_from_embeds(
+                image_embeds.astype(np.float32), max_length=max_length, num_beams=num_beams, min_length=5, on_step=on_step
+            )
+
+        embeds = torch.from_numpy(image_embeds).to(cls._device, dtype=model_dtype(model))
+        embeds_mask = torch.ones(embeds.shape[:-1], dtype=torch.long, device=embeds.device)
+        text_config = model.config.text_config
+        input_ids = torch.full((embeds.shape[0], 1), text_config.bos_token_id, dtype=torch.long, device=embeds.device)
+        with torch.no_grad():
+            return model.text_decoder.generate(
+                input_ids=input_ids,
+                eos_token_id=text_config.sep_token_id,
+                pad_token_id=text_config.pad_token_id,
+                encoder_hidden_states=embeds,
+                encoder_attention_mask=embeds_mask,
+                max_length=max_length,
+                num_beams=num_beams,
+                min_length=5,
+                stopping_criteria=StoppingCriteriaList([_StepCallback(on_step)]) if on_step is not None else None
+            )
+
+    @classmethod
+    def _run_model_batch(cls, key, items):
+        """
+        Chạy mô hình cho cả batch ảnh trong tiến trình hiện tại: vision encoder chỉ chạy cho các ảnh
+        chưa có embedding, sau đó text decoder chạy một lần cho cả batch.
+
+        Tham số:
+            key: Bộ (model_type, max_length, num_beams) chung của batch
+            items: Danh sách (embedding_key, pixel_values, image_embeds); mỗi phần tử có pixel_values float32 (1, C, H, W)
+                   hoặc image_embeds float16 (1, S, D) đã lấy từ cache
+
+        Trả về (captions, encoded): encoded[i] là bản float16 của embedding vừa tính cho ảnh i để lưu cache
+        (None nếu lấy từ cache hoặc ảnh không có embedding_key, tức cache embedding đang tắt)
+        """
+        model_type, max_length, num_beams = key
+        # Đánh dấu mô hình đang được sử dụng để không bị giải phóng giữa lúc suy luận
+        with cls._registry.acquire(cls._model_name(model_type)) as (model, processor):
+            embeds = [item[2] for item in items]
+            encoded = [None] * len(items)
+            pending = [index for index, item in enumerate(items) if item[2] is None]
+            if pending:
+                batch_embeds = cls._encode_images(model, np.concatenate([items[index][1] for index in pending], axis=0))
+                for row, index in enumerate(pending):
+                    embeds[index] = batch_embeds[row:row + 1]
+                    if items[index][0] is not None:
+                        encoded[index] = EmbeddingCacheService.compact(embeds[index])
+
+            output_ids = cls._decode_embeds(model, np.concatenate(embeds, axis=0), max_length, num_beams)
+            return processor.batch_decode(output_ids, skip_special_tokens=True), encoded
+
     @classmethod
-    def generate_caption_from_binary(cls, image_data, max_length=30, num_beams=5, speak=False, model_type="default", language="en"):
+    def _run_generate_batch(cls, key, items):
+        """Sinh caption cho một batch (trong tiến trình hoặc qua pool) và lưu embedding vừa tính vào cache"""
+        if cls._use_pool():
+            captions, encoded = cls._get_pool().run_batch(key, items)
+        else:
+            captions, encoded = cls._run_model_batch(key, items)
+
+        for (embedding_key, _, _), embeds in zip(items, encoded):
+            if embedding_key is not None and embeds is not None:
+                EmbeddingCacheService.put(embedding_key, embeds, key[0])
+        return captions
+
+    @classmethod
+    def _generate(cls, model_type, max_length, num_beams, pixel_values=None, image_embeds=None, embedding_key=None):
+        """Sinh caption tiếng Anh cho một ảnh (từ pixel_values hoặc embedding đã cache), qua hàng đợi gom batch nếu được bật"""
+        key = (model_type, int(max_length), int(num_beams))
+        item = (embedding_key, pixel_values, image_embeds)
+        if not cls._batching_enabled:
+            return cls._run_generate_batch(key, [item])[0]
+        return cls._get_batcher().run(key, item)
+
+    @classmethod
+    def _model_path(cls, model_type):
+        """Đường dẫn mô hình trên đĩa tương ứng với model_type"""
+        if model_type == "travel":
+            return cls._travel_model_path
+        if model_type in cls._extra_model_paths:
+            return cls._extra_model_paths[model_type]
+        if os.path.isdir(cls._default_model_path):
+            return cls._default_model_path
+        return cls._default_model_name
+
+    @classmethod
+    def get_stats(cls):
+        """Thống kê vận hành của dịch vụ tạo caption"""
+        return {
+            "device": cls._device,
+            "batching_enabled": cls._batching_enabled,
+            "batcher": cls._batcher.get_stats() if cls._batcher is not None else None,
+            "inference_pool": cls._pool.get_stats() if cls._pool is not None else None,
+            "models": cls._registry.get_stats(),
+            "cache": CaptionCacheService.get_stats(),
+            "embedding_cache": EmbeddingCacheService.get_stats(),
+            "decoding_presets": DecodingPresetService.get_stats(),
+            "translation": TranslationService.get_stats(),
+            "tts": TTSService.get_stats(),
+            "background": BackgroundExecutor.shared().get_stats(),
+            "log_sink": cls._log_sink.get_stats(),
+            "near_duplicate": NearDuplicateService.get_stats()
+        }
+
+    @classmethod
+    def generate_caption_from_binary(cls, image_data, max_length=30, num_beams=5, speak=False, model_type="default", language="en",
+                                     image_hash=None, perceptual_hash=None):
+        """
+        Tạo caption cho dữ liệu ảnh. image_hash (SHA-256) và perceptual_hash (pHash) đã tính khi upload giúp bỏ qua
+        việc tính lại; ảnh trùng nội dung hoặc gần trùng dùng lại caption trong cache mà không chạy mô hình.
+        """
         start_time = time.time()
-        start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_messages = []
-        log_messages.append(f"[{start_datetime}] Bắt đầu tạo mô tả ảnh...")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Bắt đầu tạo mô tả ảnh...")
+        # Nhãn chung cho các metric thời gian của từng bước
+        labels = {"model_type": model_type, "language": language}
+        # Bản ghi log có cấu trúc của request, thời gian từng bước (giây) nằm trong "stages"
+        record = {
+            "event": "caption",
+            "model_type": model_type,
+            "language": language,
+            "max_length": max_length,
+            "num_beams": num_beams,
+            "cache": "miss",
+            "stages": {}
+        }
+        stages = record["stages"]
         try:
+            # Tra cứu cache theo nội dung ảnh và tham số giải mã
+            # Backend và độ chính xác ảnh hưởng tới caption nên cũng là một phần của phiên bản mô hình
+            model_version = cls._cache_version(model_type)
+            image_hash = image_hash or CaptionCacheService.hash_image(image_data)
+            record["image_hash"] = image_hash
+            record["model_version"] = model_version
+            cache_key = CaptionCacheService.make_key(image_hash, model_type, max_length, num_beams, language, model_version)
+            cached_caption = CaptionCacheService.get(cache_key)
+            if cached_caption is not None:
+                print(f" Caption lấy từ cache ({model_type}, {language}): {cached_caption}")
+                if speak:
+                    speech_start = time.time()
+                    cls.speak_caption(cached_caption, lang=language)
+                    stages["speech"] = round(time.time() - speech_start, 4)
+                total_time = time.time() - start_time
+                MetricsService.caption_total_seconds.observe(total_time, **labels)
+                MetricsService.caption_requests_total.inc(cache="hit", outcome="ok", **labels)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Tổng thời gian tạo mô tả: {total_time:.2f}s")
+                record["cache"] = "hit"
+                cls.log_event(**record, caption=cached_caption, status="ok", total_seconds=round(total_time, 4))
+                return cached_caption
+
+            # Ảnh gần trùng (ảnh chụp liên tiếp, bản nén lại) đã có caption với cùng mô hình và tham số: dùng lại
+            near_duplicate = cls._near_duplicate_caption(
+                image_data, image_hash, perceptual_hash, model_type, max_length, num_beams, language, model_version
+            )
+            if near_duplicate is not None:
+                caption, distance = near_duplicate
+                print(f" Caption lấy từ ảnh gần trùng ({model_type}, {language}, khác {distance} bit): {caption}")
+                CaptionCacheService.put(cache_key, caption, model_type, model_version, language)
+                if speak:
+                    speech_start = time.time()
+                    cls.speak_caption(caption, lang=language)
+                    stages["speech"] = round(time.time() - speech_start, 4)
+                total_time = time.time() - start_time
+                MetricsService.caption_total_seconds.observe(total_time, **labels)
+                MetricsService.caption_requests_total.inc(cache="near_duplicate", outcome="ok", **labels)
+                record["cache"] = "near_duplicate"
+                cls.log_event(
+                    **record, near_duplicate_distance=distance, caption=caption, status="ok",
+                    total_seconds=round(total_time, 4)
+                )
+                return caption
+
             # Chọn mô hình phù hợp
             model_load_start = time.time()
+            processor = cls._get_processor(model_type)
+            model_load_seconds = time.time() - model_load_start
+            stages["model_load"] = round(model_load_seconds, 4)
+            MetricsService.caption_model_load_seconds.observe(model_load_seconds, **labels)
             if model_type == "travel":
-                cls._load_travel_model_if_needed()
-                model = cls._travel_model
-                processor = cls._travel_processor
-                log_messages.append(f"Sử dụng mô hình du lịch để tạo mô tả (tải mô hình: {time.time() - model_load_start:.2f}s)")
+                print(f"Sử dụng mô hình du lịch để tạo mô tả (tải mô hình: {model_load_seconds:.2f}s)")
+            elif model_type in cls._extra_model_paths:
+                print(f"Sử dụng mô hình {model_type} để tạo mô tả (tải mô hình: {model_load_seconds:.2f}s)")
+            else:
+                print(f"Sử dụng mô hình mặc định để tạo mô tả (tải mô hình: {model_load_seconds:.2f}s)")
+
+            # Embedding của ảnh không phụ thuộc tham số giải mã: nếu đã có trong cache thì bỏ qua xử lý ảnh và vision encoder
+            embedding_key = EmbeddingCacheService.make_key(image_hash, model_type, model_version) \
+                if EmbeddingCacheService.is_enabled() else None
+            image_embeds = EmbeddingCacheService.get(embedding_key)
+            record["embedding_cached"] = image_embeds is not None
+            pixel_values = None
+            if image_embeds is not None:
+                print("Embedding ảnh lấy từ cache, chỉ chạy text decoder")
             else:
-                cls._load_default_model_if_needed()
-                model = cls._default_model
-                processor = cls._default_processor
-                log_messages.append(f"Sử dụng mô hình mặc định để tạo mô tả (tải mô hình: {time.time() - model_load_start:.2f}s)")
-            print(log_messages[-1])
-
-            # Chuyển dữ liệu nhị phân thành đối tượng PIL Image
-            image_process_start = time.time()
-            image = Image.open(io.BytesIO(image_data)).convert("RGB")
-            inputs = processor(image, return_tensors="pt")
-            for k, v in inputs.items():
-                inputs[k] = v.to(cls._device)
-            log_messages.append(f"Xử lý ảnh: {time.time() - image_process_start:.2f}s")
-            print(log_messages[-1])
-
-            # Tạo mô tả
+                # Giải mã và tiền xử lý ảnh thành pixel_values
+                image_process_start = time.time()
+                pixel_values = cls._preprocess(image_data, processor)
+                image_process_seconds = time.time() - image_process_start
+                stages["preprocess"] = round(image_process_seconds, 4)
+                MetricsService.caption_preprocess_seconds.observe(image_process_seconds, **labels)
+                print(f"Xử lý ảnh: {image_process_seconds:.2f}s")
+
+            # Tạo mô tả (gom batch với các yêu cầu đồng thời có cùng mô hình và tham số giải mã)
             caption_start = time.time()
-            with torch.no_grad():
-                output_ids = model.generate(
-                    **inputs,
-                    max_length=max_length,
-                    num_beams=num_beams,
-                    min_length=5
-                )
-            caption_en = processor.decode(output_ids[0], skip_special_tokens=True)
-            log_messages.append(f"Tạo mô tả: {time.time() - caption_start:.2f}s")
-            log_messages.append(f" Caption tiếng Anh ({model_type}): {caption_en}")
-            print(log_messages[-2])
-            print(log_messages[-1])
+            caption_en = cls._generate(
+                model_type, max_length, num_beams,
+                pixel_values=pixel_values, image_embeds=image_embeds, embedding_key=embedding_key
+            )
+            caption_seconds = time.time() - caption_start
+            stages["generate"] = round(caption_seconds, 4)
+            record["caption_en"] = caption_en
+            MetricsService.caption_generate_seconds.observe(caption_seconds, **labels)
+            # Chỉ ghi nhận lượt chạy đủ vision encoder + text decoder để ước lượng độ trễ không bị lạc quan
+            if image_embeds is None:
+                DecodingPresetService.record(model_type, max_length, num_beams, caption_seconds)
+            print(f"Tạo mô tả: {caption_seconds:.2f}s")
+            print(f" Caption tiếng Anh ({model_type}): {caption_en}")
 
             # Nếu người dùng chọn tiếng Việt, dịch caption sang tiếng Việt
             if language == "vi":
                 translation_start = time.time()
                 caption_vi = cls.translate_text(caption_en, src_lang="en", dest_lang="vi")
-                log_messages.append(f"Dịch sang tiếng Việt: {time.time() - translation_start:.2f}s")
-                log_messages.append(f" Caption tiếng Việt ({model_type}): {caption_vi}")
-                print(log_messages[-2])
-                print(log_messages[-1])
+                translation_seconds = time.time() - translation_start
+                stages["translation"] = round(translation_seconds, 4)
+                MetricsService.caption_translation_seconds.observe(translation_seconds, **labels)
+                print(f"Dịch sang tiếng Việt: {translation_seconds:.2f}s")
+                print(f" Caption tiếng Việt ({model_type}): {caption_vi}")
                 caption = caption_vi
             else:
                 caption = caption_en
 
+            if caption is None:
+                # Không dịch được: trả về caption tiếng Anh nhưng không lưu cache dưới khóa tiếng Việt
+                print(" Không dịch được caption, trả về caption tiếng Anh")
+                caption = caption_en
+            else:
+                CaptionCacheService.put(cache_key, caption, model_type, model_version, language)
+
             if speak:
                 speech_start = time.time()
                 cls.speak_caption(caption, lang=language)
-                log_messages.append(f"Phát âm: {time.time() - speech_start:.2f}s")
-                print(log_messages[-1])
+                stages["speech"] = round(time.time() - speech_start, 4)
+                print(f"Phát âm: {stages['speech']:.2f}s")
 
             total_time = time.time() - start_time
-            log_messages.append(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Tổng thời gian tạo mô tả: {total_time:.2f}s")
-            print(log_messages[-1])
+            MetricsService.caption_total_seconds.observe(total_time, **labels)
+            MetricsService.caption_requests_total.inc(cache="miss", outcome="ok", **labels)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Tổng thời gian tạo mô tả: {total_time:.2f}s")
 
-            # Lưu tất cả log vào file
-            cls.log_to_file("\n".join(log_messages))
+            # Ghi bản ghi log của request (không chặn, được ghi theo lô ở background)
+            cls.log_event(**record, caption=caption, status="ok", total_seconds=round(total_time, 4))
 
             return caption
         except Exception as e:
-            end_time = time.time()
-            error_message = f"Lỗi khi tạo caption: {e}"
-            time_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Tổng thời gian (có lỗi): {end_time - start_time:.2f}s"
-            log_messages.append(error_message)
-            log_messages.append(time_message)
-            print(error_message)
-            print(time_message)
-            cls.log_to_file("\n".join(log_messages))
+            total_time = time.time() - start_time
+            MetricsService.caption_requests_total.inc(cache="miss", outcome="error", **labels)
+            print(f"Lỗi khi tạo caption: {e}")
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Tổng thời gian (có lỗi): {total_time:.2f}s")
+            cls.log_event(**record, status="error", error=f"{type(e).__name__}: {e}", total_seconds=round(total_time, 4))
             raise
 
+    @classmethod
+    def _near_duplicate_caption(cls, image_data, image_hash, perceptual_hash, model_type, max_length, num_beams, language, model_version):
+        """Caption đã có trong cache của ảnh gần trùng gần nhất, trả về (caption, khoảng cách) hoặc None"""
+        if not NearDuplicateService.is_enabled():
+            return None
+        perceptual_hash = perceptual_hash or NearDuplicateService.compute(image_data)
+        # Chỉ thử vài ảnh gần nhất để giới hạn số lần tra cache
+        for distance, other_hash in NearDuplicateService.find(perceptual_hash, exclude=image_hash)[:5]:
+            key = CaptionCacheService.make_key(other_hash, model_type, max_length, num_beams, language, model_version)
+            caption = CaptionCacheService.get(key)
+            if caption is not None:
+                return caption, distance
+        return None
+
+    @classmethod
+    def open_stream(cls, user_id):
+        """Đăng ký một phiên stream caption, trả về (stream_id, cancel_event)"""
+        from models.caption_stream import CaptionStream
+        stream_id = uuid.uuid4().hex
+        cancel_event = threading.Event()
+        with cls._streams_lock:
+            cls._streams[stream_id] = (user_id, cancel_event)
+        try:
+            CaptionStream(stream_id=stream_id, user_id=str(user_id)).save(force_insert=True)
+        except Exception as e:
+            # Vẫn stream được; chỉ yêu cầu hủy tới đúng worker này (hoặc ngắt kết nối) mới có tác dụng
+            print(f"Không thể lưu phiên stream {stream_id}: {e}")
+        cls._ensure_stream_watcher()
+        return stream_id, cancel_event
+
+    @classmethod
+    def close_stream(cls, stream_id):
+        from models.caption_stream import CaptionStream
+        with cls._streams_lock:
+            cls._streams.pop(stream_id, None)
+        BackgroundExecutor.shared().submit(
+            lambda: CaptionStream.objects(stream_id=stream_id).delete(), name="caption_stream_close"
+        )
+
+    @classmethod
+    def cancel_stream(cls, stream_id, user_id):
+        """
+        Hủy phiên stream của người dùng; trả về False nếu không tìm thấy.
+        Phiên của worker khác được đánh dấu hủy trong MongoDB, worker đó dừng giải mã sau tối đa
+        CAPTION_STREAM_CANCEL_POLL_SECONDS giây.
+        """
+        from models.caption_stream import CaptionStream
+        with cls._streams_lock:
+            entry = cls._streams.get(stream_id)
+        if entry is not None:
+            if entry[0] != user_id:
+                return False
+            entry[1].set()
+            return True
+        return bool(CaptionStream.objects(stream_id=stream_id, user_id=str(user_id)).update_one(set__cancelled=True))
+
+    @classmethod
+    def _ensure_stream_watcher(cls):
+        """Khởi động (một lần) thread nền đọc cờ hủy của các phiên stream đang chạy trong tiến trình"""
+        if cls._stream_watcher is not None:
+            return
+        with cls._streams_lock:
+            if cls._stream_watcher is not None:
+                return
+            cls._stream_watcher = threading.Thread(target=cls._watch_stream_cancels, name="caption-stream-cancel", daemon=True)
+            cls._stream_watcher.start()
+
+    @classmethod
+    def _watch_stream_cancels(cls):
+        from models.caption_stream import CaptionStream
+        while True:
+            time.sleep(cls._stream_cancel_poll_seconds)
+            with cls._streams_lock:
+                stream_ids = list(cls._streams.keys())
+            if not stream_ids:
+                continue
+            try:
+                cancelled = CaptionStream.objects(stream_id__in=stream_ids, cancelled=True).scalar('stream_id')
+                with cls._streams_lock:
+                    for stream_id in cancelled:
+                        entry = cls._streams.get(stream_id)
+                        if entry is not None:
+                            entry[1].set()
+            except Exception as e:
+                print(f"Lỗi khi đọc cờ hủy stream caption: {e}")
+
+    @classmethod
+    def stream_num_beams(cls, num_beams):
+        """num_beams thực tế khi stream: beam search lớn làm caption tạm thời nhảy liên tục nên bị giới hạn"""
+        return max(1, min(int(num_beams), cls._stream_max_beams))
+
+    @classmethod
+    def stream_caption(cls, image_data, max_length=30, num_beams=1, model_type="default", language="en", cancel_event=None,
+                       image_hash=None):
+        """
+        Sinh caption và trả về dần các sự kiện trong lúc giải mã:
+        - {"type": "partial", "caption": ...}: caption tiếng Anh tạm thời sau mỗi token mới.
+        - {"type": "ping"}: Giữ kết nối khi chưa có token mới (vd: đang tải mô hình).
+        - {"type": "done", "caption": ..., "caption_en": ..., "cached": ...}: Caption hoàn chỉnh (đã dịch nếu cần).
+        Khi cancel_event được bật hoặc generator bị đóng (client ngắt kết nối), việc giải mã dừng ở bước kế tiếp.
+        Chỉ dùng greedy hoặc beam nhỏ (tối đa CAPTION_STREAM_MAX_BEAMS).
+        """
+        cancel_event = cancel_event or threading.Event()
+        num_beams = cls.stream_num_beams(num_beams)
+        start_time = time.time()
+
+        model_version = cls._cache_version(model_type)
+        image_hash = image_hash or CaptionCacheService.hash_image(image_data)
+        cache_key = CaptionCacheService.make_key(image_hash, model_type, max_length, num_beams, language, model_version)
+        cached_caption = CaptionCacheService.get(cache_key)
+        if cached_caption is not None:
+            yield {"type": "done", "caption": cached_caption, "caption_en": None, "cached": True}
+            return
+
+        if cls._use_pool():
+            # Pool tiến trình không hỗ trợ trả về từng bước, chỉ gửi caption hoàn chỉnh
+            caption = cls.generate_caption_from_binary(image_data, max_length, num_beams, False, model_type, language, image_hash)
+            yield {"type": "done", "caption": caption, "caption_en": None, "cached": False}
+            return
+
+        events = queue.Queue()
+
+        def run():
+            try:
+                embedding_key = EmbeddingCacheService.make_key(image_hash, model_type, model_version)
+                with cls._registry.acquire(cls._model_name(model_type)) as (model, processor):
+                    image_embeds = EmbeddingCacheService.get(embedding_key)
+                    if image_embeds is None:
+                        image_embeds = cls._encode_images(model, cls._preprocess(image_data, processor))
+                        EmbeddingCacheService.put(embedding_key, image_embeds, model_type)
+
+                    def on_step(token_ids):
+                        events.put(("partial", processor.decode(token_ids, skip_special_tokens=True)))
+                        return cancel_event.is_set()
+
+                    output_ids = cls._decode_embeds(model, image_embeds, max_length, num_beams, on_step=on_step)
+                    if cancel_event.is_set():
+                        events.put(("cancelled", None))
+                        return
+                    events.put(("caption", processor.decode(output_ids[0], skip_special_tokens=True)))
+            except Exception as e:
+                events.put(("error", e))
+
+        threading.Thread(target=run, name="caption-stream", daemon=True).start()
+        try:
+            last_partial = None
+            while True:
+                try:
+                    kind, value = events.get(timeout=cls._stream_heartbeat_seconds)
+                except queue.Empty:
+                    yield {"type": "ping"}
+                    continue
+
+                if kind == "partial":
+                    if value and value != last_partial:
+                        last_partial = value
+                        yield {"type": "partial", "caption": value}
+                elif kind == "error":
+                    raise value
+                elif kind == "cancelled":
+                    return
+                else:
+                    caption_en = value
+                    caption = cls.translate_text(caption_en, src_lang="en", dest_lang="vi") if language == "vi" else caption_en
+                    if caption is None:
+                        # Không dịch được: trả về caption tiếng Anh nhưng không lưu cache dưới khóa tiếng Việt
+                        caption = caption_en
+                    else:
+                        CaptionCacheService.put(cache_key, caption, model_type, model_version, language)
+                    cls.log_event(
+                        "stream", model_type=model_type, language=language, max_length=max_length,
+                        num_beams=num_beams, image_hash=image_hash, caption_en=caption_en, caption=caption,
+                        status="ok", total_seconds=round(time.time() - start_time, 4)
+                    )
+                    yield {"type": "done", "caption": caption, "caption_en": caption_en, "cached": False}
+                    return
+        finally:
+            # Generator bị đóng giữa chừng (client ngắt kết nối): dừng giải mã để giải phóng mô hình
+            cancel_event.set()
+
     @classmethod
     def generate_caption_from_image_id(cls, image_id, max_length=30, num_beams=5, speak=False, model_type="default", language="en"):
         """
@@ -307,4 +951,62 @@ class ImageCaptionService:
         if not image_doc:
             raise ValueError("Không tìm thấy ảnh với ID cung cấp")
 
-        return cls.generate_caption_from_binary(image_doc.image_data, max_length, num_beams, speak, model_type, language)
\ No newline at end of file
+        return cls.generate_caption_from_binary(
+            image_doc.get_image_data(), max_length, num_beams, speak, model_type, language,
+            image_doc.image_hash, image_doc.perceptual_hash
+        )
+
+
+
+ImageCaptionService._registry.register(
+    "default",
+    ImageCaptionService._load_default_model,
+    warmup=ImageCaptionService._warmup_model,
+    estimate=lambda: ImageCaptionService._estimate_model_bytes(ImageCaptionService._default_model_path)
+)
+ImageCaptionService._registry.register(
+    "travel",
+    ImageCaptionService._load_travel_model,
+    warmup=ImageCaptionService._warmup_model,
+    estimate=lambda: ImageCaptionService._estimate_model_bytes(ImageCaptionService._travel_model_path)
+)
+for _name, _path in ImageCaptionService._extra_model_paths.items():
+    ImageCaptionService._registry.register(
+        _name,
+        lambda name=_name, path=_path: ImageCaptionService._load_local_model(name, path),
+        warmup=ImageCaptionService._warmup_model,
+        estimate=lambda path=_path: ImageCaptionService._estimate_model_bytes(path)
+    )
+
+
+def _queue_depths():
+    depths = {
+        ("background",): BackgroundExecutor.shared().queue_depth(),
+        ("log_sink",): ImageCaptionService._log_sink.queue_depth()
+    }
+    if ImageCaptionService._batcher is not None:
+        depths[("caption_batcher",)] = ImageCaptionService._batcher.get_stats()["queued"]
+    if ImageCaptionService._pool is not None:
+        depths[("inference_pool",)] = ImageCaptionService._pool.get_stats()["in_flight"]
+    return depths
+
+
+MetricsService.register_gauge(
+    "caption_queue_depth", "Số tác vụ đang chờ trong các hàng đợi", ("queue",), _queue_depths
+)
+MetricsService.register_gauge(
+    "caption_model_resident_bytes", "Bộ nhớ của các mô hình đang nạp trong tiến trình web", ("model",),
+    lambda: {
+        (name,): status["footprint_bytes"] or 0
+        for name, status in ImageCaptionService._registry.status().items() if status["state"] == "ready"
+    }
+)
+MetricsService.register_gauge(
+    "caption_cache_entries", "Số mục trong các cache", ("cache",),
+    lambda: {
+        ("caption",): CaptionCacheService.get_stats()["memory_entries"],
+        ("embedding",): EmbeddingCacheService.get_stats()["entries"],
+        ("translation",): TranslationService.get_stats()["cache_entries"],
+        ("tts",): TTSService.get_stats()["entries"]
+    }
+)
@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Thay đổi khi cách tiền xử lý thay đổi để cache caption cũ không còn được dùng
+PREPROCESS_VERSION = "pp1"
+
+_params_cache = {}
+
+
+def _config_key(image_processor):
+    """Khóa cache theo giá trị cấu hình (không theo id của đối tượng, vốn có thể được dùng lại sau khi processor bị giải phóng)"""
+    return (
+        repr(image_processor.size),
+        tuple(np.atleast_1d(image_processor.image_mean).tolist()),
+        tuple(np.atleast_1d(image_processor.image_std).tolist()),
+        float(image_processor.rescale_factor),
+        bool(image_processor.do_rescale),
+        bool(image_processor.do_normalize),
+        int(image_processor.resample)
+    )
+
+
+def preprocess_params(processor):
+    """Đọc tham số resize/chuẩn hóa từ image processor của BLIP (được cache theo cấu hình của processor)"""
+    image_processor = getattr(processor, "image_processor", processor)
+    key = _config_key(image_processor)
+    params = _params_cache.get(key)
+    if params is not None:
+        return params
+
+    size = image_processor.size
+    if isinstance(size, int):
+        width = height = size
+    else:
+        # size có thể là dict hoặc SizeDict tùy phiên bản transformers
+        lookup = size.get if isinstance(size, dict) else lambda name: getattr(size, name, None)
+        height = lookup("height") or lookup("shortest_edge")
+        width = lookup("width") or height
+
+    mean = np.asarray(image_processor.image_mean, dtype=np.float32)
+    std = np.asarray(image_processor.image_std, dtype=np.float32)
+    scale = float(image_processor.rescale_factor) if image_processor.do_rescale else 1.0
+    if not image_processor.do_normalize:
+        mean = np.zeros(3, dtype=np.float32)
+        std = np.ones(3, dtype=np.float32)
+
+    params = {
+        "size": (int(width), int(height)),
+        "resample": int(image_processor.resample),
+        # (x * scale - mean) / std = x * (scale / std) - mean / std, tính một lần cho cả ảnh
+        "multiplier": (scale / std).astype(np.float32),
+        "offset": (mean / std).astype(np.float32)
+    }
+    _params_cache[key] = params
+    return params
+
+
+def load_image(image_data, target_size, draft=True):
+    """
+    Giải mã ảnh thành PIL RGB đã xoay đúng theo EXIF.
+    - JPEG: giải mã ở độ phân giải giảm (1/2, 1/4, 1/8) nhưng vẫn không nhỏ hơn target_size.
+    - Định dạng khác: thu nhỏ nhanh bằng reduce() nếu ảnh lớn hơn nhiều so với target_size.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    is_jpeg = image.format == "JPEG"
+    # Ảnh có thể bị xoay 90 độ theo EXIF nên yêu cầu cả hai chiều không nhỏ hơn cạnh lớn của target
+    side = max(target_size)
+    if draft and is_jpeg:
+        image.draft("RGB", (side, side))
+
+    image = ImageOps.exif_transpose(image)
+
+    if draft and not is_jpeg:
+        factor = min(image.width, image.height) // (2 * side)
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    return image.convert("RGB")
+
+
+def preprocess_image(image_data, processor, draft=True):
+    """
+    Tạo pixel_values (1, 3, H, W) float32 giống đầu ra của BlipProcessor:
+    resize bicubic về kích thước của mô hình, rescale và chuẩn hóa theo mean/std bằng NumPy.
+    """
+    params = preprocess_params(processor)
+    image = load_image(image_data, params["size"], draft=draft)
+    if image.size != params["size"]:
+        image = image.resize(params["size"], resample=params["resample"])
+
+    pixels = np.asarray(image, dtype=np.float32)
+    pixels *= params["multiplier"]
+    pixels -= params["offset"]
+    return np.ascontiguousarray(pixels.transpose(2, 0, 1))[None]
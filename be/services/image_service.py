@@ -2,52 +2,123 @@
 from models.image import Image
 from models.report import Report
 from models.user import User
+from services.image_blob_service import ImageBlobService
+from services.near_duplicate_service import NearDuplicateService
+from services.pagination import paginate, keyset_paginate
 import uuid
+import datetime
 from werkzeug.utils import secure_filename
 import io
 from flask import send_file
 
 class ImageService:
+    # Các trường dùng cho danh sách ảnh: chỉ thông tin, không có dữ liệu nhị phân
+    SUMMARY_FIELDS = ('id', 'description', 'created_at', 'location', 'uploaded_by')
     
     @staticmethod
-    def upload_image(file, description, user_id, location=None):
-        """Tải lên hình ảnh mới vào MongoDB"""
+    def upload_image(file, description, user_id, location=None, original_file_name=None):
+        """
+        Tải lên hình ảnh mới vào MongoDB.
+        Dữ liệu ảnh được lưu một lần theo SHA-256 (ImageBlob); ảnh trùng nội dung chỉ tăng bộ đếm tham chiếu.
+        """
         # Tạo tên tệp duy nhất
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
         
-        # Đọc dữ liệu nhị phân từ file
-        file_data = file.read()
+        # Đọc dữ liệu nhị phân từ file, đồng thời tính SHA-256
+        image_hash, file_data = ImageBlobService.read_and_hash(file.stream)
+        ImageBlobService.acquire(image_hash, file_data, file.content_type)
+        # pHash để tìm ảnh gần trùng (ảnh chụp liên tiếp, bản nén lại) và dùng lại caption
+        perceptual_hash = NearDuplicateService.compute(file_data) if NearDuplicateService.is_enabled() else None
         
         # Tạo bản ghi hình ảnh
         user = User.objects(id=user_id).first()
         image = Image(
             description=description,
             file_name=unique_filename,
+            original_file_name=original_file_name or file.filename,
             content_type=file.content_type,
-            image_data=file_data,
+            image_hash=image_hash,
+            perceptual_hash=perceptual_hash,
             uploaded_by=user,
             location=location
         )
-        image.save()
+        if perceptual_hash:
+            # Đặt ngay trước khi lưu (không phải lúc tạo document) để worker khác không bỏ sót ảnh lưu chậm
+            image.phash_at = datetime.datetime.now()
+        try:
+            image.save()
+        except Exception:
+            ImageBlobService.release(image_hash)
+            raise
+        # Giữ dữ liệu vừa đọc để tạo caption mà không phải đọc lại blob
+        image._blob_data = file_data
+        NearDuplicateService.add(perceptual_hash, image_hash)
         
         return image
     
     @staticmethod
-    def get_all_images(page=1, per_page=20):
-        """Lấy tất cả hình ảnh với phân trang"""
-        return Image.objects.order_by('-created_at').paginate(page=page, per_page=per_page)
+    def _summary_query(queryset):
+        """
+        Chỉ lấy các trường thông tin của ảnh (SUMMARY_FIELDS) và không tự nạp User được tham chiếu:
+        uploaded_by là DBRef, dùng get_users_by_id để lấy người upload của cả trang trong một truy vấn
+        """
+        return queryset.only(*ImageService.SUMMARY_FIELDS).no_dereference()
     
     @staticmethod
-    def get_user_images(user_id, page=1, per_page=20):
-        """Lấy tất cả hình ảnh được tải lên bởi một người dùng cụ thể"""
-        user = User.objects(id=user_id).first()
-        return Image.objects(uploaded_by=user).order_by('-created_at').paginate(page=page, per_page=per_page)
+    def to_summary(image):
+        """Thông tin ảnh trả về trong các API danh sách"""
+        return {
+            'id': str(image.id),
+            'description': image.description,
+            'url': f"/api/images/file/{str(image.id)}",
+            'created_at': image.created_at.isoformat() if image.created_at else None,
+            'location': image.location
+        }
+    
+    @staticmethod
+    def get_users_by_id(refs, *fields):
+        """Lấy các User được tham chiếu (DBRef, ObjectId hoặc User) trong một truy vấn, chỉ các trường cần dùng"""
+        ids = {getattr(ref, 'id', ref) for ref in refs if ref is not None}
+        if not ids:
+            return {}
+        return {user.id: user for user in User.objects(id__in=list(ids)).only(*fields)}
+    
+    @staticmethod
+    def get_images_by_id(refs, *fields):
+        """Lấy các Image được tham chiếu trong một truy vấn, chỉ các trường cần dùng (không có dữ liệu nhị phân)"""
+        ids = {getattr(ref, 'id', ref) for ref in refs if ref is not None}
+        if not ids:
+            return {}
+        return {image.id: image for image in Image.objects(id__in=list(ids)).only(*(fields or ImageService.SUMMARY_FIELDS)).no_dereference()}
+    
+    @staticmethod
+    def _page(queryset, page, per_page, cursor, total):
+        """Phân trang theo cursor (created_at, _id) khi có cursor (chuỗi rỗng = trang đầu), ngược lại theo page"""
+        if cursor is not None:
+            return keyset_paginate(queryset, cursor, per_page, total)
+        return paginate(queryset.order_by('-created_at', '-id'), page, per_page)
+    
+    @staticmethod
+    def get_all_images(page=1, per_page=20, cursor=None, total=None):
+        """Lấy tất cả hình ảnh với phân trang (chỉ thông tin, không có dữ liệu ảnh)"""
+        return ImageService._page(ImageService._summary_query(Image.objects), page, per_page, cursor, total)
+    
+    @staticmethod
+    def get_user_images(user_id, page=1, per_page=20, cursor=None, total=None):
+        """Lấy tất cả hình ảnh được tải lên bởi một người dùng cụ thể (chỉ thông tin, không có dữ liệu ảnh)"""
+        user = User.objects(id=user_id).only('id').first()
+        return ImageService._page(ImageService._summary_query(Image.objects(uploaded_by=user)), page, per_page, cursor, total)
+    
+    @staticmethod
+    def get_images_by_location(location):
+        """Lấy tất cả hình ảnh ở một địa điểm (chỉ thông tin, không có dữ liệu ảnh)"""
+        return ImageService._summary_query(Image.objects(location=location).order_by('-created_at'))
     
     @staticmethod
     def get_image_by_id(image_id):
-        """Lấy hình ảnh theo ID"""
-        return Image.objects(id=image_id).first()
+        """Lấy hình ảnh theo ID (không tải image_data của ảnh cũ; dùng image.get_image_data() khi cần dữ liệu)"""
+        return Image.objects(id=image_id).exclude('image_data').first()
     
     @staticmethod
     def get_image_data(image_id):
@@ -63,7 +134,8 @@ class ImageService:
                 from flask import abort
                 return abort(404, description="Không tìm thấy ảnh")
             
-            if not hasattr(image, 'image_data') or not image.image_data:
+            image_data = image.get_image_data()
+            if not image_data:
                 from flask import abort
                 return abort(404, description="Không có dữ liệu ảnh")
             
@@ -72,7 +144,7 @@ class ImageService:
             
             # Sử dụng các tham số cơ bản mà tất cả các phiên bản Flask đều hỗ trợ
             return send_file(
-                io.BytesIO(image.image_data),
+                io.BytesIO(image_data),
                 mimetype=mimetype,
                 as_attachment=False
             )
@@ -90,8 +162,8 @@ class ImageService:
     @staticmethod
     def update_image(image_id, user_id, description):
         """Cập nhật mô tả hình ảnh"""
-        image = Image.objects(id=image_id).first()
-        user = User.objects(id=user_id).first()
+        image = Image.objects(id=image_id).only('uploaded_by').no_dereference().first()
+        user = User.objects(id=user_id).only('role').first()
         
         if not image or not user:
             return False
@@ -101,8 +173,7 @@ class ImageService:
             return False
         
         # Cập nhật mô tả
-        image.description = description
-        image.save()
+        Image.objects(id=image.id).update_one(set__description=description)
         return True
     
     @staticmethod
@@ -118,11 +189,20 @@ class ImageService:
         if str(image.uploaded_by.id) != user_id and user.role != 'admin':
             return False
         
-        # Xóa bản ghi hình ảnh (dữ liệu nhị phân cũng sẽ bị xóa)
+        # Xóa bản ghi hình ảnh và bỏ tham chiếu tới dữ liệu nhị phân dùng chung
         image.delete()
+        ImageService._release_image_data(image)
         
         return True
     
+    @staticmethod
+    def _release_image_data(image):
+        """Bỏ tham chiếu tới dữ liệu ảnh dùng chung; khi không còn ảnh nào dùng thì xóa khỏi chỉ mục ảnh gần trùng"""
+        if image.image_data:
+            return
+        if ImageBlobService.release(image.image_hash):
+            NearDuplicateService.remove(image.perceptual_hash, image.image_hash)
+    
     @staticmethod
     def admin_delete_image(image_id):
         """Chức năng admin để xóa bất kỳ hình ảnh nào"""
@@ -131,22 +211,23 @@ class ImageService:
         if not image:
             return False
         
-        # Xóa bản ghi hình ảnh
+        # Xóa bản ghi hình ảnh và bỏ tham chiếu tới dữ liệu nhị phân dùng chung
         image.delete()
+        ImageService._release_image_data(image)
         
         return True
     
     @staticmethod
     def report_image(image_id, user_id, reason):
         """Báo cáo hình ảnh không phù hợp"""
-        image = Image.objects(id=image_id).first()
-        user = User.objects(id=user_id).first()
+        image = Image.objects(id=image_id).only('id').first()
+        user = User.objects(id=user_id).only('id').first()
         
         if not image or not user:
             return False
         
         # Kiểm tra xem người dùng đã báo cáo ảnh này chưa
-        existing_report = Report.objects(image=image, reported_by=user).first()
+        existing_report = Report.objects(image=image, reported_by=user).no_dereference().first()
         if existing_report:
             # Cập nhật lý do báo cáo nếu đã tồn tại
             existing_report.reason = reason
@@ -165,13 +246,14 @@ class ImageService:
         return True
 
     @staticmethod
-    def get_reports(page=1, per_page=20, status=None):
+    def get_reports(page=1, per_page=20, status=None, cursor=None, total=None):
         """Lấy danh sách báo cáo (chỉ admin)"""
         query = {}
         if status:
             query['status'] = status
         
-        return Report.objects(**query).order_by('-created_at').paginate(page=page, per_page=per_page)
+        # Không tự nạp ảnh/người báo cáo của từng báo cáo; dùng get_images_by_id/get_users_by_id cho cả trang
+        return ImageService._page(Report.objects(**query).no_dereference(), page, per_page, cursor, total)
 
     @staticmethod
     def update_report_status(report_id, status):
@@ -181,7 +263,7 @@ class ImageService:
         if status not in valid_statuses:
             return False
             
-        report = Report.objects(id=report_id).first()
+        report = Report.objects(id=report_id).no_dereference().first()
         
         if not report:
             return False
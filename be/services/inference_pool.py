@@ -0,0 +1,378 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_ALIGNMENT = 64
+
+
+def partition_cores(num_workers, cores=None):
+    """Chia các core mà tiến trình được phép dùng thành num_workers nhóm liên tiếp, không chồng lấn nếu đủ core"""
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if num_workers >= len(cores):
+        return [[cores[index % len(cores)]] for index in range(num_workers)]
+
+    size, extra = divmod(len(cores), num_workers)
+    groups = []
+    start = 0
+    for index in range(num_workers):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def pack_arrays(arrays):
+    """
+    Ghi danh sách mảng NumPy vào một vùng shared memory.
+    Trả về (shm, specs) với specs = [(offset, shape, dtype)] để tiến trình khác đọc lại.
+    """
+    specs = []
+    size = 0
+    for array in arrays:
+        size = (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+        specs.append((size, tuple(array.shape), array.dtype.str))
+        size += array.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for array, (offset, shape, dtype) in zip(arrays, specs):
+        target = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        target[...] = array
+        del target
+    return shm, specs
+
+
+def unpack_arrays(name, specs, unlink=False):
+    """Đọc (sao chép) các mảng từ vùng shared memory name, có thể xóa vùng nhớ sau khi đọc"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = []
+        for offset, shape, dtype in specs:
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            arrays.append(view.copy())
+            del view
+        return arrays
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _release_shm(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _worker_main(index, cores, num_threads, preload, warmup, tasks, results):
+    """
+    Vòng lặp của một tiến trình suy luận: gắn vào nhóm core riêng, tự tải mô hình
+    và chạy từng batch nhận được qua hàng đợi.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Không đổi được sau khi torch đã chạy song song lần đầu
+        pass
+
+    from services.image_caption_service import ImageCaptionService
+
+    try:
+        if preload:
+            ImageCaptionService.preload_models(preload, warmup=warmup)
+        results.put(("ready", index, None, None))
+    except Exception as e:
+        results.put(("ready", index, None, f"{type(e).__name__}: {e}"))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        task_id, key, shm_name, specs, kinds, embedding_keys = task
+        results.put(("started", index, task_id, None))
+        try:
+            arrays = unpack_arrays(shm_name, specs)
+            # embedding_key được giữ nguyên để _run_model_batch biết ảnh nào cần trả embedding về để lưu cache
+            items = [
+                (embedding_key, array, None) if kind == "pixels" else (embedding_key, None, array)
+                for kind, array, embedding_key in zip(kinds, arrays, embedding_keys)
+            ]
+            captions, encoded = ImageCaptionService._run_model_batch(key, items)
+
+            # Embedding vừa tính được gửi lại tiến trình chính (để lưu cache) qua shared memory
+            encoded_rows = [row for row, embeds in enumerate(encoded) if embeds is not None]
+            encoded_payload = None
+            if encoded_rows:
+                shm, encoded_specs = pack_arrays([encoded[row] for row in encoded_rows])
+                shm.close()
+                encoded_payload = (shm.name, encoded_specs, encoded_rows)
+            results.put(("done", index, task_id, (captions, encoded_payload)))
+        except Exception as e:
+            results.put(("error", index, task_id, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Thông tin của một tiến trình suy luận trong pool"""
+
+    def __init__(self, index, cores, num_threads):
+        self.index = index
+        self.cores = cores
+        self.num_threads = num_threads
+        self.process = None
+        self.ready = False
+        self.error = None
+        self.task_id = None
+        self.started_at = None
+        self.restarts = 0
+        self.completed = 0
+
+    def to_dict(self):
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.process is not None and self.process.is_alive(),
+            "ready": self.ready,
+            "busy": self.task_id is not None,
+            "cores": self.cores,
+            "num_threads": self.num_threads,
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "error": self.error
+        }
+
+
+class InferencePool:
+    """
+    Pool gồm N tiến trình suy luận, mỗi tiến trình có trình thông dịch và bản mô hình riêng:
+    - Mỗi tiến trình được gắn vào một nhóm core riêng với số thread torch tương ứng,
+      tránh tranh chấp GIL và tránh các thread intra-op chiếm quá số core.
+    - Tensor ảnh đã tiền xử lý được chuyển qua shared memory thay vì pickle qua pipe.
+    - Tiến trình bị chết được khởi động lại; batch đang chạy trên tiến trình đó trả về lỗi.
+    """
+
+    def __init__(self, num_workers, threads_per_worker=None, preload=None, warmup=True, task_timeout=120.0):
+        """
+        Tham số:
+            num_workers: Số tiến trình suy luận
+            threads_per_worker: Số thread torch mỗi tiến trình (mặc định: số core được gán)
+            preload: Danh sách model_type mỗi tiến trình tải trước khi báo sẵn sàng
+            warmup: Có chạy suy luận khởi động sau khi tải trước hay không
+            task_timeout: Thời gian tối đa (giây) chờ kết quả của một batch
+        """
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self.preload = list(preload or [])
+        self.warmup = warmup
+        self.task_timeout = task_timeout
+
+        self._workers = [
+            _Worker(index, cores, int(threads_per_worker or len(cores)))
+            for index, cores in enumerate(partition_cores(max(1, int(num_workers))))
+        ]
+        self._lock = threading.Lock()
+        self._pending = {}  # task_id -> (future, shm, submitted_at)
+        self._task_ids = itertools.count(1)
+        self._closed = False
+        self._collector = None
+
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "restarts": 0
+        }
+
+    @property
+    def num_workers(self):
+        return len(self._workers)
+
+    def start(self):
+        """Khởi động các tiến trình và thread nhận kết quả"""
+        with self._lock:
+            if self._collector is not None:
+                return
+            for worker in self._workers:
+                self._spawn(worker)
+            self._collector = threading.Thread(target=self._collect_results, name="inference-pool-collector", daemon=True)
+            self._collector.start()
+        print(f"Đã khởi động {self.num_workers} tiến trình suy luận: " +
+              ", ".join(f"#{w.index} core {w.cores} ({w.num_threads} thread)" for w in self._workers))
+
+    def _spawn(self, worker):
+        worker.ready = False
+        worker.task_id = None
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.index, worker.cores, worker.num_threads, self.preload, self.warmup, self._tasks, self._results),
+            name=f"caption-worker-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+
+    def submit(self, key, items):
+        """
+        Gửi một batch tới pool, trả về Future chứa (captions, encoded).
+
+        Tham số:
+            key: Bộ (model_type, max_length, num_beams) chung của batch
+            items: Danh sách (embedding_key, pixel_values, image_embeds) như ImageCaptionService._run_model_batch
+        """
+        self.start()
+        arrays = []
+        kinds = []
+        embedding_keys = [embedding_key for embedding_key, _, _ in items]
+        for _, pixel_values, image_embeds in items:
+            if image_embeds is not None:
+                kinds.append("embeds")
+                arrays.append(np.asarray(image_embeds))
+            else:
+                kinds.append("pixels")
+                arrays.append(np.ascontiguousarray(pixel_values, dtype=np.float32))
+
+        shm, specs = pack_arrays(arrays)
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = (future, shm, time.monotonic())
+            self._stats["submitted"] += 1
+        self._tasks.put((task_id, key, shm.name, specs, kinds, embedding_keys))
+        return future
+
+    def run_batch(self, key, items):
+        """Gửi batch và chờ kết quả (captions, encoded)"""
+        return self.submit(key, items).result()
+
+    def _finish(self, task_id, result=None, error=None):
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            if entry is not None:
+                self._stats["failed" if error is not None else "completed"] += 1
+        if entry is None:
+            return False
+
+        future, shm, _ = entry
+        _release_shm(shm)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        return True
+
+    def _collect_results(self):
+        last_check = time.monotonic()
+        while not self._closed:
+            try:
+                kind, index, task_id, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                break
+
+            if kind is not None:
+                try:
+                    self._handle_message(kind, index, task_id, payload)
+                except Exception as e:
+                    print(f"Lỗi khi xử lý kết quả từ tiến trình suy luận: {e}")
+
+            if time.monotonic() - last_check >= 0.5:
+                last_check = time.monotonic()
+                self._check_workers()
+
+    def _handle_message(self, kind, index, task_id, payload):
+        worker = self._workers[index]
+        if kind == "ready":
+            worker.ready = True
+            worker.error = payload
+            if payload:
+                print(f"Tiến trình suy luận #{index} tải trước mô hình thất bại: {payload}")
+            return
+        if kind == "started":
+            worker.task_id = task_id
+            worker.started_at = time.monotonic()
+            return
+
+        worker.task_id = None
+        worker.completed += 1
+        if kind == "error":
+            self._finish(task_id, error=RuntimeError(f"Tiến trình suy luận #{index}: {payload}"))
+            return
+
+        captions, encoded_payload = payload
+        encoded = [None] * len(captions)
+        if encoded_payload is not None:
+            name, specs, rows = encoded_payload
+            for row, embeds in zip(rows, unpack_arrays(name, specs, unlink=True)):
+                encoded[row] = embeds
+        self._finish(task_id, result=(captions, encoded))
+
+    def _check_workers(self):
+        """Khởi động lại tiến trình đã chết và hủy các batch quá thời gian chờ"""
+        for worker in self._workers:
+            if self._closed or worker.process is None or worker.process.is_alive():
+                continue
+            print(f"Tiến trình suy luận #{worker.index} đã dừng (exitcode={worker.process.exitcode}), khởi động lại")
+            if worker.task_id is not None:
+                self._finish(worker.task_id, error=RuntimeError(f"Tiến trình suy luận #{worker.index} bị dừng khi đang chạy batch"))
+            worker.restarts += 1
+            with self._lock:
+                self._stats["restarts"] += 1
+            self._spawn(worker)
+
+        if self.task_timeout:
+            now = time.monotonic()
+            with self._lock:
+                expired = [task_id for task_id, (_, _, submitted_at) in self._pending.items()
+                           if now - submitted_at > self.task_timeout]
+                self._stats["timeouts"] += len(expired)
+            for task_id in expired:
+                self._finish(task_id, error=TimeoutError(f"Batch {task_id} không có kết quả sau {self.task_timeout}s"))
+
+    def is_ready(self):
+        """Pool sẵn sàng khi mọi tiến trình đang chạy và đã tải trước mô hình"""
+        return self._collector is not None and all(
+            worker.ready and worker.process is not None and worker.process.is_alive() for worker in self._workers
+        )
+
+    def status(self):
+        """Trạng thái của từng tiến trình suy luận"""
+        return {f"worker-{worker.index}": worker.to_dict() for worker in self._workers}
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._pending)
+        stats["num_workers"] = self.num_workers
+        stats["ready"] = self.is_ready()
+        stats["workers"] = self.status()
+        return stats
+
+    def shutdown(self, timeout=5.0):
+        """Dừng các tiến trình suy luận và hủy các batch đang chờ"""
+        self._closed = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        with self._lock:
+            task_ids = list(self._pending.keys())
+        for task_id in task_ids:
+            self._finish(task_id, error=RuntimeError("Pool suy luận đã dừng"))
@@ -0,0 +1,206 @@
+import atexit
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có khóa file, chỉ an toàn khi chạy một tiến trình
+    fcntl = None
+
+
+class JsonlLogSink:
+    """
+    Ghi log có cấu trúc dạng JSON Lines (mỗi dòng một bản ghi JSON) mà không chặn request:
+    - emit() chỉ đưa bản ghi vào hàng đợi trong bộ nhớ; một thread riêng gom và ghi theo lô
+      (mỗi flush_interval giây hoặc khi đủ batch_size bản ghi).
+    - Hàng đợi có giới hạn: khi đầy, bản ghi cũ nhất bị bỏ và được đếm trong thống kê.
+    - File theo ngày (<prefix>_YYYY-MM-DD.jsonl); khi vượt max_bytes file hiện tại được đổi tên
+      thành <prefix>_YYYY-MM-DD.<n>.jsonl và ghi tiếp vào file mới.
+    - Nhiều tiến trình (vd: các worker gunicorn) có thể ghi chung một thư mục: mỗi lô được ghi bằng một
+      lần write ở chế độ append khi giữ khóa file, nên các dòng không bị xen lẫn và việc xoay file không bị trùng.
+    """
+
+    def __init__(self, directory, prefix="caption_log", max_bytes=50 * 1024 * 1024, flush_interval=0.5,
+                 batch_size=200, max_queue=10000):
+        """
+        Tham số:
+            directory: Thư mục chứa file log
+            prefix: Tiền tố tên file log
+            max_bytes: Kích thước tối đa của một file trước khi xoay (0 = không giới hạn)
+            flush_interval: Thời gian tối đa (giây) một bản ghi nằm trong hàng đợi trước khi được ghi
+            batch_size: Số bản ghi tối đa ghi trong một lần
+            max_queue: Số bản ghi chờ tối đa trong bộ nhớ
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max(0, int(max_bytes))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.batch_size = max(1, int(batch_size))
+        self.max_queue = max(1, int(max_queue))
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._writer = None
+        self._writer_pid = None
+        self._flushing = False
+        self._lock_path = os.path.join(directory, f".{prefix}.lock")
+
+        self._stats = {
+            "emitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "batches": 0,
+            "bytes_written": 0,
+            "rotations": 0,
+            "errors": 0
+        }
+        self._last_error = None
+        atexit.register(self.flush)
+
+    def emit(self, record):
+        """Đưa một bản ghi (dict) vào hàng đợi; tự thêm thời điểm (ts) và pid. Không bao giờ chặn người gọi."""
+        record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "pid": os.getpid(), **record}
+        with self._cond:
+            self._ensure_writer()
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self._stats["dropped"] += 1
+            self._queue.append(record)
+            self._stats["emitted"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_writer(self):
+        """Tạo thread ghi (lần đầu hoặc trong tiến trình con sau khi fork), gọi khi đang giữ _cond"""
+        pid = os.getpid()
+        if self._writer is not None and self._writer_pid == pid and self._writer.is_alive():
+            return
+        if self._writer_pid is not None and self._writer_pid != pid:
+            # Tiến trình con sau fork: bỏ các bản ghi kế thừa từ tiến trình cha (tiến trình cha tự ghi chúng)
+            self._queue.clear()
+            self._flushing = False
+        self._writer_pid = pid
+        self._writer = threading.Thread(target=self._writer_loop, name=f"log-sink-{self.prefix}", daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ bản ghi đang chờ xuống đĩa (theo lô batch_size), trả về số bản ghi đã ghi"""
+        written = 0
+        while True:
+            with self._cond:
+                # Chỉ một thread ghi tại một thời điểm để thứ tự bản ghi trong file được giữ nguyên
+                while self._flushing:
+                    self._cond.wait()
+                if not self._queue:
+                    return written
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._flushing = True
+            try:
+                self._write_batch(batch)
+                written += len(batch)
+            finally:
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        # Nhóm theo ngày của bản ghi để bản ghi lúc gần nửa đêm vào đúng file
+        by_day = {}
+        for record in batch:
+            line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            by_day.setdefault(record["ts"][:10], []).append(line)
+
+        for day, lines in by_day.items():
+            data = "".join(lines).encode("utf-8")
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with self._file_lock():
+                    path = os.path.join(self.directory, f"{self.prefix}_{day}.jsonl")
+                    self._rotate_if_needed(path, day, len(data))
+                    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, data)
+                    finally:
+                        os.close(fd)
+            except Exception as e:
+                print(f"Lỗi khi ghi log vào {self.directory}: {e}")
+                with self._cond:
+                    self._stats["errors"] += 1
+                    self._stats["dropped"] += len(lines)
+                    self._last_error = str(e)
+                continue
+            with self._cond:
+                self._stats["written"] += len(lines)
+                self._stats["batches"] += 1
+                self._stats["bytes_written"] += len(data)
+
+    def _file_lock(self):
+        return _FileLock(self._lock_path)
+
+    def _rotate_if_needed(self, path, day, incoming):
+        """Đổi tên file hiện tại sang số thứ tự kế tiếp nếu ghi thêm sẽ vượt max_bytes (gọi khi đang giữ khóa file)"""
+        if not self.max_bytes:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size == 0 or size + incoming <= self.max_bytes:
+            return
+        index = 1
+        while os.path.exists(os.path.join(self.directory, f"{self.prefix}_{day}.{index}.jsonl")):
+            index += 1
+        os.replace(path, os.path.join(self.directory, f"{self.prefix}_{day}.{index}.jsonl"))
+        with self._cond:
+            self._stats["rotations"] += 1
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "directory": self.directory,
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "batch_size": self.batch_size,
+                "flush_interval_ms": round(self.flush_interval * 1000),
+                "max_bytes": self.max_bytes,
+                "process_lock": fcntl is not None,
+                **self._stats,
+                "last_error": self._last_error
+            }
+
+
+class _FileLock:
+    """Khóa độc quyền giữa các tiến trình bằng flock trên một file khóa riêng (bỏ qua nếu không có fcntl)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        return False
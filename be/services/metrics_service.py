@@ -0,0 +1,288 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOAD_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Lớp cơ sở: một metric có tên, mô tả và danh sách nhãn; mỗi bộ giá trị nhãn là một chuỗi số liệu riêng"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        missing = [name for name in self.labelnames if name not in labels]
+        if missing:
+            raise ValueError(f"Metric {self.name} thiếu nhãn: {', '.join(missing)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in sorted(series):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge đặt giá trị trực tiếp, hoặc tính lúc xuất metric qua hàm function() -> {bộ nhãn: giá trị}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def render(self):
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                print(f"Lỗi khi thu thập metric {self.name}: {e}")
+                values = {}
+            with self._lock:
+                self._series = {tuple(str(part) for part in key): value for key, value in values.items()}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Đo thời gian chạy của khối with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập hợp các metric của tiến trình, xuất theo định dạng văn bản của Prometheus"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _MongoCommandListener(monitoring.CommandListener):
+    """Đo thời gian từng lệnh MongoDB qua cơ chế monitoring của pymongo"""
+
+    def __init__(self, histogram, failures):
+        self._histogram = histogram
+        self._failures = failures
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # Tên collection nằm trong giá trị của khóa lệnh, vd: {"find": "images", ...}
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, status):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), "")
+        self._histogram.observe(
+            event.duration_micros / 1e6, command=event.command_name, collection=collection, status=status
+        )
+        if status == "failed":
+            self._failures.inc(command=event.command_name, collection=collection)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "failed")
+
+
+class MetricsService:
+    """
+    Số liệu vận hành trong tiến trình cho endpoint /metrics (định dạng Prometheus):
+    - Histogram thời gian từng bước tạo caption (tải mô hình, tiền xử lý ảnh, sinh caption, dịch, tổng) theo model_type và language.
+    - Số request và độ trễ HTTP theo blueprint, phương thức và mã trạng thái.
+    - Thời gian các lệnh MongoDB theo lệnh và collection.
+    - Gauge được tính lúc xuất: hàng đợi gom batch, hàng đợi tác vụ nền, bộ nhớ mô hình, cache.
+    Mỗi tiến trình (vd: mỗi worker gunicorn) có số liệu riêng.
+    """
+
+    registry = MetricsRegistry()
+
+    caption_model_load_seconds = registry.histogram(
+        "caption_model_load_seconds", "Thời gian lấy mô hình/processor (gồm tải lần đầu)",
+        ("model_type", "language"), buckets=LOAD_BUCKETS
+    )
+    caption_preprocess_seconds = registry.histogram(
+        "caption_preprocess_seconds", "Thời gian giải mã và tiền xử lý ảnh", ("model_type", "language")
+    )
+    caption_generate_seconds = registry.histogram(
+        "caption_generate_seconds", "Thời gian sinh caption (gồm thời gian chờ gom batch)", ("model_type", "language")
+    )
+    caption_translation_seconds = registry.histogram(
+        "caption_translation_seconds", "Thời gian dịch caption", ("model_type", "language")
+    )
+    caption_total_seconds = registry.histogram(
+        "caption_total_seconds", "Tổng thời gian tạo caption cho một ảnh", ("model_type", "language")
+    )
+    caption_requests_total = registry.counter(
+        "caption_requests_total", "Số lần tạo caption", ("model_type", "language", "cache", "outcome")
+    )
+
+    http_requests_total = registry.counter(
+        "http_requests_total", "Số request HTTP", ("blueprint", "method", "status")
+    )
+    http_request_duration_seconds = registry.histogram(
+        "http_request_duration_seconds", "Độ trễ request HTTP", ("blueprint", "method")
+    )
+
+    mongo_command_duration_seconds = registry.histogram(
+        "mongo_command_duration_seconds", "Thời gian lệnh MongoDB", ("command", "collection", "status")
+    )
+    mongo_command_failures_total = registry.counter(
+        "mongo_command_failures_total", "Số lệnh MongoDB lỗi", ("command", "collection")
+    )
+
+    _mongo_listener = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def render(cls):
+        return cls.registry.render()
+
+    @classmethod
+    def register_mongo_listener(cls):
+        """Đăng ký listener đo lệnh MongoDB; phải gọi trước khi tạo kết nối (trước initialize_db)"""
+        with cls._lock:
+            if cls._mongo_listener is not None:
+                return
+            listener = _MongoCommandListener(cls.mongo_command_duration_seconds, cls.mongo_command_failures_total)
+            monitoring.register(listener)
+            cls._mongo_listener = listener
+
+    @classmethod
+    def init_app(cls, app):
+        """Đo số request và độ trễ của mọi request HTTP theo blueprint"""
+        from flask import g, request
+
+        @app.before_request
+        def _start_timer():
+            g._metrics_started = time.perf_counter()
+
+        @app.after_request
+        def _record_request(response):
+            started = getattr(g, "_metrics_started", None)
+            if started is not None:
+                blueprint = request.blueprint or "app"
+                cls.http_request_duration_seconds.observe(
+                    time.perf_counter() - started, blueprint=blueprint, method=request.method
+                )
+                cls.http_requests_total.inc(blueprint=blueprint, method=request.method, status=response.status_code)
+            return response
+
+    @classmethod
+    def register_gauge(cls, name, documentation, labelnames, function):
+        """Đăng ký gauge được tính lúc xuất metric, function() trả về {bộ giá trị nhãn: giá trị}"""
+        return cls.registry.gauge(name, documentation, labelnames, function)
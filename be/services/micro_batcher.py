@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def _percentile(sorted_values, q):
+    """Lấy phân vị q (0-100) từ danh sách đã sắp xếp"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class MicroBatcher:
+    """
+    Hàng đợi gom nhóm (micro-batching) dùng chung cho các lời gọi suy luận.
+    - Các yêu cầu có cùng khóa (vd: loại mô hình + tham số giải mã) được gom vào một batch.
+    - Một batch được chạy khi đủ max_batch_size hoặc khi yêu cầu cũ nhất đã chờ quá max_wait_ms.
+    - Mỗi người gọi nhận một Future chứa kết quả của riêng mình.
+    - Có thể chạy nhiều batch song song (concurrency > 1), vd: khi phía sau là nhiều tiến trình suy luận.
+      Khi mọi luồng chạy đều bận, yêu cầu mới tiếp tục được gom nên batch lớn dần theo tải.
+    - Ghi nhận thống kê kích thước batch và thời gian chờ trong hàng đợi để tinh chỉnh.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=20, name="batcher", stats_window=2000, concurrency=1):
+        """
+        Tham số:
+            run_batch: Hàm run_batch(key, items) trả về danh sách kết quả theo đúng thứ tự items
+            max_batch_size: Số yêu cầu tối đa trong một batch
+            max_wait_ms: Thời gian tối đa một yêu cầu được giữ lại để chờ gom batch
+            name: Tên hàng đợi (dùng khi báo cáo thống kê)
+            stats_window: Số mẫu thời gian chờ gần nhất được giữ lại để tính phân vị
+            concurrency: Số batch được chạy đồng thời tối đa
+        """
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms) / 1000.0)
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> deque[(item, future, enqueued_at)]
+        self._thread = None
+        self._run_slots = threading.Semaphore(self.concurrency)
+        self._runner = None
+        if self.concurrency > 1:
+            self._runner = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"{name}-runner")
+        self._in_flight = 0
+
+        # Thống kê
+        self._batch_size_counts = {}
+        self._queue_waits = deque(maxlen=stats_window)
+        self._run_times = deque(maxlen=stats_window)
+        self._total_items = 0
+        self._total_batches = 0
+        self._total_errors = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch_loop, name=f"{self.name}-dispatcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, key, item):
+        """Đưa một yêu cầu vào hàng đợi, trả về Future của yêu cầu đó"""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            queue = self._pending.get(key)
+            if queue is None:
+                queue = deque()
+                self._pending[key] = queue
+            queue.append((item, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def run(self, key, item, timeout=None):
+        """Đưa yêu cầu vào hàng đợi và chờ kết quả"""
+        return self.submit(key, item).result(timeout)
+
+    def _select_batch_key(self):
+        """
+        Chọn khóa sẽ được chạy tiếp theo.
+        Trả về (key, deadline): key là None nếu hàng đợi rỗng, deadline là None nếu batch đã sẵn sàng.
+        """
+        selected_key = None
+        oldest = None
+        for key, queue in self._pending.items():
+            if len(queue) >= self.max_batch_size:
+                return key, None
+            enqueued_at = queue[0][2]
+            if oldest is None or enqueued_at < oldest:
+                oldest = enqueued_at
+                selected_key = key
+
+        if selected_key is None:
+            return None, None
+
+        deadline = oldest + self.max_wait
+        if time.monotonic() >= deadline:
+            return selected_key, None
+        return selected_key, deadline
+
+    def _dispatch_loop(self):
+        while True:
+            # Chỉ lấy batch tiếp theo khi còn luồng chạy rảnh, trong lúc chờ yêu cầu vẫn được gom vào hàng đợi
+            self._run_slots.acquire()
+            with self._cond:
+                while True:
+                    key, deadline = self._select_batch_key()
+                    if key is None:
+                        self._cond.wait()
+                    elif deadline is None:
+                        break
+                    else:
+                        self._cond.wait(timeout=max(0.0, deadline - time.monotonic()))
+
+                queue = self._pending[key]
+                batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch_size))]
+                if not queue:
+                    del self._pending[key]
+                self._in_flight += 1
+
+            if self._runner is None:
+                self._execute_and_release(key, batch)
+            else:
+                self._runner.submit(self._execute_and_release, key, batch)
+
+    def _execute_and_release(self, key, batch):
+        try:
+            self._execute(key, batch)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+            self._run_slots.release()
+
+    def _execute(self, key, batch):
+        started_at = time.monotonic()
+
+        # Bỏ qua các yêu cầu đã bị hủy trong lúc chờ
+        active = [(item, future, enqueued_at) for item, future, enqueued_at in batch
+                  if future.set_running_or_notify_cancel()]
+        if not active:
+            return
+
+        error = None
+        results = None
+        try:
+            results = self._run_batch(key, [item for item, _, _ in active])
+            if results is None or len(results) != len(active):
+                raise RuntimeError(f"{self.name}: số kết quả không khớp với kích thước batch")
+        except Exception as e:
+            error = e
+
+        run_time = time.monotonic() - started_at
+        with self._cond:
+            self._total_batches += 1
+            self._total_items += len(active)
+            self._batch_size_counts[len(active)] = self._batch_size_counts.get(len(active), 0) + 1
+            self._run_times.append(run_time)
+            for _, _, enqueued_at in active:
+                self._queue_waits.append(started_at - enqueued_at)
+            if error is not None:
+                self._total_errors += 1
+
+        for index, (_, future, _) in enumerate(active):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index])
+
+    def get_stats(self):
+        """Thống kê kích thước batch, thời gian chờ và thời gian chạy (ms)"""
+        with self._cond:
+            waits = sorted(self._queue_waits)
+            run_times = sorted(self._run_times)
+            queued = sum(len(queue) for queue in self._pending.values())
+            batch_size_counts = dict(self._batch_size_counts)
+            total_batches = self._total_batches
+            total_items = self._total_items
+            total_errors = self._total_errors
+            in_flight = self._in_flight
+
+        def summarize(values):
+            return {
+                "avg": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+                "p50": round(_percentile(values, 50) * 1000, 2),
+                "p95": round(_percentile(values, 95) * 1000, 2),
+                "p99": round(_percentile(values, 99) * 1000, 2),
+                "max": round(values[-1] * 1000, 2) if values else 0.0,
+            }
+
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "concurrency": self.concurrency,
+            "in_flight": in_flight,
+            "queued": queued,
+            "batches": total_batches,
+            "items": total_items,
+            "errors": total_errors,
+            "avg_batch_size": round(total_items / total_batches, 2) if total_batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(batch_size_counts.items())},
+            "queue_wait_ms": summarize(waits),
+            "batch_run_ms": summarize(run_times),
+        }
@@ -0,0 +1,113 @@
+import json
+import os
+import torch
+
+# Các chế độ độ chính xác được hỗ trợ khi suy luận
+PRECISION_MODES = ("fp32", "int8", "bf16")
+
+_QUANTIZED_DIR = "quantized"
+_INT8_FILE = "int8_dynamic.pt"
+_INT8_META_FILE = "int8_dynamic.json"
+
+
+def normalize_precision(mode):
+    """Chuẩn hóa tên chế độ, trả về "fp32" nếu không hợp lệ"""
+    mode = (mode or "fp32").strip().lower()
+    if mode not in PRECISION_MODES:
+        print(f"Chế độ độ chính xác không hợp lệ: {mode}, dùng fp32")
+        return "fp32"
+    return mode
+
+
+def cpu_supports_bf16():
+    """Kiểm tra CPU có hỗ trợ bfloat16 gốc (AVX512-BF16 hoặc AMX) hay không"""
+    if os.getenv("CAPTION_BF16_FORCE", "0") == "1":
+        return True
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as cpuinfo:
+            flags = cpuinfo.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def resolve_precision(mode, device):
+    """
+    Chọn chế độ thực tế dựa trên thiết bị:
+    - int8 (dynamic quantization) chỉ chạy trên CPU.
+    - bf16 trên CPU chỉ được bật khi CPU hỗ trợ, nếu không sẽ chậm hơn fp32.
+    """
+    mode = normalize_precision(mode)
+    if mode == "int8" and device != "cpu":
+        print("int8 dynamic quantization chỉ hỗ trợ CPU, dùng fp32")
+        return "fp32"
+    if mode == "bf16" and device == "cpu" and not cpu_supports_bf16():
+        print("CPU không hỗ trợ bfloat16, dùng fp32")
+        return "fp32"
+    return mode
+
+
+def _int8_paths(model_path):
+    cache_dir = os.path.join(model_path, _QUANTIZED_DIR)
+    return cache_dir, os.path.join(cache_dir, _INT8_FILE), os.path.join(cache_dir, _INT8_META_FILE)
+
+
+def load_cached_int8(model_path, model_version):
+    """Đọc mô hình int8 đã lượng tử hóa từ đĩa nếu còn khớp với phiên bản mô hình gốc và torch"""
+    if not os.path.isdir(model_path):
+        return None
+    _, model_file, meta_file = _int8_paths(model_path)
+    if not os.path.exists(model_file) or not os.path.exists(meta_file):
+        return None
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model_version") != model_version or meta.get("torch_version") != torch.__version__:
+            print("Bản lượng tử hóa int8 đã cũ, sẽ lượng tử hóa lại")
+            return None
+        model = torch.load(model_file, map_location="cpu", weights_only=False)
+        model.eval()
+        print(f"Đã tải mô hình int8 từ cache: {model_file}")
+        return model
+    except Exception as e:
+        print(f"Lỗi khi đọc mô hình int8 từ cache: {e}")
+        return None
+
+
+def quantize_int8(model, model_path=None, model_version=None):
+    """
+    Lượng tử hóa động int8 cho các lớp Linear (chỉ CPU).
+    Nếu có model_path, kết quả được lưu vào <model_path>/quantized để lần sau không phải chuyển đổi lại.
+    """
+    quantized = torch.quantization.quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    quantized.eval()
+
+    if model_path and os.path.isdir(model_path):
+        cache_dir, model_file, meta_file = _int8_paths(model_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f"{model_file}.tmp"
+            torch.save(quantized, tmp_file)
+            os.replace(tmp_file, model_file)
+            with open(meta_file, "w", encoding="utf-8") as f:
+                json.dump({"model_version": model_version, "torch_version": torch.__version__}, f)
+            print(f"Đã lưu mô hình int8 vào cache: {model_file}")
+        except Exception as e:
+            print(f"Lỗi khi lưu mô hình int8 vào cache: {e}")
+    return quantized
+
+
+def apply_precision(model, mode, device, model_path=None, model_version=None):
+    """Chuyển mô hình fp32 đã tải sang chế độ độ chính xác mong muốn"""
+    if mode == "int8":
+        return quantize_int8(model, model_path, model_version)
+    if mode == "bf16":
+        return model.to(device=device, dtype=torch.bfloat16).eval()
+    return model.to(device).eval()
+
+
+def model_dtype(model):
+    """Kiểu dữ liệu đầu vào mà mô hình mong đợi (int8 dynamic vẫn nhận float32)"""
+    return getattr(model, "dtype", torch.float32)
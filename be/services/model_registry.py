@@ -0,0 +1,336 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ModelSlot:
+    """Trạng thái của một mô hình trong registry"""
+
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, name, loader, warmup=None, estimate=None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.estimate = estimate
+        self.lock = threading.Lock()
+        self.state = ModelSlot.UNLOADED
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.warmed_up = False
+        self.warmed_up_once = False  # Đã warm-up ít nhất một lần (không bị đặt lại khi giải phóng/tải lại)
+        self.loaded_at = None
+        self.load_count = 0
+        self.footprint_bytes = None
+        self.last_used = None
+        self.in_use = 0
+        self.evictions = 0
+        self.evicted = False  # Đang không nạp vì bị giải phóng (idle/LRU), sẽ được tải lại khi cần
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "footprint_bytes": self.footprint_bytes,
+            "in_use": self.in_use,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1) if self.last_used is not None and self.state == ModelSlot.READY else None,
+            "warmed_up": self.warmed_up,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "warmup_seconds": round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            "loaded_at": self.loaded_at,
+            "load_count": self.load_count,
+            "reloads": max(0, self.load_count - 1),
+            "evictions": self.evictions,
+            "error": self.error
+        }
+
+
+class ModelRegistry:
+    """
+    Registry quản lý việc tải mô hình một lần duy nhất và an toàn giữa các thread:
+    - Mỗi mô hình có một khóa riêng, chỉ một thread thực hiện việc tải, các thread khác chờ trên khóa.
+    - Nếu tải thất bại, lỗi được trả về cho mọi thread đang chờ và lần gọi sau sẽ thử tải lại.
+    - Hỗ trợ tải trước (preload) và chạy suy luận khởi động (warm-up) khi ứng dụng bắt đầu.
+    - Giữ tổng bộ nhớ của các mô hình đang nạp dưới ngân sách byte: giải phóng mô hình ít dùng gần đây nhất (LRU)
+      và các mô hình không được dùng quá idle_ttl giây. Mô hình đang được sử dụng không bị giải phóng.
+    """
+
+    def __init__(self, memory_budget_bytes=None, idle_ttl_seconds=None, sizer=None, on_evict=None):
+        """
+        Tham số:
+            memory_budget_bytes: Ngân sách bộ nhớ cho tất cả mô hình đang nạp (None = không giới hạn)
+            idle_ttl_seconds: Thời gian không dùng tối đa trước khi mô hình bị giải phóng (None = không giới hạn)
+            sizer: Hàm sizer(value) trả về số byte mô hình chiếm trong bộ nhớ
+            on_evict: Hàm gọi sau mỗi lần giải phóng mô hình (vd: gc.collect)
+        """
+        self._slots = {}
+        self._lock = threading.Lock()
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sizer = sizer
+        self._on_evict = on_evict
+        self._reaper = None
+
+    def register(self, name, loader, warmup=None, estimate=None):
+        """
+        Đăng ký một mô hình.
+
+        Tham số:
+            name: Tên mô hình (vd: "default", "travel")
+            loader: Hàm không tham số, trả về đối tượng mô hình đã sẵn sàng
+            warmup: Hàm warmup(value) chạy một lần suy luận khởi động (tùy chọn)
+            estimate: Hàm ước lượng số byte trước khi tải lần đầu, vd: dựa trên kích thước trọng số trên đĩa (tùy chọn)
+        """
+        with self._lock:
+            if name not in self._slots:
+                self._slots[name] = ModelSlot(name, loader, warmup, estimate)
+            self._ensure_reaper()
+            return self._slots[name]
+
+    def names(self):
+        return list(self._slots.keys())
+
+    def _slot(self, name):
+        slot = self._slots.get(name)
+        if slot is None:
+            raise KeyError(f"Mô hình chưa được đăng ký: {name}")
+        return slot
+
+    def get(self, name):
+        """Lấy mô hình, tải nếu chưa có. Ném lỗi nếu việc tải thất bại."""
+        slot = self._slot(name)
+        slot.last_used = time.monotonic()
+        value = slot.value
+        if slot.state == ModelSlot.READY and value is not None:
+            return value
+
+        with slot.lock:
+            # Thread khác có thể đã tải xong trong lúc chờ khóa
+            if slot.state == ModelSlot.READY:
+                return slot.value
+
+            # Giải phóng bớt mô hình khác để mô hình mới nằm trong ngân sách bộ nhớ
+            self._make_room(self._expected_footprint(slot), exclude=slot)
+
+            slot.state = ModelSlot.LOADING
+            slot.error = None
+            started = time.time()
+            try:
+                value = slot.loader()
+            except Exception as e:
+                slot.state = ModelSlot.FAILED
+                slot.error = str(e)
+                print(f"Lỗi khi tải mô hình {name}: {e}")
+                raise
+
+            slot.value = value
+            slot.footprint_bytes = self._measure(value)
+            slot.load_seconds = time.time() - started
+            slot.loaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            slot.last_used = time.monotonic()
+            slot.load_count += 1
+            if slot.load_count > 1:
+                print(f"Tải lại mô hình {name} (lần {slot.load_count})")
+            slot.warmed_up = False
+            slot.evicted = False
+            slot.state = ModelSlot.READY
+
+        # Ước lượng trước khi tải có thể sai lệch, kiểm tra lại ngân sách với kích thước thực tế
+        self._make_room(0, exclude=slot)
+        return value
+
+    @contextmanager
+    def acquire(self, name):
+        """
+        Lấy mô hình và đánh dấu đang sử dụng trong suốt khối with để không bị giải phóng giữa chừng.
+
+        Ví dụ:
+            with registry.acquire("default") as model:
+                ...
+        """
+        slot = self._slot(name)
+        while True:
+            value = self.get(name)
+            with self._lock:
+                # Mô hình có thể vừa bị giải phóng giữa lúc get() trả về và lúc đánh dấu sử dụng
+                if slot.state == ModelSlot.READY and slot.value is value:
+                    slot.in_use += 1
+                    break
+        try:
+            yield value
+        finally:
+            with self._lock:
+                slot.in_use -= 1
+                slot.last_used = time.monotonic()
+
+    def _measure(self, value):
+        if self._sizer is None:
+            return None
+        try:
+            return int(self._sizer(value))
+        except Exception as e:
+            print(f"Không đo được kích thước mô hình: {e}")
+            return None
+
+    def _expected_footprint(self, slot):
+        if slot.footprint_bytes is not None:
+            return slot.footprint_bytes
+        if slot.estimate is not None:
+            try:
+                return int(slot.estimate())
+            except Exception:
+                return 0
+        return 0
+
+    def resident_bytes(self):
+        """Tổng số byte của các mô hình đang nạp trong bộ nhớ"""
+        return sum(slot.footprint_bytes or 0 for slot in self._slots.values() if slot.state == ModelSlot.READY)
+
+    def _make_room(self, needed_bytes, exclude=None):
+        """Giải phóng các mô hình LRU không được sử dụng cho tới khi đủ chỗ cho needed_bytes"""
+        if self.memory_budget_bytes is None:
+            return
+
+        while self.resident_bytes() + needed_bytes > self.memory_budget_bytes:
+            with self._lock:
+                candidates = [
+                    slot for slot in self._slots.values()
+                    if slot is not exclude and slot.state == ModelSlot.READY and slot.in_use == 0
+                ]
+            if not candidates:
+                print(f"Không thể giải phóng thêm mô hình để nằm trong ngân sách {self.memory_budget_bytes} byte")
+                return
+            victim = min(candidates, key=lambda slot: slot.last_used or 0)
+            if not self._evict(victim, reason="lru"):
+                return
+
+    def _evict(self, slot, reason):
+        """Giải phóng một mô hình nếu nó không bận; trả về True nếu đã giải phóng"""
+        # Không chờ khóa của mô hình đang được tải để tránh deadlock giữa hai lần tải đồng thời
+        if not slot.lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if slot.state != ModelSlot.READY or slot.in_use > 0:
+                    return False
+                slot.value = None
+                slot.state = ModelSlot.UNLOADED
+                slot.warmed_up = False
+                slot.evicted = True
+                slot.evictions += 1
+        finally:
+            slot.lock.release()
+
+        print(f"Giải phóng mô hình {slot.name} ({reason}, {slot.footprint_bytes or 0} byte)")
+        if self._on_evict is not None:
+            self._on_evict()
+        return True
+
+    def evict_idle(self):
+        """Giải phóng các mô hình không được sử dụng quá idle_ttl_seconds"""
+        if self.idle_ttl_seconds is None:
+            return
+        now = time.monotonic()
+        for slot in list(self._slots.values()):
+            if slot.state == ModelSlot.READY and slot.in_use == 0 and slot.last_used is not None \
+                    and now - slot.last_used > self.idle_ttl_seconds:
+                self._evict(slot, reason="idle")
+
+    def _ensure_reaper(self):
+        """Khởi động thread nền định kỳ giải phóng mô hình nhàn rỗi (chỉ khi có cấu hình TTL)"""
+        if self.idle_ttl_seconds is None or self._reaper is not None:
+            return
+        interval = max(1.0, min(self.idle_ttl_seconds / 2.0, 60.0))
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    print(f"Lỗi khi giải phóng mô hình nhàn rỗi: {e}")
+
+        self._reaper = threading.Thread(target=reap, name="model-idle-reaper", daemon=True)
+        self._reaper.start()
+
+    def warm_up(self, name):
+        """Tải mô hình (nếu cần) và chạy suy luận khởi động"""
+        slot = self._slot(name)
+        value = self.get(name)
+        if slot.warmup is None:
+            slot.warmed_up = True
+            slot.warmed_up_once = True
+            return
+
+        started = time.time()
+        slot.warmup(value)
+        slot.warmup_seconds = time.time() - started
+        slot.warmed_up = True
+        slot.warmed_up_once = True
+        print(f"Warm-up mô hình {name}: {slot.warmup_seconds:.2f}s")
+
+    def preload(self, names=None, warmup=True):
+        """Tải trước (và warm-up) các mô hình; lỗi được ghi nhận vào trạng thái thay vì ném ra"""
+        for name in names if names is not None else self.names():
+            try:
+                if warmup:
+                    self.warm_up(name)
+                else:
+                    self.get(name)
+            except Exception as e:
+                slot = self._slots.get(name)
+                if slot is not None and slot.state != ModelSlot.FAILED:
+                    slot.error = f"Warm-up thất bại: {e}"
+                print(f"Lỗi khi tải trước mô hình {name}: {e}")
+
+    def is_ready(self, names, require_warmup=True):
+        """
+        Kiểm tra tất cả các mô hình trong names đã tải xong (và đã warm-up nếu yêu cầu).
+        Warm-up chỉ cần trước lần READY đầu tiên: mô hình đã sẵn sàng rồi bị giải phóng (idle TTL, ngân sách bộ nhớ)
+        vẫn được tính là sẵn sàng vì get() tự tải lại khi có request, worker vẫn phục vụ được.
+        """
+        for name in names:
+            slot = self._slots.get(name)
+            if slot is None:
+                return False
+            if require_warmup and not slot.warmed_up_once:
+                return False
+            if slot.state == ModelSlot.READY:
+                continue
+            if not (slot.evicted and slot.state in (ModelSlot.UNLOADED, ModelSlot.LOADING)):
+                return False
+        return True
+
+    def unload(self, name):
+        """Giải phóng một mô hình khỏi registry"""
+        slot = self._slot(name)
+        with slot.lock:
+            slot.value = None
+            slot.state = ModelSlot.UNLOADED
+            slot.warmed_up = False
+            slot.evicted = False
+
+    def unload_all(self):
+        for name in self.names():
+            self.unload(name)
+
+    def status(self):
+        """Trạng thái tải và warm-up của từng mô hình"""
+        return {name: slot.to_dict() for name, slot in self._slots.items()}
+
+    def get_stats(self):
+        """Các mô hình đang nạp, bộ nhớ sử dụng, số lần giải phóng và tải lại"""
+        slots = list(self._slots.values())
+        return {
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "resident_bytes": self.resident_bytes(),
+            "resident_models": [slot.name for slot in slots if slot.state == ModelSlot.READY],
+            "evictions": sum(slot.evictions for slot in slots),
+            "reloads": sum(max(0, slot.load_count - 1) for slot in slots),
+            "models": self.status()
+        }
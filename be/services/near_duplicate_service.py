@@ -0,0 +1,315 @@
+# services/near_duplicate_service.py
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from services.image_preprocess import load_image
+from services.background_executor import BackgroundExecutor
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    """Ma trận DCT-II trực chuẩn n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def perceptual_hash(image_data):
+    """
+    pHash 64 bit của ảnh (chuỗi hex 16 ký tự): ảnh xám 32x32 -> DCT 2 chiều -> 8x8 tần số thấp,
+    mỗi bit cho biết hệ số lớn hơn trung vị. Ổn định khi ảnh bị nén lại, đổi kích thước hoặc chỉnh sáng nhẹ.
+    """
+    image = load_image(image_data, (_DCT_SIZE, _DCT_SIZE)).convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.float32)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    # Bỏ hệ số DC (độ sáng trung bình) khi tính trung vị
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Cây BK trên khoảng cách Hamming: tìm mọi phần tử cách truy vấn không quá max_distance bit
+    mà chỉ phải so sánh với một phần nhỏ của tập (nhờ bất đẳng thức tam giác).
+    Mỗi nút là một giá trị hash, có thể gắn nhiều value (vd: nhiều ảnh có cùng pHash).
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, set(values), {khoảng cách: nút con}]
+        self.size = 0
+
+    def add(self, hash_value, value):
+        """Thêm value với hash_value; trả về False nếu cặp này đã có"""
+        if self._root is None:
+            self._root = [hash_value, {value}, {}]
+            self.size = 1
+            return True
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                if value in node[1]:
+                    return False
+                node[1].add(value)
+                self.size += 1
+                return True
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, {value}, {}]
+                self.size += 1
+                return True
+            node = child
+
+    def discard(self, hash_value, value):
+        """Xóa value khỏi nút có hash_value (nút rỗng vẫn được giữ để không phải dựng lại cây con)"""
+        node = self._root
+        while node is not None:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                if value in node[1]:
+                    node[1].discard(value)
+                    self.size -= 1
+                    return True
+                return False
+            node = node[2].get(distance)
+        return False
+
+    def search(self, hash_value, max_distance):
+        """Trả về danh sách (khoảng cách, value) trong phạm vi max_distance, gần nhất trước"""
+        results = []
+        if self._root is None:
+            return results
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+class NearDuplicateService:
+    """
+    Chỉ mục ảnh gần trùng theo pHash để dùng lại caption cho ảnh chụp liên tiếp hoặc bản nén lại của cùng một ảnh:
+    - pHash được tính khi upload và lưu trong trường perceptual_hash của Image.
+    - Chỉ mục trong bộ nhớ là cây BK (pHash -> SHA-256 nội dung ảnh), được dựng lại từ collection images
+      khi khởi động và cập nhật dần: ảnh mới upload trong tiến trình được thêm ngay, ảnh do worker khác
+      upload (hoặc backfill) được đọc định kỳ theo phash_at - thời điểm pHash được ghi, đặt ngay trước khi lưu.
+      Mỗi lần đọc chồng lấn một khoảng với lần trước (lệch đồng hồ giữa các máy, ảnh đang được lưu),
+      và chỉ mục được dựng lại toàn bộ định kỳ để không bỏ sót ảnh nào.
+    - Truy vấn trả về SHA-256 của các ảnh cách không quá CAPTION_NEAR_DUPLICATE_DISTANCE bit.
+    """
+
+    _enabled = os.getenv("CAPTION_NEAR_DUPLICATE", "1") != "0"
+    _max_distance = int(os.getenv("CAPTION_NEAR_DUPLICATE_DISTANCE", "5"))
+    _refresh_interval = float(os.getenv("CAPTION_NEAR_DUPLICATE_REFRESH_SECONDS", "30"))
+    _refresh_overlap = float(os.getenv("CAPTION_NEAR_DUPLICATE_REFRESH_OVERLAP_SECONDS", "60"))
+    _full_rebuild_interval = float(os.getenv("CAPTION_NEAR_DUPLICATE_FULL_REBUILD_SECONDS", "3600"))
+
+    _lock = threading.Lock()
+    _tree = BKTree()
+    _loaded = False
+    _loading = False
+    _last_scan_at = None  # Thời điểm (đồng hồ của máy) bắt đầu lần đọc collection gần nhất
+    _last_refresh = 0.0
+    _last_full_refresh = 0.0
+
+    _stats = {
+        "queries": 0,
+        "matches": 0,
+        "added": 0,
+        "removed": 0,
+        "rebuilds": 0,
+        "errors": 0
+    }
+
+    @classmethod
+    def is_enabled(cls):
+        return cls._enabled
+
+    @classmethod
+    def compute(cls, image_data):
+        """pHash của ảnh, None nếu không giải mã được"""
+        try:
+            return perceptual_hash(image_data)
+        except Exception as e:
+            print(f"Lỗi khi tính pHash: {e}")
+            with cls._lock:
+                cls._stats["errors"] += 1
+            return None
+
+    @classmethod
+    def add(cls, phash, image_hash):
+        """Thêm ảnh vào chỉ mục (gọi sau khi lưu ảnh)"""
+        if not cls._enabled or not phash or not image_hash:
+            return
+        with cls._lock:
+            if cls._tree.add(int(phash, 16), image_hash):
+                cls._stats["added"] += 1
+
+    @classmethod
+    def remove(cls, phash, image_hash):
+        """Xóa ảnh khỏi chỉ mục (gọi khi dữ liệu ảnh không còn ai dùng)"""
+        if not cls._enabled or not phash or not image_hash:
+            return
+        with cls._lock:
+            if cls._tree.discard(int(phash, 16), image_hash):
+                cls._stats["removed"] += 1
+
+    @classmethod
+    def find(cls, phash, max_distance=None, exclude=None):
+        """
+        Các ảnh gần trùng với phash: danh sách (khoảng cách, SHA-256), gần nhất trước.
+        Không chặn khi chỉ mục chưa được dựng xong (trả về danh sách rỗng).
+        """
+        if not cls._enabled or not phash:
+            return []
+        cls._schedule_refresh()
+        max_distance = cls._max_distance if max_distance is None else max_distance
+        with cls._lock:
+            cls._stats["queries"] += 1
+            matches = [
+                (distance, image_hash) for distance, image_hash in cls._tree.search(int(phash, 16), max_distance)
+                if image_hash != exclude
+            ]
+            if matches:
+                cls._stats["matches"] += 1
+        return matches
+
+    @classmethod
+    def _schedule_refresh(cls):
+        """Dựng chỉ mục lần đầu (hoặc dựng lại định kỳ) hay đọc thêm ảnh mới của các worker khác, ở background"""
+        with cls._lock:
+            if cls._loading:
+                return
+            now = time.monotonic()
+            if cls._last_refresh and now - cls._last_refresh < cls._refresh_interval:
+                return
+            full = not cls._loaded or (
+                cls._full_rebuild_interval > 0 and now - cls._last_full_refresh >= cls._full_rebuild_interval
+            )
+            cls._loading = True
+        BackgroundExecutor.shared().submit(cls.refresh, full, name="near_duplicate_refresh")
+
+    @classmethod
+    def rebuild(cls):
+        """Dựng lại toàn bộ chỉ mục từ collection images"""
+        with cls._lock:
+            cls._loading = True
+        cls.refresh(full=True)
+        with cls._lock:
+            return cls._tree.size
+
+    @classmethod
+    def refresh(cls, full=False):
+        """
+        Đọc ảnh từ collection images vào chỉ mục.
+        full=True (và lần đầu): dựng cây mới từ toàn bộ ảnh rồi thay cây cũ, chỉ mục cũ vẫn được dùng trong lúc dựng.
+        Ngược lại: chỉ đọc ảnh có phash_at từ lúc bắt đầu lần đọc trước trừ CAPTION_NEAR_DUPLICATE_REFRESH_OVERLAP_SECONDS.
+        """
+        from models.image import Image
+
+        try:
+            full = full or not cls._loaded
+            # Ảnh không giải mã được có perceptual_hash rỗng
+            query = {"perceptual_hash__nin": [None, ""]}
+            if not full:
+                if cls._last_scan_at is not None:
+                    query["phash_at__gte"] = cls._last_scan_at - datetime.timedelta(seconds=cls._refresh_overlap)
+                else:
+                    query["phash_at__ne"] = None
+            scan_started = datetime.datetime.now()
+            tree = BKTree() if full else None
+            added = 0
+            for image in Image.objects(**query).only("perceptual_hash", "image_hash"):
+                if not image.image_hash:
+                    continue
+                if full:
+                    tree.add(int(image.perceptual_hash, 16), image.image_hash)
+                else:
+                    with cls._lock:
+                        added += cls._tree.add(int(image.perceptual_hash, 16), image.image_hash)
+            with cls._lock:
+                if full:
+                    # Ảnh được lưu trong lúc dựng cây có phash_at sau scan_started nên được lần đọc kế tiếp bổ sung
+                    cls._tree = tree
+                    cls._last_full_refresh = time.monotonic()
+                    cls._stats["rebuilds"] += 1
+                    print(f"Đã dựng chỉ mục ảnh gần trùng: {tree.size} ảnh")
+                cls._stats["added"] += added
+                cls._last_scan_at = scan_started
+                cls._loaded = True
+        except Exception as e:
+            print(f"Lỗi khi cập nhật chỉ mục ảnh gần trùng: {e}")
+            with cls._lock:
+                cls._stats["errors"] += 1
+        finally:
+            with cls._lock:
+                cls._loading = False
+                cls._last_refresh = time.monotonic()
+
+    @classmethod
+    def rebuild_in_background(cls, backfill=False):
+        """Tính pHash cho ảnh cũ (nếu backfill) rồi dựng lại chỉ mục, chạy qua bộ thực thi tác vụ nền"""
+        def run():
+            if backfill:
+                print(f"Đã tính pHash cho {cls.backfill()} ảnh cũ")
+            return cls.rebuild()
+        return BackgroundExecutor.shared().submit(run, name="near_duplicate_rebuild")
+
+    @classmethod
+    def backfill(cls, batch_size=100):
+        """Tính pHash (và SHA-256 nếu thiếu) cho các ảnh cũ chưa có, trả về số ảnh đã cập nhật"""
+        from models.image import Image
+        from services.caption_cache_service import CaptionCacheService
+
+        updated = 0
+        while True:
+            images = list(Image.objects(perceptual_hash=None).limit(batch_size))
+            if not images:
+                return updated
+            for image in images:
+                data = image.get_image_data()
+                phash = cls.compute(data) if data else None
+                image_hash = image.image_hash or (CaptionCacheService.hash_image(data) if data else None)
+                # Ảnh không giải mã được vẫn được đánh dấu để không đọc lại ở vòng sau
+                # phash_at mới để worker khác đọc được ảnh này dù created_at đã cũ
+                image.update(set__perceptual_hash=phash or "", set__image_hash=image_hash, set__phash_at=datetime.datetime.now())
+                if phash:
+                    cls.add(phash, image_hash)
+                    updated += 1
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            return {
+                **cls._stats,
+                "enabled": cls._enabled,
+                "max_distance": cls._max_distance,
+                "loaded": cls._loaded,
+                "entries": cls._tree.size,
+                "last_scan_at": cls._last_scan_at.isoformat() if isinstance(cls._last_scan_at, datetime.datetime) else None
+            }
@@ -0,0 +1,329 @@
+import inspect
+import json
+import os
+import numpy as np
+
+# Thư mục con (bên trong thư mục mô hình) chứa các artifact ONNX
+ONNX_DIR = "onnx"
+_VISION_FILE = "vision_encoder.onnx"
+_DECODER_FILE = "text_decoder.onnx"
+_CONFIG_FILE = "export_config.json"
+
+
+def onnx_dir_for(model_path):
+    return os.path.join(model_path, ONNX_DIR)
+
+
+def _legacy_past(past_key_values):
+    """
+    Chuyển cache của transformers (nếu là đối tượng Cache) về dạng tuple các (key, value) self-attention theo từng lớp.
+    Cache cross-attention không được xuất vì được tính lại từ image_embeds ở mỗi bước.
+    """
+    past_key_values = getattr(past_key_values, "self_attention_cache", past_key_values)
+    if hasattr(past_key_values, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+    if hasattr(past_key_values, "to_legacy_cache"):
+        past_key_values = past_key_values.to_legacy_cache()
+    return tuple((layer[0], layer[1]) for layer in past_key_values)
+
+
+def _cache_from_past(past):
+    """Tạo DynamicCache từ tuple (key, value) theo từng lớp; transformers mới không nhận tuple làm past_key_values"""
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(ddp_cache_data=past)
+
+
+def export_model(model_path, opset=17):
+    """
+    Xuất vision encoder và text decoder (có past-key-value) của BLIP sang ONNX.
+    Artifact được ghi vào <model_path>/onnx, kèm export_config.json mô tả kích thước và token đặc biệt.
+    """
+    import torch
+    from transformers import BlipForConditionalGeneration
+    from services.caption_cache_service import CaptionCacheService
+
+    model = BlipForConditionalGeneration.from_pretrained(model_path).eval()
+    text_config = model.config.text_config
+    num_layers = text_config.num_hidden_layers
+    num_heads = text_config.num_attention_heads
+    head_dim = text_config.hidden_size // num_heads
+    image_size = model.config.vision_config.image_size
+
+    output_dir = onnx_dir_for(model_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Dùng exporter TorchScript (dynamic_axes); từ torch 2.9 exporter mặc định là dynamo, cần thêm onnxscript
+    export_options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+    class VisionEncoder(torch.nn.Module):
+        def __init__(self, vision_model):
+            super().__init__()
+            self.vision_model = vision_model
+
+        def forward(self, pixel_values):
+            return self.vision_model(pixel_values=pixel_values, return_dict=True).last_hidden_state
+
+    class TextDecoderWithPast(torch.nn.Module):
+        """Một bước giải mã: nhận token mới và past-key-value, trả về logits của vị trí cuối và past mới"""
+
+        def __init__(self, text_decoder):
+            super().__init__()
+            self.text_decoder = text_decoder
+
+        def forward(self, input_ids, attention_mask, encoder_hidden_states, *past_flat):
+            past = tuple((past_flat[2 * i], past_flat[2 * i + 1]) for i in range(num_layers))
+            encoder_attention_mask = torch.ones(encoder_hidden_states.shape[:2], dtype=torch.long)
+            outputs = self.text_decoder(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                encoder_hidden_states=encoder_hidden_states,
+                encoder_attention_mask=encoder_attention_mask,
+                past_key_values=_cache_from_past(past),
+                use_cache=True,
+                return_dict=True
+            )
+            present = _legacy_past(outputs.past_key_values)
+            flat = [tensor for layer in present for tensor in layer]
+            return (outputs.logits[:, -1, :], *flat)
+
+    with torch.no_grad():
+        pixel_values = torch.randn(1, 3, image_size, image_size)
+        vision_path = os.path.join(output_dir, _VISION_FILE)
+        torch.onnx.export(
+            VisionEncoder(model.vision_model),
+            (pixel_values,),
+            vision_path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=opset,
+            **export_options
+        )
+
+        image_embeds = model.vision_model(pixel_values=pixel_values).last_hidden_state
+        past_length = 1
+        past_flat = []
+        past_names = []
+        present_names = []
+        dynamic_axes = {
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "total_sequence"},
+            "encoder_hidden_states": {0: "batch", 1: "image_sequence"},
+            "logits": {0: "batch"}
+        }
+        for layer in range(num_layers):
+            for kind in ("key", "value"):
+                past_flat.append(torch.zeros(1, num_heads, past_length, head_dim))
+                past_name = f"past_{kind}_{layer}"
+                present_name = f"present_{kind}_{layer}"
+                past_names.append(past_name)
+                present_names.append(present_name)
+                dynamic_axes[past_name] = {0: "batch", 2: "past_sequence"}
+                dynamic_axes[present_name] = {0: "batch", 2: "total_sequence"}
+
+        input_ids = torch.full((1, 1), text_config.bos_token_id, dtype=torch.long)
+        attention_mask = torch.ones(1, past_length + 1, dtype=torch.long)
+        decoder_path = os.path.join(output_dir, _DECODER_FILE)
+        torch.onnx.export(
+            TextDecoderWithPast(model.text_decoder),
+            (input_ids, attention_mask, image_embeds, *past_flat),
+            decoder_path,
+            input_names=["input_ids", "attention_mask", "encoder_hidden_states", *past_names],
+            output_names=["logits", *present_names],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            **export_options
+        )
+
+    export_config = {
+        "model_version": CaptionCacheService.fingerprint_model_dir(model_path),
+        "num_layers": num_layers,
+        "num_heads": num_heads,
+        "head_dim": head_dim,
+        "image_size": image_size,
+        "bos_token_id": text_config.bos_token_id,
+        "eos_token_id": text_config.sep_token_id,
+        "pad_token_id": text_config.pad_token_id,
+        "opset": opset
+    }
+    with open(os.path.join(output_dir, _CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(export_config, f, indent=2)
+    print(f"Đã xuất mô hình ONNX vào: {output_dir}")
+    return output_dir
+
+
+def _log_softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+class OnnxCaptionBackend:
+    """
+    Backend suy luận BLIP qua ONNX Runtime:
+    - Vision encoder chạy một lần cho cả batch ảnh.
+    - Text decoder chạy từng bước với past-key-value, beam search được thực hiện bằng NumPy
+      theo cùng quy tắc với transformers (length_penalty=1, early_stopping=False).
+    Có cùng giao diện generate() với BlipForConditionalGeneration để dùng thay thế trong ImageCaptionService.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        self.onnx_dir = onnx_dir_for(model_path)
+        config_path = os.path.join(self.onnx_dir, _CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(
+                f"Không tìm thấy artifact ONNX trong {self.onnx_dir}, hãy chạy: python -m tools.export_onnx --model <model_type>"
+            )
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        from services.caption_cache_service import CaptionCacheService
+        if self.config.get("model_version") != CaptionCacheService.fingerprint_model_dir(model_path):
+            print(f"Cảnh báo: artifact ONNX trong {self.onnx_dir} được xuất từ phiên bản mô hình khác, nên xuất lại")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        providers = ["CPUExecutionProvider"]
+        self.vision_session = ort.InferenceSession(os.path.join(self.onnx_dir, _VISION_FILE), options, providers=providers)
+        self.decoder_session = ort.InferenceSession(os.path.join(self.onnx_dir, _DECODER_FILE), options, providers=providers)
+
+        self.num_layers = self.config["num_layers"]
+        self.num_heads = self.config["num_heads"]
+        self.head_dim = self.config["head_dim"]
+        self.bos_token_id = self.config["bos_token_id"]
+        self.eos_token_id = self.config["eos_token_id"]
+        self.pad_token_id = self.config["pad_token_id"]
+        self._past_names = [f"past_{kind}_{layer}" for layer in range(self.num_layers) for kind in ("key", "value")]
+
+    def footprint_bytes(self):
+        """Ước lượng bộ nhớ bằng tổng kích thước các file ONNX"""
+        return sum(os.path.getsize(os.path.join(self.onnx_dir, name)) for name in (_VISION_FILE, _DECODER_FILE))
+
+    def encode(self, pixel_values):
+        """Chạy vision encoder, trả về image_embeds dạng float32"""
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        return self.vision_session.run(["image_embeds"], {"pixel_values": pixel_values})[0]
+
+    def _decode_step(self, input_ids, attention_mask, image_embeds, past):
+        feed = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "encoder_hidden_states": image_embeds
+        }
+        feed.update(zip(self._past_names, past))
+        outputs = self.decoder_session.run(None, feed)
+        return outputs[0], outputs[1:]
+
+    def generate_from_embeds(self, image_embeds, max_length=30, num_beams=5, min_length=5, on_step=None):
+        """
+        Beam search trên image_embeds (B, S, D), trả về danh sách chuỗi token id cho mỗi ảnh.
+        max_length và min_length tính cả token bắt đầu, giống transformers.
+        on_step(token_ids): Gọi sau mỗi bước với beam tốt nhất của ảnh đầu tiên; trả về True để dừng sớm.
+        """
+        batch_size = image_embeds.shape[0]
+        num_beams = max(1, int(num_beams))
+        rows = batch_size * num_beams
+
+        embeds = np.repeat(image_embeds.astype(np.float32), num_beams, axis=0)
+        sequences = np.full((rows, 1), self.bos_token_id, dtype=np.int64)
+        beam_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        beam_scores[:, 1:] = -1e9  # Bước đầu tất cả beam giống nhau, chỉ giữ beam 0
+        beam_scores = beam_scores.reshape(-1)
+        past = [np.zeros((rows, self.num_heads, 0, self.head_dim), dtype=np.float32) for _ in self._past_names]
+
+        finished = [[] for _ in range(batch_size)]  # (score, tokens)
+        done = [False] * batch_size
+        next_input = sequences
+
+        while sequences.shape[1] < max_length and not all(done):
+            cur_len = sequences.shape[1]
+            attention_mask = np.ones((rows, cur_len), dtype=np.int64)
+            logits, past = self._decode_step(next_input, attention_mask, embeds, past)
+            log_probs = _log_softmax(logits.astype(np.float32))
+            if cur_len < min_length:
+                log_probs[:, self.eos_token_id] = -np.inf
+
+            vocab_size = log_probs.shape[-1]
+            scores = (log_probs + beam_scores[:, None]).reshape(batch_size, num_beams * vocab_size)
+
+            next_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+            next_tokens = np.full((batch_size, num_beams), self.pad_token_id, dtype=np.int64)
+            next_beams = np.zeros((batch_size, num_beams), dtype=np.int64)
+
+            for b in range(batch_size):
+                if done[b]:
+                    # Ảnh đã xong: giữ nguyên beam với token pad để không ảnh hưởng kết quả
+                    next_scores[b] = 0.0
+                    next_beams[b] = np.arange(num_beams)
+                    continue
+
+                top_k = min(2 * num_beams, scores.shape[1])
+                candidates = np.argpartition(-scores[b], top_k - 1)[:top_k]
+                candidates = candidates[np.argsort(-scores[b][candidates], kind="stable")]
+
+                slot = 0
+                for rank, index in enumerate(candidates):
+                    beam = index // vocab_size
+                    token = index % vocab_size
+                    score = float(scores[b, index])
+                    if token == self.eos_token_id:
+                        # Như transformers: chỉ nhận câu kết thúc nếu nằm trong num_beams ứng viên tốt nhất
+                        if rank < num_beams:
+                            tokens = sequences[b * num_beams + beam].tolist()
+                            # Chuẩn hóa theo số token sinh ra như transformers: tokens có token bắt đầu nhưng chưa có
+                            # token kết thúc, nên len(tokens) bằng số token sinh ra tính cả token kết thúc
+                            self._add_hypothesis(finished[b], num_beams, score / len(tokens), tokens)
+                        continue
+                    next_scores[b, slot] = score
+                    next_tokens[b, slot] = token
+                    next_beams[b, slot] = beam
+                    slot += 1
+                    if slot == num_beams:
+                        break
+
+                # Dừng khi không beam nào đang chạy có thể vượt qua câu kém nhất đã hoàn thành
+                if len(finished[b]) == num_beams:
+                    # Beam đang chạy sau bước này có cur_len token sinh ra (không tính token bắt đầu)
+                    best_possible = float(np.max(scores[b])) / cur_len
+                    if finished[b][-1][0] >= best_possible:
+                        done[b] = True
+
+            beam_scores = next_scores.reshape(-1)
+            row_index = (np.arange(batch_size)[:, None] * num_beams + next_beams).reshape(-1)
+            sequences = np.concatenate([sequences[row_index], next_tokens.reshape(-1, 1)], axis=1)
+            past = [layer[row_index] for layer in past]
+            next_input = next_tokens.reshape(-1, 1)
+            if on_step is not None and on_step(sequences[0].tolist()):
+                break
+
+        # Các ảnh chưa xong khi đạt max_length: thêm các beam còn lại vào danh sách ứng viên
+        for b in range(batch_size):
+            if done[b]:
+                continue
+            for beam in range(num_beams):
+                row = b * num_beams + beam
+                tokens = sequences[row].tolist()
+                # Câu dừng vì max_length không có token kết thúc: số token sinh ra là len(tokens) - 1
+                self._add_hypothesis(finished[b], num_beams, float(beam_scores[row]) / max(len(tokens) - 1, 1), tokens)
+
+        return [max(hypotheses, key=lambda item: item[0])[1] for hypotheses in finished]
+
+    @staticmethod
+    def _add_hypothesis(hypotheses, num_beams, score, tokens):
+        """Giữ tối đa num_beams câu hoàn thành có điểm cao nhất, sắp xếp giảm dần"""
+        if len(hypotheses) < num_beams or score > hypotheses[-1][0]:
+            hypotheses.append((score, tokens))
+            hypotheses.sort(key=lambda item: item[0], reverse=True)
+            del hypotheses[num_beams:]
+
+    def generate(self, pixel_values=None, max_length=30, num_beams=5, min_length=5, **kwargs):
+        """Giao diện giống BlipForConditionalGeneration.generate, trả về danh sách chuỗi token id"""
+        if hasattr(pixel_values, "detach"):
+            pixel_values = pixel_values.detach().cpu().float().numpy()
+        image_embeds = self.encode(pixel_values)
+        return self.generate_from_embeds(image_embeds, max_length=max_length, num_beams=num_beams, min_length=min_length)
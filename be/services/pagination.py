@@ -0,0 +1,135 @@
+# services/pagination.py
+import base64
+import datetime
+import json
+import math
+from bson import ObjectId
+from flask import abort
+from mongoengine.queryset.visitor import Q
+
+
+class Page:
+    """
+    Một trang kết quả, cùng thuộc tính với Pagination của flask_mongoengine (items, total, pages, page, per_page).
+    Khác ở chỗ không gọi select_related(): Pagination của flask_mongoengine nạp đầy đủ mọi document được
+    tham chiếu (vd: toàn bộ Image kèm dữ liệu nhị phân của mỗi Report), kể cả khi queryset dùng no_dereference().
+    """
+
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def pages(self):
+        return int(math.ceil(self.total / float(self.per_page))) if self.per_page else 0
+
+    def meta(self):
+        """Các trường phân trang trả về cho client"""
+        return {'total': self.total, 'pages': self.pages, 'page': self.page}
+
+
+def paginate(queryset, page=1, per_page=20):
+    """Phân trang theo page/per_page; trả về 404 với page < 1 hoặc trang rỗng khác trang đầu (giống flask_mongoengine)"""
+    if page < 1 or per_page < 1:
+        abort(404)
+    items = list(queryset.skip((page - 1) * per_page).limit(per_page))
+    if not items and page != 1:
+        abort(404)
+    return Page(items, queryset.count(), page, per_page)
+
+
+class CursorPage:
+    """
+    Một trang kết quả phân trang theo khóa (keyset) (created_at, _id), mới nhất trước.
+    next_cursor/prev_cursor là chuỗi mờ (opaque) để lấy trang sau/trước, None nếu không còn trang.
+    total chỉ có khi được yêu cầu (đếm chính xác hoặc ước lượng).
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    def meta(self):
+        """Các trường phân trang trả về cho client"""
+        meta = {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor
+        }
+        if self.total is not None:
+            meta['total'] = self.total
+        return meta
+
+
+def encode_cursor(document, direction):
+    """Cursor trỏ tới vị trí của document theo (created_at, _id); direction là "next" hoặc "prev" """
+    payload = {'t': document.created_at.isoformat(), 'i': str(document.id), 'd': direction}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Giải mã cursor thành (created_at, ObjectId, direction); ValueError nếu cursor không hợp lệ"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction = payload['d']
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return datetime.datetime.fromisoformat(payload['t']), ObjectId(payload['i']), direction
+    except Exception:
+        raise ValueError("Cursor phân trang không hợp lệ")
+
+
+def count_total(queryset, mode):
+    """
+    Tổng số bản ghi theo mode: "exact" đếm chính xác, "approx" dùng số ước lượng từ metadata của collection
+    (không quét, chỉ áp dụng khi không có điều kiện lọc; có lọc thì đếm chính xác), None/khác: không đếm.
+    """
+    if mode == 'exact':
+        return queryset.count()
+    if mode == 'approx':
+        if not queryset._query:
+            return queryset._document._get_collection().estimated_document_count()
+        return queryset.count()
+    return None
+
+
+def keyset_paginate(queryset, cursor=None, per_page=20, total=None):
+    """
+    Phân trang theo khóa (created_at, _id) giảm dần: mỗi trang là một truy vấn theo khoảng trên index
+    (created_at, _id) nên trang thứ 500 tốn như trang đầu, không cần skip hay count().
+    cursor rỗng/None là trang đầu; total: None, "exact" hoặc "approx" (xem count_total).
+    """
+    if per_page < 1:
+        raise ValueError("per_page phải lớn hơn 0")
+    direction = 'next'
+    query = queryset
+    if cursor:
+        created_at, object_id, direction = decode_cursor(cursor)
+        if direction == 'next':
+            query = query.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=object_id))
+        else:
+            query = query.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=object_id))
+
+    # Lấy thêm một bản ghi để biết còn trang tiếp theo theo hướng đang đi hay không
+    if direction == 'next':
+        items = list(query.order_by('-created_at', '-id').limit(per_page + 1))
+    else:
+        items = list(query.order_by('created_at', 'id').limit(per_page + 1))
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+
+    next_cursor = prev_cursor = None
+    if items:
+        # Đi tới: còn trang sau nếu lấy dư; luôn có trang trước nếu không phải trang đầu. Đi lùi thì ngược lại.
+        if direction == 'prev' or has_more:
+            next_cursor = encode_cursor(items[-1], 'next')
+        if cursor and (direction == 'next' or has_more):
+            prev_cursor = encode_cursor(items[0], 'prev')
+    return CursorPage(items, per_page, next_cursor, prev_cursor, count_total(queryset, total))
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import torch
+from transformers import MarianMTModel, MarianTokenizer
+
+from services.micro_batcher import MicroBatcher, _percentile
+from services.model_registry import ModelRegistry, ModelSlot
+
+try:
+    from googletrans import Translator
+except ImportError:  # googletrans chỉ còn là phương án dự phòng
+    Translator = None
+
+
+def _translation_footprint(bundle):
+    """Số byte trọng số của mô hình dịch trong bộ nhớ"""
+    return sum(tensor.numel() * tensor.element_size() for tensor in bundle[0].state_dict().values())
+
+
+class TranslationService:
+    """
+    Dịch caption Anh -> Việt ngay trên máy bằng mô hình MarianMT (opus-mt-en-vi):
+    - Mô hình được tải một lần qua ModelRegistry (tải trước, warm-up, giải phóng khi nhàn rỗi như BLIP).
+    - Các yêu cầu dịch đồng thời được gom batch qua MicroBatcher.
+    - Cache LRU theo câu đã chuẩn hóa vì nhiều caption gần như trùng nhau.
+    - Nếu không tải được mô hình cục bộ, bỏ qua mô hình trong CAPTION_TRANSLATION_RETRY_SECONDS giây trước khi
+      thử tải lại thay vì tải lại ở mọi request.
+    - Chỉ gửi câu ra googletrans khi bật CAPTION_TRANSLATION_FALLBACK=1 (mặc định tắt) hoặc cặp ngôn ngữ không có
+      mô hình cục bộ; không dịch được thì trả về None để nơi gọi tự quyết định (không lưu cache).
+    - Ghi nhận thời gian của từng lời gọi (cache, cục bộ, googletrans) để theo dõi.
+    """
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.abspath(os.path.join(current_dir, ".."))
+    _model_name = "Helsinki-NLP/opus-mt-en-vi"
+    _model_path = os.getenv("CAPTION_TRANSLATION_MODEL", os.path.join(parent_dir, "pretrain", "opus_mt_en_vi"))
+    _device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # Cặp ngôn ngữ có mô hình cục bộ
+    _local_pairs = {("en", "vi"): "en-vi"}
+
+    _backend = os.getenv("CAPTION_TRANSLATION_BACKEND", "marian")
+    _fallback_enabled = os.getenv("CAPTION_TRANSLATION_FALLBACK", "0") == "1"
+    # Thời gian (giây) chờ trước khi thử tải lại mô hình cục bộ sau một lần tải thất bại
+    _retry_seconds = float(os.getenv("CAPTION_TRANSLATION_RETRY_SECONDS", "60"))
+    _load_failed_at = None
+    _num_beams = int(os.getenv("CAPTION_TRANSLATION_BEAMS", "2"))
+    _max_new_tokens = int(os.getenv("CAPTION_TRANSLATION_MAX_TOKENS", "64"))
+
+    _registry = ModelRegistry(
+        idle_ttl_seconds=float(os.getenv("CAPTION_MODEL_IDLE_TTL_SECONDS", "0")) or None,
+        sizer=_translation_footprint
+    )
+
+    _batcher = MicroBatcher(
+        run_batch=lambda key, texts: TranslationService._run_batch(key, texts),
+        max_batch_size=int(os.getenv("CAPTION_TRANSLATION_BATCH_MAX_SIZE", "16")),
+        max_wait_ms=float(os.getenv("CAPTION_TRANSLATION_BATCH_MAX_WAIT_MS", "10")),
+        name="translation"
+    )
+
+    _translator = None
+    _translator_lock = threading.Lock()
+
+    # Cache LRU: (src, dest, câu đã chuẩn hóa) -> bản dịch
+    _cache_size = int(os.getenv("CAPTION_TRANSLATION_CACHE_SIZE", "2048"))
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+
+    _timings = {"cache": deque(maxlen=2000), "local": deque(maxlen=2000), "googletrans": deque(maxlen=2000)}
+    _stats = {
+        "calls": 0,
+        "cache_hits": 0,
+        "local": 0,
+        "googletrans": 0,
+        "untranslated": 0,
+        "errors": 0,
+        "local_skipped": 0
+    }
+
+    @staticmethod
+    def normalize(text):
+        """Chuẩn hóa câu làm khóa cache: bỏ khoảng trắng thừa, chữ thường (caption của BLIP vốn là chữ thường)"""
+        return " ".join(text.split()).lower()
+
+    @classmethod
+    def _load_model(cls):
+        """Tải MarianMT từ thư mục pretrain, nếu chưa có thì tải theo tên trên Hugging Face"""
+        path = cls._model_path if os.path.isdir(cls._model_path) else cls._model_name
+        tokenizer = MarianTokenizer.from_pretrained(path)
+        model = MarianMTModel.from_pretrained(path).to(cls._device)
+        model.eval()
+        print(f"Đã tải mô hình dịch {path} ({cls._device})")
+        return model, tokenizer
+
+    @classmethod
+    def _warmup(cls, bundle):
+        model, tokenizer = bundle
+        inputs = tokenizer(["a dog sitting on a bench"], return_tensors="pt").to(cls._device)
+        with torch.no_grad():
+            model.generate(**inputs, num_beams=cls._num_beams, max_new_tokens=8)
+
+    @classmethod
+    def _run_batch(cls, key, texts):
+        """Dịch một batch câu bằng mô hình cục bộ, trả về danh sách bản dịch theo đúng thứ tự"""
+        with cls._registry.acquire(cls._local_pairs[key]) as (model, tokenizer):
+            inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True).to(cls._device)
+            with torch.no_grad():
+                output_ids = model.generate(**inputs, num_beams=cls._num_beams, max_new_tokens=cls._max_new_tokens)
+            return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+    @classmethod
+    def _uses_local(cls, src_lang, dest_lang):
+        return cls._backend == "marian" and (src_lang, dest_lang) in cls._local_pairs
+
+    @classmethod
+    def _local_backing_off(cls):
+        """Mô hình cục bộ vừa tải thất bại và chưa hết thời gian chờ trước khi thử lại"""
+        failed_at = cls._load_failed_at
+        return failed_at is not None and time.monotonic() - failed_at < cls._retry_seconds
+
+    @classmethod
+    def _translate_local(cls, text, src_lang, dest_lang):
+        """Dịch bằng mô hình cục bộ qua hàng đợi gom batch; ghi nhận lần tải mô hình thất bại để tạm ngừng thử lại"""
+        name = cls._local_pairs[(src_lang, dest_lang)]
+        try:
+            translation = cls._batcher.run((src_lang, dest_lang), text)
+        except Exception:
+            if cls._registry.status().get(name, {}).get("state") == ModelSlot.FAILED:
+                cls._load_failed_at = time.monotonic()
+                print(f"Không tải được mô hình dịch {name}, thử lại sau {cls._retry_seconds:.0f}s")
+            raise
+        cls._load_failed_at = None
+        return translation
+
+    @classmethod
+    def _translate_remote(cls, text, src_lang, dest_lang):
+        """Dịch qua googletrans (cần kết nối mạng)"""
+        if Translator is None:
+            raise RuntimeError("googletrans chưa được cài đặt")
+        if cls._translator is None:
+            with cls._translator_lock:
+                if cls._translator is None:
+                    cls._translator = Translator()
+        return cls._translator.translate(text, src=src_lang, dest=dest_lang).text
+
+    @classmethod
+    def _record(cls, source, started):
+        elapsed = time.time() - started
+        with cls._lock:
+            cls._timings[source].append(elapsed)
+        return elapsed
+
+    @classmethod
+    def translate(cls, text, src_lang="en", dest_lang="vi"):
+        """
+        Dịch một câu, trả về bản dịch; None nếu không dịch được (mô hình cục bộ và googletrans đều lỗi).
+
+        Tham số:
+            text: Văn bản cần dịch
+            src_lang: Ngôn ngữ nguồn ('en' hoặc 'vi')
+            dest_lang: Ngôn ngữ đích ('en' hoặc 'vi')
+        """
+        if src_lang == dest_lang or not text or not text.strip():
+            return text
+
+        started = time.time()
+        key = (src_lang, dest_lang, cls.normalize(text))
+        with cls._lock:
+            cls._stats["calls"] += 1
+            cached = cls._cache.get(key)
+            if cached is not None:
+                cls._cache.move_to_end(key)
+                cls._stats["cache_hits"] += 1
+        if cached is not None:
+            cls._record("cache", started)
+            return cached
+
+        translation, source = None, None
+        if cls._uses_local(src_lang, dest_lang) and cls._local_backing_off():
+            with cls._lock:
+                cls._stats["local_skipped"] += 1
+        elif cls._uses_local(src_lang, dest_lang):
+            try:
+                translation = cls._translate_local(key[2], src_lang, dest_lang)
+                source = "local"
+            except Exception as e:
+                print(f"Lỗi khi dịch bằng mô hình cục bộ: {e}")
+                with cls._lock:
+                    cls._stats["errors"] += 1
+
+        if translation is None and (cls._fallback_enabled or not cls._uses_local(src_lang, dest_lang)):
+            try:
+                translation = cls._translate_remote(text, src_lang, dest_lang)
+                source = "googletrans"
+            except Exception as e:
+                print(f"Lỗi khi dịch văn bản: {e}")
+                with cls._lock:
+                    cls._stats["errors"] += 1
+
+        if translation is None:
+            with cls._lock:
+                cls._stats["untranslated"] += 1
+            return None
+
+        elapsed = cls._record(source, started)
+        print(f"Dịch {src_lang}->{dest_lang} ({source}): {elapsed * 1000:.0f}ms")
+        with cls._lock:
+            cls._stats[source] += 1
+            if cls._cache_size > 0:
+                cls._cache[key] = translation
+                cls._cache.move_to_end(key)
+                while len(cls._cache) > cls._cache_size:
+                    cls._cache.popitem(last=False)
+        return translation
+
+    @classmethod
+    def preload(cls, warmup=True, background=False):
+        """Tải trước (và warm-up) mô hình dịch cục bộ"""
+        if cls._backend != "marian":
+            return
+        names = list(cls._local_pairs.values())
+        if background:
+            threading.Thread(target=cls._registry.preload, args=(names,), kwargs={"warmup": warmup}, daemon=True).start()
+        else:
+            cls._registry.preload(names, warmup=warmup)
+
+    @classmethod
+    def unload(cls):
+        cls._registry.unload_all()
+
+    @classmethod
+    def get_stats(cls):
+        def summarize(values):
+            ordered = sorted(values)
+            return {
+                "count": len(ordered),
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2)
+            }
+
+        with cls._lock:
+            timings = {source: summarize(values) for source, values in cls._timings.items()}
+            stats = dict(cls._stats)
+            cache_entries = len(cls._cache)
+        return {
+            **stats,
+            "backend": cls._backend,
+            "fallback_enabled": cls._fallback_enabled,
+            "local_backing_off": cls._local_backing_off(),
+            "cache_entries": cache_entries,
+            "timings": timings,
+            "batcher": cls._batcher.get_stats(),
+            "models": cls._registry.get_stats()
+        }
+
+
+TranslationService._registry.register(
+    "en-vi",
+    TranslationService._load_model,
+    warmup=TranslationService._warmup
+)
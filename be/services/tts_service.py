@@ -0,0 +1,290 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from services.background_executor import BackgroundExecutor
+
+try:
+    from gtts import gTTS
+except ImportError:
+    gTTS = None
+
+
+class GTTSEngine:
+    """Google Text-to-Speech (cần kết nối mạng), trả về MP3"""
+
+    name = "gtts"
+    extension = ".mp3"
+
+    def is_available(self):
+        return gTTS is not None
+
+    def synthesize(self, text, lang):
+        buffer = io.BytesIO()
+        gTTS(text, lang=lang).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class EspeakEngine:
+    """espeak-ng chạy cục bộ (không cần mạng), trả về WAV"""
+
+    name = "espeak"
+    extension = ".wav"
+    _voices = {"en": "en", "vi": "vi"}
+
+    def __init__(self):
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def is_available(self):
+        return self.binary is not None
+
+    def synthesize(self, text, lang):
+        # Câu được gửi qua stdin để caption bắt đầu bằng "-" không bị espeak hiểu là tham số dòng lệnh
+        result = subprocess.run(
+            [self.binary, "-v", self._voices.get(lang, lang), "--stdout", "--stdin"],
+            input=text.encode("utf-8"), capture_output=True, timeout=30, check=True
+        )
+        return result.stdout
+
+
+class TTSService:
+    """
+    Tạo audio đọc caption dưới dạng file để client tự phát (server không phát âm thanh):
+    - Mỗi (engine, ngôn ngữ, câu) chỉ được tổng hợp một lần; file lưu theo SHA-256 của nội dung đó (content-addressed).
+    - Thư mục cache giới hạn theo tổng dung lượng, file ít được dùng gần đây nhất bị xóa trước.
+    - Nhiều request cùng một câu chỉ tổng hợp một lần (khóa theo khóa cache).
+    - Engine có thể thay thế: gtts (mạng) hoặc espeak (cục bộ), đăng ký thêm bằng register_engine().
+    """
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.abspath(os.path.join(current_dir, ".."))
+    _cache_dir = os.getenv("CAPTION_TTS_CACHE_DIR", os.path.join(parent_dir, "cache", "tts"))
+    _cache_budget = int(float(os.getenv("CAPTION_TTS_CACHE_MB", "256")) * 1024 * 1024)
+    # auto: dùng engine cục bộ nếu đã cài, ngược lại dùng gtts
+    _engine_name = os.getenv("CAPTION_TTS_ENGINE", "auto")
+
+    _mimetypes = {".mp3": "audio/mpeg", ".wav": "audio/wav"}
+    _engines = OrderedDict([("espeak", EspeakEngine()), ("gtts", GTTSEngine())])
+
+    _lock = threading.Lock()
+    _index = None  # key -> (tên file, số byte), theo thứ tự dùng gần đây
+    _index_bytes = 0
+    _key_locks = {}
+
+    _stats = {
+        "hits": 0,
+        "misses": 0,
+        "synthesized": 0,
+        "evictions": 0,
+        "errors": 0,
+        "synthesize_seconds": 0.0
+    }
+
+    @classmethod
+    def register_engine(cls, engine):
+        """Đăng ký engine mới (có name, extension, is_available() và synthesize(text, lang) -> bytes)"""
+        cls._engines[engine.name] = engine
+
+    @classmethod
+    def get_engine(cls):
+        if cls._engine_name != "auto":
+            engine = cls._engines.get(cls._engine_name)
+            if engine is None:
+                raise ValueError(f"Engine TTS không hợp lệ: {cls._engine_name}")
+            return engine
+        for engine in cls._engines.values():
+            if engine.is_available():
+                return engine
+        raise RuntimeError("Không có engine TTS nào khả dụng")
+
+    @staticmethod
+    def guess_language(text):
+        """Đoán ngôn ngữ của caption: có ký tự ngoài ASCII (dấu tiếng Việt) thì là 'vi'"""
+        return "vi" if any(ord(char) > 127 for char in text) else "en"
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split())
+
+    @classmethod
+    def audio_key(cls, text, lang, engine=None):
+        """Khóa cache của audio: SHA-256 của engine, ngôn ngữ và câu đã chuẩn hóa"""
+        engine = engine or cls.get_engine()
+        content = f"{engine.name}|{lang}|{cls.normalize(text)}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _load_index(cls):
+        """Đọc các file audio đã có trên đĩa (một lần), sắp xếp theo thời gian sử dụng gần nhất"""
+        if cls._index is not None:
+            return
+        os.makedirs(cls._cache_dir, exist_ok=True)
+        entries = []
+        for filename in os.listdir(cls._cache_dir):
+            key, extension = os.path.splitext(filename)
+            if extension not in cls._mimetypes:
+                continue
+            stat = os.stat(os.path.join(cls._cache_dir, filename))
+            entries.append((stat.st_mtime, key, filename, stat.st_size))
+        cls._index = OrderedDict()
+        cls._index_bytes = 0
+        for _, key, filename, size in sorted(entries):
+            cls._index[key] = (filename, size)
+            cls._index_bytes += size
+
+    @classmethod
+    def _lookup(cls, key):
+        """Trả về tên file nếu audio đã có trong cache và đánh dấu vừa được dùng"""
+        with cls._lock:
+            cls._load_index()
+            entry = cls._index.get(key)
+            if entry is None:
+                return None
+            path = os.path.join(cls._cache_dir, entry[0])
+            if not os.path.exists(path):
+                del cls._index[key]
+                cls._index_bytes -= entry[1]
+                return None
+            cls._index.move_to_end(key)
+        try:
+            # Cập nhật mtime để thứ tự LRU vẫn đúng sau khi khởi động lại
+            os.utime(path)
+        except OSError:
+            pass
+        return entry[0]
+
+    @classmethod
+    def _store(cls, key, extension, data):
+        """Ghi audio vào cache (ghi file tạm rồi đổi tên để không ai đọc được file dở dang) và dọn cache nếu vượt ngân sách"""
+        filename = f"{key}{extension}"
+        path = os.path.join(cls._cache_dir, filename)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with cls._lock:
+            cls._load_index()
+            previous = cls._index.pop(key, None)
+            if previous is not None:
+                cls._index_bytes -= previous[1]
+            cls._index[key] = (filename, len(data))
+            cls._index_bytes += len(data)
+            while cls._index_bytes > cls._cache_budget and len(cls._index) > 1:
+                old_key, (old_file, old_size) = cls._index.popitem(last=False)
+                cls._index_bytes -= old_size
+                cls._stats["evictions"] += 1
+                try:
+                    os.remove(os.path.join(cls._cache_dir, old_file))
+                except OSError:
+                    pass
+        return filename
+
+    @classmethod
+    def _key_lock(cls, key):
+        with cls._lock:
+            lock = cls._key_locks.get(key)
+            if lock is None:
+                lock = cls._key_locks[key] = threading.Lock()
+            return lock
+
+    @classmethod
+    def get_audio(cls, text, lang=None, synthesize=True):
+        """
+        Lấy audio đọc câu text, tổng hợp nếu chưa có trong cache.
+        synthesize=False chỉ trả về audio đã có trong cache, ngược lại ném LookupError.
+
+        Trả về dict: key, path, mimetype, engine, cached
+        """
+        text = cls.normalize(text or "")
+        if not text:
+            raise ValueError("Không có nội dung để đọc")
+        lang = lang if lang in ("en", "vi") else cls.guess_language(text)
+        engine = cls.get_engine()
+        key = cls.audio_key(text, lang, engine)
+
+        filename = cls._lookup(key)
+        cached = filename is not None
+        if filename is None and not synthesize:
+            with cls._lock:
+                cls._stats["misses"] += 1
+            raise LookupError("Audio chưa có trong cache")
+        if filename is None:
+            lock = cls._key_lock(key)
+            try:
+                with lock:
+                    # Request khác có thể vừa tổng hợp xong trong lúc chờ khóa
+                    filename = cls._lookup(key)
+                    cached = filename is not None
+                    if filename is None:
+                        started = time.time()
+                        try:
+                            data = engine.synthesize(text, lang)
+                        except Exception:
+                            with cls._lock:
+                                cls._stats["errors"] += 1
+                            raise
+                        filename = cls._store(key, engine.extension, data)
+                        elapsed = time.time() - started
+                        with cls._lock:
+                            cls._stats["synthesized"] += 1
+                            cls._stats["synthesize_seconds"] += elapsed
+                        print(f"Tạo audio ({engine.name}, {lang}): {elapsed:.2f}s")
+            finally:
+                # Luôn bỏ khóa theo key (kể cả khi tổng hợp lỗi) để _key_locks không phình ra theo số câu lỗi
+                with cls._lock:
+                    if cls._key_locks.get(key) is lock:
+                        del cls._key_locks[key]
+
+        with cls._lock:
+            cls._stats["hits" if cached else "misses"] += 1
+        extension = os.path.splitext(filename)[1]
+        return {
+            "key": key,
+            "path": os.path.join(cls._cache_dir, filename),
+            "mimetype": cls._mimetypes.get(extension, "application/octet-stream"),
+            "engine": engine.name,
+            "cached": cached
+        }
+
+    @classmethod
+    def prefetch(cls, text, lang=None):
+        """Tạo trước audio ở background (qua bộ thực thi tác vụ nền dùng chung) để client tải về ngay khi cần"""
+        return BackgroundExecutor.shared().submit(cls.get_audio, text, lang, name="tts")
+
+    @classmethod
+    def audio_url(cls, image_id, text, lang=None):
+        """
+        URL audio của caption ảnh. Tham số v là khóa nội dung nên URL thay đổi khi caption thay đổi
+        và client có thể cache vĩnh viễn.
+        """
+        if not text:
+            return None
+        text = cls.normalize(text)
+        lang = lang if lang in ("en", "vi") else cls.guess_language(text)
+        try:
+            version = cls.audio_key(text, lang)[:16]
+        except Exception:
+            return f"/api/image-caption/{image_id}/audio?lang={lang}"
+        return f"/api/image-caption/{image_id}/audio?lang={lang}&v={version}"
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            cls._load_index()
+            try:
+                engine = cls.get_engine().name
+            except Exception as e:
+                engine = f"unavailable: {e}"
+            return {
+                **cls._stats,
+                "engine": engine,
+                "entries": len(cls._index),
+                "cache_bytes": cls._index_bytes,
+                "cache_budget_bytes": cls._cache_budget
+            }
@@ -1,5 +1,6 @@
 # services/user_service.py
 from models.user import User
+from services.pagination import keyset_paginate
 import datetime
 
 class UserService:
@@ -59,8 +60,12 @@ class UserService:
         return user
     
     @staticmethod
-    def get_all_users(page=1, per_page=20, is_active=None, role=None):
-        """Lấy danh sách người dùng với phân trang, cho phép lọc theo is_active và role (chỉ admin)"""
+    def get_all_users(page=1, per_page=20, is_active=None, role=None, cursor=None, total=None):
+        """
+        Lấy danh sách người dùng với phân trang, cho phép lọc theo is_active và role (chỉ admin).
+        Có cursor (chuỗi rỗng = trang đầu): phân trang theo (created_at, _id), mới nhất trước, không đếm tổng
+        trừ khi total là "exact"/"approx"
+        """
         query = {}
         
         # Nếu is_active không phải None, chuyển về boolean và đưa vào query
@@ -76,6 +81,10 @@ class UserService:
         # Nếu role không phải None, thêm vào query
         if role is not None:
             query['role'] = role
+        
+        if cursor is not None:
+            result = keyset_paginate(User.objects(**query), cursor, per_page, total)
+            return {'items': result.items, **result.meta()}
             
         # Tính toán skip và limit cho phân trang
         skip = (page - 1) * per_page
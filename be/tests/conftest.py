@@ -0,0 +1,78 @@
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+# Các module của backend được import theo đường dẫn tương đối với thư mục be/ (như khi chạy app.py)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+@pytest.fixture
+def mongo():
+    """Kết nối mongoengine tới MongoDB giả lập trong bộ nhớ (mongomock), xóa dữ liệu sau mỗi test"""
+    mongomock = pytest.importorskip("mongomock")
+    import mongoengine
+
+    mongoengine.disconnect()
+    connection = mongoengine.connect("caption_test", host="mongodb://localhost", mongo_client_class=mongomock.MongoClient,
+                                     uuidRepresentation="standard")
+    yield connection
+    connection.drop_database("caption_test")
+    mongoengine.disconnect()
+
+
+@pytest.fixture(scope="session")
+def tiny_blip(tmp_path_factory):
+    """
+    Thư mục mô hình BLIP rất nhỏ, khởi tạo ngẫu nhiên (cố định seed), cùng cấu trúc file với pretrain/blip_default.
+    Bias của token kết thúc được nâng lên để beam search sinh các câu có độ dài khác nhau.
+    """
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    path = tmp_path_factory.mktemp("tiny_blip")
+    torch.manual_seed(0)
+    config = transformers.BlipConfig(
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+                           image_size=64, patch_size=16),
+        text_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+                         vocab_size=30524, encoder_hidden_size=32),
+    )
+    model = transformers.BlipForConditionalGeneration(config).eval()
+    with torch.no_grad():
+        model.text_decoder.cls.predictions.bias[config.text_config.sep_token_id] += 6.0
+    model.save_pretrained(path)
+
+    vocab = [f"tok{index}" for index in range(config.text_config.vocab_size)]
+    for index, token in ((0, "[PAD]"), (100, "[UNK]"), (101, "[CLS]"), (102, "[SEP]"), (103, "[MASK]"), (30522, "[DEC]")):
+        vocab[index] = token
+    vocab_file = path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab) + "\n")
+    tokenizer = transformers.BertTokenizer(str(vocab_file), bos_token="[DEC]")
+    image_processor = transformers.BlipImageProcessor(size={"height": 64, "width": 64})
+    transformers.BlipProcessor(image_processor=image_processor, tokenizer=tokenizer).save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture
+def tiny_model_type(tiny_blip, monkeypatch):
+    """Đăng ký mô hình BLIP nhỏ với ImageCaptionService dưới model_type "tiny", suy luận ngay trong tiến trình test"""
+    from services.image_caption_service import ImageCaptionService
+
+    monkeypatch.setattr(ImageCaptionService, "_worker_count", 0)
+    ImageCaptionService._registry.register("tiny", lambda: ImageCaptionService._load_local_model("tiny", tiny_blip))
+    return "tiny"
+
+
+@pytest.fixture
+def embedding_cache(monkeypatch):
+    """EmbeddingCacheService với bộ nhớ riêng cho từng test"""
+    from services.embedding_cache_service import EmbeddingCacheService
+
+    monkeypatch.setattr(EmbeddingCacheService, "_enabled", True)
+    monkeypatch.setattr(EmbeddingCacheService, "_memory_budget", 64 * 1024 * 1024)
+    monkeypatch.setattr(EmbeddingCacheService, "_memory", OrderedDict())
+    monkeypatch.setattr(EmbeddingCacheService, "_memory_bytes", 0)
+    monkeypatch.setattr(EmbeddingCacheService, "_stats", dict.fromkeys(EmbeddingCacheService._stats, 0))
+    return EmbeddingCacheService
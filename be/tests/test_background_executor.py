@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from services.background_executor import BackgroundExecutor, BackgroundQueueFull
+
+
+def test_runs_tasks_and_reports_errors():
+    executor = BackgroundExecutor(max_workers=2, name="test")
+    errors = []
+    ok = executor.submit(lambda: 42, name="ok")
+    bad = executor.submit(lambda: 1 / 0, name="bad", on_error=errors.append)
+
+    assert ok.result(5) == 42
+    with pytest.raises(ZeroDivisionError):
+        bad.result(5)
+    assert executor.wait_idle(5)
+    stats = executor.get_stats()
+    assert stats["completed"] == 1 and stats["failed"] == 1
+    assert stats["tasks"]["bad"]["failed"] == 1 and stats["recent_errors"][0]["task"] == "bad"
+    assert len(errors) == 1 and isinstance(errors[0], ZeroDivisionError)
+    executor.shutdown()
+
+
+def test_adds_worker_while_idle_worker_has_not_taken_its_task():
+    executor = BackgroundExecutor(max_workers=3, name="test")
+    executor.submit(lambda: None).result(5)
+    while executor._idle != 1:
+        threading.Event().wait(0.01)
+
+    # Gửi hai tác vụ trước khi thread rảnh kịp lấy tác vụ đầu tiên: thread đó vẫn được tính là rảnh,
+    # nên cần thêm một thread cho tác vụ thứ hai. Hai tác vụ chỉ hoàn thành khi chạy đồng thời.
+    started = threading.Barrier(2, timeout=5)
+    with executor._cond:
+        futures = [executor.submit(started.wait) for _ in range(2)]
+    for future in futures:
+        future.result(5)
+    assert executor.get_stats()["workers"] == 2
+    executor.shutdown()
+
+
+def test_does_not_exceed_max_workers():
+    executor = BackgroundExecutor(max_workers=2, name="test")
+    release = threading.Event()
+    futures = [executor.submit(release.wait, 5) for _ in range(6)]
+
+    assert executor.get_stats()["workers"] == 2
+    release.set()
+    for future in futures:
+        future.result(5)
+    executor.shutdown()
+
+
+def test_drop_oldest_and_reject_when_queue_is_full():
+    release = threading.Event()
+    for policy, expected in ((BackgroundExecutor.DROP_OLDEST, "dropped"), (BackgroundExecutor.REJECT, "rejected")):
+        release.clear()
+        executor = BackgroundExecutor(max_workers=1, max_queue=1, policy=policy, name="test")
+        running = threading.Event()
+        executor.submit(lambda: (running.set(), release.wait(5)))
+        assert running.wait(5)
+        queued = executor.submit(lambda: "queued")
+        newest = executor.submit(lambda: "newest")
+
+        lost = queued if policy == BackgroundExecutor.DROP_OLDEST else newest
+        kept = newest if policy == BackgroundExecutor.DROP_OLDEST else queued
+        with pytest.raises(BackgroundQueueFull):
+            lost.result(5)
+        release.set()
+        assert kept.result(5) in ("queued", "newest")
+        assert executor.get_stats()[expected] == 1
+        executor.shutdown()
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        BackgroundExecutor(policy="block")
@@ -0,0 +1,128 @@
+import io
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from models.image import Image
+from services import batch_upload_service
+from services.batch_upload_service import BatchUploadService
+
+
+def is_allowed(filename):
+    return filename.rsplit('.', 1)[-1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
+
+
+def _file(name, data=b"image"):
+    return FileStorage(stream=io.BytesIO(data), filename=name, content_type="image/jpeg")
+
+
+def _zip(name, entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for entry_name, data in entries:
+            archive.writestr(entry_name, data)
+    buffer.seek(0)
+    return FileStorage(stream=buffer, filename=name, content_type="application/zip")
+
+
+@pytest.fixture
+def saved(mongo, monkeypatch):
+    """Thay ImageService.upload_image bằng bản chỉ lưu Image; file tên bắt đầu bằng "fail" gây lỗi khi lưu"""
+    def fake_upload_image(file, description, user_id, location=None, original_file_name=None):
+        data = file.stream.read()
+        if original_file_name.startswith("fail"):
+            raise RuntimeError("lỗi lưu ảnh")
+        image = Image(file_name=original_file_name, original_file_name=original_file_name,
+                      content_type=file.content_type, location=location).save()
+        image._blob_data = data
+        return image
+
+    monkeypatch.setattr(batch_upload_service.ImageService, "upload_image", staticmethod(fake_upload_image))
+    monkeypatch.setattr(BatchUploadService, "_max_files", 200)
+    monkeypatch.setattr(BatchUploadService, "_max_file_bytes", 16)
+
+
+def test_zip_skips_metadata_hidden_and_unsupported_entries(saved):
+    archive = _zip("photos.zip", [
+        ("trip/a.jpg", b"a"),
+        ("__MACOSX/trip/._a.jpg", b"meta"),
+        ("trip/.hidden.png", b"hidden"),
+        ("trip/notes.txt", b"text"),
+        ("trip/sub/", b""),
+        ("trip/b.PNG", b"b"),
+    ])
+    names = [(name, error) for name, _, error in BatchUploadService.iter_files([], [archive], is_allowed)]
+    assert names == [("a.jpg", None), ("b.PNG", None)]
+
+
+def test_invalid_and_oversized_files_get_per_file_errors(saved):
+    files = [_file("ok.jpg"), _file("doc.pdf"), _file("big.jpg", b"x" * 17), _file("")]
+    archives = [_file("broken.zip", b"not a zip"), _zip("photos.zip", [("huge.jpg", b"x" * 17), ("c.jpg", b"c")])]
+
+    images, results = BatchUploadService.upload_files(files, archives, None, is_allowed)
+
+    assert [image.original_file_name for image in images] == ["ok.jpg", "c.jpg"]
+    assert [(result["file_name"], "error" in result) for result in results] == [
+        ("ok.jpg", False), ("doc.pdf", True), ("big.jpg", True), ("broken.zip", True), ("huge.jpg", True), ("c.jpg", False)
+    ]
+    assert [image._blob_data for image in images] == [b"image", b"c"]
+
+
+def _patch_central_directory(archive, flag_bits=None, compress_type=None):
+    """Sửa bảng thư mục của zip: đặt thêm bit flag (vd: 0x1 là mã hóa) hoặc phương thức nén cho từng entry theo tên"""
+    data = bytearray(archive.stream.getvalue())
+    offset = int.from_bytes(data[data.rfind(b"PK\x05\x06") + 16:][:4], "little")
+    while data[offset:offset + 4] == b"PK\x01\x02":
+        name_length, extra_length, comment_length = (
+            int.from_bytes(data[offset + start:offset + start + 2], "little") for start in (28, 30, 32)
+        )
+        name = data[offset + 46:offset + 46 + name_length].decode()
+        if name in (flag_bits or {}):
+            data[offset + 8] |= flag_bits[name]
+        if name in (compress_type or {}):
+            data[offset + 10:offset + 12] = compress_type[name].to_bytes(2, "little")
+        offset += 46 + name_length + extra_length + comment_length
+    return _file(archive.filename, bytes(data))
+
+
+def test_unreadable_zip_entries_do_not_abort_batch(saved):
+    archive = _zip("photos.zip", [("a.jpg", b"a"), ("locked.jpg", b"l"), ("odd.jpg", b"o"), ("b.jpg", b"b")])
+    # locked.jpg được đánh dấu mã hóa, odd.jpg dùng phương thức nén không hỗ trợ
+    archive = _patch_central_directory(archive, flag_bits={"locked.jpg": 0x1}, compress_type={"odd.jpg": 99})
+
+    images, results = BatchUploadService.upload_files([], [archive], None, is_allowed)
+
+    assert [image.original_file_name for image in images] == ["a.jpg", "b.jpg"]
+    assert [result["file_name"] for result in results if "error" in result] == ["locked.jpg", "odd.jpg"]
+
+
+def test_files_over_batch_limit_are_rejected(saved, monkeypatch):
+    monkeypatch.setattr(BatchUploadService, "_max_files", 2)
+    files = [_file(f"{index}.jpg") for index in range(3)]
+
+    images, results = BatchUploadService.upload_files(files, [], None, is_allowed)
+
+    assert len(images) == 2
+    assert "id" in results[0] and "id" in results[1]
+    assert "error" in results[2] and results[2]["file_name"] == "2.jpg"
+
+
+def test_failed_save_does_not_abort_batch(saved):
+    files = [_file("a.jpg"), _file("fail.jpg"), _file("b.jpg")]
+
+    images, results = BatchUploadService.upload_files(files, [], None, is_allowed)
+
+    assert [image.original_file_name for image in images] == ["a.jpg", "b.jpg"]
+    assert results[1] == {"file_name": "fail.jpg", "error": "Không thể lưu ảnh"}
+    assert Image.objects.count() == 2
+
+
+def test_only_first_images_keep_their_data(saved):
+    files = [_file(f"{index}.jpg", bytes([index])) for index in range(4)]
+
+    images, _ = BatchUploadService.upload_files(files, [], None, is_allowed, keep_first=2)
+    assert [image._blob_data for image in images] == [b"\x00", b"\x01", None, None]
+
+    images, _ = BatchUploadService.upload_files([_file("x.jpg")], [], None, is_allowed, keep_first=0)
+    assert images[0]._blob_data is None
@@ -0,0 +1,152 @@
+import os
+from collections import OrderedDict
+
+import pytest
+
+from services.background_executor import BackgroundExecutor
+from services.caption_cache_service import CaptionCacheService
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """CaptionCacheService với trạng thái trong bộ nhớ riêng cho từng test"""
+    monkeypatch.setattr(CaptionCacheService, "_enabled", True)
+    monkeypatch.setattr(CaptionCacheService, "_memory", OrderedDict())
+    monkeypatch.setattr(CaptionCacheService, "_memory_bytes", 0)
+    monkeypatch.setattr(CaptionCacheService, "_model_versions", {})
+    monkeypatch.setattr(CaptionCacheService, "_file_digests", {})
+    monkeypatch.setattr(CaptionCacheService, "_stats", dict.fromkeys(CaptionCacheService._stats, 0))
+    return CaptionCacheService
+
+
+def write_model(directory, weights):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        f.write('{"model_type": "blip"}')
+    with open(os.path.join(directory, "model.safetensors"), "wb") as f:
+        f.write(weights)
+    return str(directory)
+
+
+def test_key_depends_on_every_decoding_parameter(cache):
+    base = ("abc", "default", 30, 5, "en", "v1")
+    key = cache.make_key(*base)
+
+    assert cache.make_key(*base) == key
+    for index, value in enumerate(["abd", "travel", 31, 3, "vi", "v2"]):
+        changed = list(base)
+        changed[index] = value
+        assert cache.make_key(*changed) != key
+
+
+def test_memory_tier_evicts_least_recently_used_entries(cache, monkeypatch):
+    monkeypatch.setattr(cache, "_persistent_enabled", False)
+    entry_size = len(cache.make_key("a", "default", 30, 5, "en", "v")) + len("caption") + cache._entry_overhead
+    monkeypatch.setattr(cache, "_memory_budget", entry_size * 2)
+    keys = [cache.make_key(name, "default", 30, 5, "en", "v") for name in ("a", "b", "c")]
+
+    cache.put(keys[0], "caption", "default", "v")
+    cache.put(keys[1], "caption", "default", "v")
+    assert cache.get(keys[0]) == "caption"  # a trở thành mục dùng gần nhất
+    cache.put(keys[2], "caption", "default", "v")
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "caption"
+    assert cache.get(keys[2]) == "caption"
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_persistent_hit_is_promoted_to_memory(cache, mongo, monkeypatch):
+    from models.caption_cache import CaptionCacheEntry
+
+    monkeypatch.setattr(cache, "_persistent_enabled", True)
+    key = cache.make_key("img", "default", 30, 5, "en", "v1")
+    CaptionCacheEntry(key=key, caption="a dog", model_type="default", model_version="v1").save()
+
+    assert cache.get(key) == "a dog"
+    # Lượt dùng được ghi ở background, không nằm trên đường xử lý request
+    assert BackgroundExecutor.shared().wait_idle(5)
+    assert CaptionCacheEntry.objects(key=key).first().hits == 1
+    CaptionCacheEntry.objects(key=key).delete()
+    assert cache.get(key) == "a dog"
+    stats = cache.get_stats()
+    assert stats["persistent_hits"] == 1
+    assert stats["memory_hits"] == 1
+
+
+def test_fingerprint_follows_content_not_location_or_mtime(cache, tmp_path):
+    first = write_model(tmp_path / "a", b"\x01" * 4096)
+    second = write_model(tmp_path / "b", b"\x01" * 4096)
+    os.utime(os.path.join(second, "model.safetensors"), (1, 1))
+
+    assert cache.fingerprint_model_dir(first) == cache.fingerprint_model_dir(second)
+
+    write_model(second, b"\x01" * 4095 + b"\x02")
+    assert cache.fingerprint_model_dir(first) != cache.fingerprint_model_dir(second)
+
+
+def test_large_files_are_fingerprinted_from_sampled_windows(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_full_hash_max_bytes", 1024)
+    monkeypatch.setattr(cache, "_sample_bytes", 64)
+    monkeypatch.setattr(cache, "_sample_count", 4)
+    weights = bytearray(64 * 1024)
+    path = write_model(tmp_path / "m", bytes(weights))
+    original = cache.fingerprint_model_dir(path)
+
+    # Byte cuối nằm trong đoạn được lấy mẫu cuối cùng
+    weights[-1] = 7
+    write_model(path, bytes(weights))
+    assert cache.fingerprint_model_dir(path) != original
+
+
+def test_remote_models_are_versioned_by_name(cache):
+    assert cache.fingerprint_model_dir("Salesforce/blip-image-captioning-base") == "remote:Salesforce/blip-image-captioning-base"
+
+
+def test_model_change_on_disk_only_forgets_that_model(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_persistent_enabled", False)
+    monkeypatch.setattr(cache, "_version_check_interval", 0)
+    path = write_model(tmp_path / "m", b"\x01" * 128)
+    version = cache.model_version("default", path)
+    cache.put("k-default", "old caption", "default", version)
+    cache.put("k-travel", "travel caption", "travel", "t1")
+
+    assert cache.model_version("default", path) == version
+    assert cache.get("k-default") == "old caption"
+
+    write_model(path, b"\x02" * 128)
+    assert cache.model_version("default", path) != version
+    assert cache.get("k-default") is None
+    assert cache.get("k-travel") == "travel caption"
+
+
+def test_prune_keeps_only_current_versions(cache, mongo, monkeypatch):
+    from models.caption_cache import CaptionCacheEntry
+
+    monkeypatch.setattr(cache, "_persistent_enabled", True)
+    entries = [
+        ("current", "default", "v2:fp32:pp1"),
+        ("current-onnx", "default", "v2:onnx:pp1"),
+        ("old", "default", "v1:fp32:pp1"),
+        ("travel", "travel", "t1:fp32:pp1"),
+        ("dropped", "hue", "h1:fp32:pp1"),
+    ]
+    for key, model_type, version in entries:
+        CaptionCacheEntry(key=key, caption="c", model_type=model_type, model_version=version).save()
+
+    deleted = cache.prune({"default": "v2", "travel": "t1"})
+
+    assert deleted == 2
+    assert sorted(entry.key for entry in CaptionCacheEntry.objects) == ["current", "current-onnx", "travel"]
+
+
+def test_invalidate_can_keep_the_current_version(cache, mongo, monkeypatch):
+    from models.caption_cache import CaptionCacheEntry
+
+    monkeypatch.setattr(cache, "_persistent_enabled", True)
+    for key, version in (("new", "v2:fp32:pp1"), ("old", "v1:fp32:pp1")):
+        CaptionCacheEntry(key=key, caption="c", model_type="default", model_version=version).save()
+    CaptionCacheEntry(key="travel", caption="c", model_type="travel", model_version="v1:fp32:pp1").save()
+
+    assert cache.invalidate("default", keep_version="v2") == 1
+    assert sorted(entry.key for entry in CaptionCacheEntry.objects) == ["new", "travel"]
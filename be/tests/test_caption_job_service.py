@@ -0,0 +1,126 @@
+import datetime
+import threading
+
+import pytest
+
+from models.caption_job import CaptionJob
+from models.image import Image
+from models.user import User
+from services.caption_job_service import CaptionJobService
+
+
+@pytest.fixture
+def job_env(mongo, monkeypatch):
+    """Người dùng, ảnh và caption_image giả (không chạy mô hình) cho các test hàng đợi job"""
+    user = User(username="alice", password="x", email="alice@example.com").save()
+    image = Image(file_name="a.jpg", content_type="image/jpeg", uploaded_by=user).save()
+    calls = []
+
+    def fake_caption_image(image, user_id, model_type, language, preset, latency_budget_ms):
+        calls.append((str(image.id), user_id))
+        return "a dog", {"preset": "balanced"}
+
+    monkeypatch.setattr(CaptionJobService, "caption_image", staticmethod(fake_caption_image))
+    monkeypatch.setattr(CaptionJobService, "_lease_seconds", 300.0)
+    monkeypatch.setattr(CaptionJobService, "_max_attempts", 3)
+    return user, image, calls
+
+
+def _expire(job):
+    CaptionJob.objects(id=job.id).update_one(set__lease_expires_at=datetime.datetime.now() - datetime.timedelta(seconds=1))
+
+
+def test_claim_takes_oldest_queued_job_once(job_env):
+    user, image, _ = job_env
+    first = CaptionJob(image=image, user=user, created_at=datetime.datetime(2024, 1, 1)).save()
+    second = CaptionJob(image=image, user=user, created_at=datetime.datetime(2024, 1, 2)).save()
+
+    claimed = CaptionJobService._claim_next("w1")
+    assert claimed.id == first.id
+    assert claimed.status == "running" and claimed.worker == "w1" and claimed.attempts == 1
+    assert claimed.claim_token and claimed.lease_expires_at > datetime.datetime.now()
+
+    assert CaptionJobService._claim_next("w2").id == second.id
+    assert CaptionJobService._claim_next("w3") is None
+
+
+def test_expired_lease_is_reclaimed_with_a_new_token(job_env):
+    user, image, _ = job_env
+    CaptionJob(image=image, user=user).save()
+    claimed = CaptionJobService._claim_next("w1")
+    assert CaptionJobService._claim_next("w2") is None
+
+    _expire(claimed)
+    reclaimed = CaptionJobService._claim_next("w2")
+    assert reclaimed.id == claimed.id
+    assert reclaimed.worker == "w2" and reclaimed.attempts == 2
+    assert reclaimed.claim_token != claimed.claim_token
+
+
+def test_job_over_max_attempts_is_failed(job_env):
+    user, image, _ = job_env
+    job = CaptionJob(image=image, user=user, status="running", attempts=3).save()
+    _expire(job)
+
+    assert CaptionJobService._claim_next("w1") is None
+    CaptionJobService._fail_abandoned()
+    job.reload()
+    assert job.status == "failed" and "số lần thử" in job.error
+
+
+def test_process_records_result(job_env):
+    user, image, calls = job_env
+    CaptionJob(image=image, user=user).save()
+    job = CaptionJobService._claim_next("w1")
+
+    CaptionJobService._process(job)
+    job.reload()
+    assert job.status == "done" and job.caption == "a dog" and job.preset_used == "balanced"
+    assert calls == [(str(image.id), str(user.id))]
+
+
+def test_stale_claim_does_not_overwrite_reclaimed_job(job_env):
+    user, image, _ = job_env
+    CaptionJob(image=image, user=user).save()
+    stale = CaptionJobService._claim_next("w1")
+    _expire(stale)
+    current = CaptionJobService._claim_next("w2")
+
+    # Worker cũ xử lý xong sau khi job đã được nhận lại: kết quả của nó bị bỏ qua
+    CaptionJobService._process(stale)
+    job = CaptionJob.objects(id=current.id).first()
+    assert job.status == "running" and job.worker == "w2" and job.caption is None
+
+
+def test_job_without_user_is_failed_with_reason(job_env):
+    _, image, calls = job_env
+    CaptionJob(image=image).save()
+    job = CaptionJobService._claim_next("w1")
+
+    CaptionJobService._process(job)
+    job.reload()
+    assert job.status == "failed" and "người dùng" in job.error
+    assert calls == []
+
+
+def test_renew_leases_extends_only_current_claim(job_env, monkeypatch):
+    user, image, _ = job_env
+    CaptionJob(image=image, user=user).save()
+    CaptionJob(image=image, user=user).save()
+    current = CaptionJobService._claim_next("w1")
+    stale = CaptionJobService._claim_next("w1")
+    CaptionJob.objects(id=stale.id).update_one(set__claim_token="other")
+    expires = {job.id: CaptionJob.objects(id=job.id).first().lease_expires_at for job in (current, stale)}
+
+    class OneRound(threading.Event):
+        """Sự kiện dừng cho phép đúng một vòng gia hạn"""
+        rounds = 0
+
+        def wait(self, timeout=None):
+            self.rounds += 1
+            return self.rounds > 1
+
+    monkeypatch.setattr(CaptionJobService, "_lease_seconds", 600.0)
+    CaptionJobService._renew_leases([current, stale], OneRound())
+    assert CaptionJob.objects(id=current.id).first().lease_expires_at > expires[current.id]
+    assert CaptionJob.objects(id=stale.id).first().lease_expires_at == expires[stale.id]
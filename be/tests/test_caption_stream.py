@@ -0,0 +1,105 @@
+import io
+import threading
+from collections import OrderedDict
+
+import pytest
+
+from services.caption_cache_service import CaptionCacheService
+from services.image_caption_service import ImageCaptionService
+
+
+@pytest.fixture
+def stream_env(tiny_model_type, embedding_cache, monkeypatch):
+    """Mô hình BLIP nhỏ, cache caption chỉ trong bộ nhớ và bộ đếm số bước giải mã"""
+    monkeypatch.setattr(CaptionCacheService, "_enabled", True)
+    monkeypatch.setattr(CaptionCacheService, "_persistent_enabled", False)
+    monkeypatch.setattr(CaptionCacheService, "_memory", OrderedDict())
+    monkeypatch.setattr(CaptionCacheService, "_memory_bytes", 0)
+    monkeypatch.setattr(CaptionCacheService, "_stats", dict.fromkeys(CaptionCacheService._stats, 0))
+    monkeypatch.setattr(ImageCaptionService, "_streams", {})
+    monkeypatch.setattr(ImageCaptionService, "_stream_watcher", None)
+    monkeypatch.setattr(ImageCaptionService, "_stream_cancel_poll_seconds", 0.02)
+
+    steps = []
+    decode_embeds = ImageCaptionService._decode_embeds.__func__
+
+    def counting_decode_embeds(cls, model, image_embeds, max_length, num_beams, on_step=None):
+        def counting_step(token_ids):
+            steps.append(len(token_ids))
+            return on_step(token_ids)
+        return decode_embeds(cls, model, image_embeds, max_length, num_beams, on_step=counting_step if on_step else None)
+
+    monkeypatch.setattr(ImageCaptionService, "_decode_embeds", classmethod(counting_decode_embeds))
+    return steps
+
+
+def image_bytes(value=128):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (value, value, value)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def run_stream(cancel_event=None, value=128):
+    events = ImageCaptionService.stream_caption(image_bytes(value), max_length=12, num_beams=1, model_type="tiny",
+                                                cancel_event=cancel_event)
+    return [event for event in events if event["type"] != "ping"]
+
+
+def test_partials_are_followed_by_done_and_cached(stream_env):
+    events = run_stream()
+
+    assert [event["type"] for event in events[:-1]] == ["partial"] * (len(events) - 1)
+    assert len(events) >= 2
+    done = events[-1]
+    assert done["type"] == "done" and not done["cached"] and done["caption"] == done["caption_en"]
+    assert done["caption"] == events[-2]["caption"]
+    steps = len(stream_env)
+
+    # Lần sau trùng ảnh và tham số: trả về ngay từ cache, không giải mã
+    assert run_stream() == [{"type": "done", "caption": done["caption"], "caption_en": None, "cached": True}]
+    assert len(stream_env) == steps
+
+
+def test_cancel_stream_sets_in_process_event(stream_env, mongo):
+    stream_id, cancel_event = ImageCaptionService.open_stream("user-1")
+
+    assert ImageCaptionService.cancel_stream(stream_id, "user-2") is False
+    assert not cancel_event.is_set()
+    assert ImageCaptionService.cancel_stream(stream_id, "user-1") is True
+    assert cancel_event.is_set()
+
+    events = run_stream(cancel_event)
+    assert all(event["type"] == "partial" for event in events)
+    assert len(stream_env) == 1
+    ImageCaptionService.close_stream(stream_id)
+
+
+def test_cancel_from_another_worker_reaches_stream_through_mongo(stream_env, mongo):
+    from models.caption_stream import CaptionStream
+
+    stream_id, cancel_event = ImageCaptionService.open_stream("user-1")
+
+    # Worker khác không có phiên trong bộ nhớ nên chỉ đánh dấu cờ hủy trong MongoDB
+    with ImageCaptionService._streams_lock:
+        local = ImageCaptionService._streams.pop(stream_id)
+    assert ImageCaptionService.cancel_stream(stream_id, "user-2") is False
+    assert ImageCaptionService.cancel_stream(stream_id, "user-1") is True
+    assert not cancel_event.is_set()
+    assert CaptionStream.objects(stream_id=stream_id).first().cancelled
+
+    with ImageCaptionService._streams_lock:
+        ImageCaptionService._streams[stream_id] = local
+    assert cancel_event.wait(5)
+    assert "done" not in [event["type"] for event in run_stream(cancel_event)]
+    ImageCaptionService.close_stream(stream_id)
+
+
+def test_closing_generator_stops_decoding(stream_env):
+    cancel_event = threading.Event()
+    events = ImageCaptionService.stream_caption(image_bytes(), max_length=12, num_beams=1, model_type="tiny",
+                                                cancel_event=cancel_event)
+    next(event for event in events if event["type"] == "partial")
+    events.close()
+
+    assert cancel_event.is_set()
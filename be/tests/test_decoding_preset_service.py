@@ -0,0 +1,100 @@
+import pytest
+
+from services import decoding_preset_service
+from services.decoding_preset_service import DecodingPresetService
+
+
+@pytest.fixture
+def presets(monkeypatch):
+    """DecodingPresetService với số đo, thống kê và đồng hồ riêng cho từng test"""
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(decoding_preset_service.time, "time", lambda: clock["now"])
+    monkeypatch.setattr(DecodingPresetService, "_timings", {})
+    monkeypatch.setattr(DecodingPresetService, "_stats", dict.fromkeys(DecodingPresetService._stats, 0))
+    monkeypatch.setattr(DecodingPresetService, "_default_preset", "quality")
+    monkeypatch.setattr(DecodingPresetService, "_default_budget_ms", 0.0)
+    monkeypatch.setattr(DecodingPresetService, "_stale_seconds", 120.0)
+    return clock
+
+
+def record_preset(name, seconds, model_type="default"):
+    preset = DecodingPresetService.PRESETS[name]
+    DecodingPresetService.record(model_type, preset["max_length"], preset["num_beams"], seconds)
+
+
+def test_no_budget_keeps_requested_preset(presets):
+    record_preset("quality", 10.0)
+
+    resolved = DecodingPresetService.resolve("default", "balanced", latency_budget_ms=0)
+    assert (resolved["preset"], resolved["num_beams"], resolved["max_length"]) == ("balanced", 3, 30)
+    assert resolved["latency_budget_ms"] is None and resolved["estimated_ms"] is None
+    assert DecodingPresetService.resolve("default", "unknown")["preset"] == "quality"
+
+
+def test_budget_that_fits_keeps_requested_preset(presets):
+    record_preset("quality", 0.5)
+
+    resolved = DecodingPresetService.resolve("default", "quality", latency_budget_ms=600)
+    assert resolved["preset"] == "quality" and resolved["estimated_ms"] == 500.0
+    assert DecodingPresetService.get_stats()["downgraded"] == 0
+
+
+def test_downgrades_to_best_preset_within_budget(presets):
+    record_preset("quality", 2.0)
+    record_preset("balanced", 0.8)
+    record_preset("fast", 0.2)
+
+    resolved = DecodingPresetService.resolve("default", "quality", latency_budget_ms=1000)
+    assert (resolved["preset"], resolved["requested_preset"]) == ("balanced", "quality")
+    assert resolved["estimated_ms"] == 800.0
+    stats = DecodingPresetService.get_stats()
+    assert stats["downgraded"] == 1 and stats["over_budget"] == 0
+
+
+def test_falls_back_to_fastest_preset_when_nothing_fits(presets):
+    record_preset("quality", 2.0)
+    record_preset("balanced", 1.2)
+    record_preset("fast", 0.4)
+
+    resolved = DecodingPresetService.resolve("default", "quality", latency_budget_ms=100)
+    assert resolved["preset"] == "fast" and resolved["estimated_ms"] == 400.0
+    assert DecodingPresetService.get_stats()["over_budget"] == 1
+
+
+def test_never_upgrades_above_requested_preset(presets):
+    record_preset("quality", 0.1)
+    record_preset("fast", 0.01)
+
+    assert DecodingPresetService.resolve("default", "fast", latency_budget_ms=10000)["preset"] == "fast"
+
+
+def test_unmeasured_presets_scale_with_beams_and_length(presets):
+    record_preset("fast", 0.2)  # max_length 20, num_beams 1
+
+    assert DecodingPresetService.estimate("default", 30, 3) == pytest.approx(0.2 * 90 / 20)
+    assert DecodingPresetService.estimate("default", 30, 5) == pytest.approx(0.2 * 150 / 20)
+    assert DecodingPresetService.estimate("travel", 30, 5) is None
+    assert DecodingPresetService.resolve("default", "quality", latency_budget_ms=1000)["preset"] == "balanced"
+
+
+def test_ewma_smooths_fresh_samples(presets):
+    DecodingPresetService.record("default", 30, 5, 1.0)
+    DecodingPresetService.record("default", 30, 5, 2.0)
+
+    assert DecodingPresetService.estimate("default", 30, 5) == pytest.approx(1.2)
+    assert DecodingPresetService.get_stats()["timings"]["default:30:5"]["samples"] == 2
+
+
+def test_stale_samples_are_ignored_and_restarted(presets):
+    record_preset("quality", 5.0)
+    presets["now"] += 121
+
+    # Không còn số đo mới: không ước lượng được nên giữ preset được yêu cầu để đo lại
+    assert DecodingPresetService.estimate("default", 30, 5) is None
+    resolved = DecodingPresetService.resolve("default", "quality", latency_budget_ms=1000)
+    assert resolved["preset"] == "quality" and resolved["estimated_ms"] is None
+
+    # Số đo mới thay thế hoàn toàn giá trị cũ thay vì được làm mượt cùng nó
+    record_preset("quality", 0.5)
+    assert DecodingPresetService.estimate("default", 30, 5) == pytest.approx(0.5)
+    assert DecodingPresetService.get_stats()["timings"]["default:30:5"]["samples"] == 1
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+
+def embedding(value, shape=(1, 4, 8)):
+    return np.full(shape, value, dtype=np.float32)
+
+
+def test_entries_are_stored_as_float16_copies(embedding_cache):
+    batch = embedding(0.5, shape=(2, 4, 8))
+    embedding_cache.put("k", batch[0:1], "default")
+    batch[...] = 0
+
+    stored = embedding_cache.get("k")
+    assert stored.dtype == np.float16
+    assert stored.shape == (1, 4, 8)
+    assert np.all(stored == np.float16(0.5))
+
+
+def test_byte_budget_evicts_least_recently_used(embedding_cache, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "_memory_budget", 2 * embedding(0).astype(np.float16).nbytes)
+
+    embedding_cache.put("a", embedding(1), "default")
+    embedding_cache.put("b", embedding(2), "default")
+    assert embedding_cache.get("a") is not None
+    embedding_cache.put("c", embedding(3), "default")
+
+    assert embedding_cache.get("b") is None
+    assert embedding_cache.get("a") is not None
+    assert embedding_cache.get("c") is not None
+    assert embedding_cache.get_stats()["evictions"] == 1
+
+
+def test_invalidate_only_drops_one_model(embedding_cache):
+    embedding_cache.put("a", embedding(1), "default")
+    embedding_cache.put("b", embedding(2), "travel")
+
+    embedding_cache.invalidate("default")
+
+    assert embedding_cache.get("a") is None
+    assert embedding_cache.get("b") is not None
+    assert embedding_cache.get_stats()["memory_bytes"] == embedding(0).astype(np.float16).nbytes
+
+
+def test_disabled_cache_stores_nothing(embedding_cache, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "_enabled", False)
+    embedding_cache.put("a", embedding(1), "default")
+    assert embedding_cache.get("a") is None
+
+
+def test_generate_batch_caches_fresh_embeddings_and_reuses_them(embedding_cache, tiny_model_type):
+    from services.image_caption_service import ImageCaptionService
+
+    processor = ImageCaptionService._get_model(tiny_model_type)[1]
+    pixel_values = processor(images=[np.full((64, 64, 3), value, dtype=np.uint8) for value in (0, 255)],
+                             return_tensors="np")["pixel_values"]
+    key = (tiny_model_type, 10, 2)
+    items = [("image-a", pixel_values[0:1], None), (None, pixel_values[1:2], None)]
+
+    # Embedding vừa tính được giải mã ở độ chính xác đầy đủ, chỉ bản lưu cache là float16
+    model = ImageCaptionService._get_model(tiny_model_type)[0]
+    assert ImageCaptionService._encode_images(model, pixel_values).dtype == np.float32
+
+    captions = ImageCaptionService._run_generate_batch(key, items)
+
+    assert len(captions) == 2
+    assert embedding_cache.get_stats()["entries"] == 1
+    cached = embedding_cache.get("image-a")
+    assert cached.dtype == np.float16
+
+    # Lần sau chỉ chạy text decoder trên embedding đã cache
+    again = ImageCaptionService._run_generate_batch(key, [("image-a", None, cached)])
+    assert len(again) == 1
+    assert embedding_cache.get_stats()["writes"] == 1
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from services.evaluation_service import EvaluationService
+
+# Giá trị CIDEr-D do pycocoevalcap 1.2 (Cider().compute_score) tính trên cùng dữ liệu, token tách theo khoảng trắng
+GTS = {
+    1: ["a man riding a horse on a beach", "a person rides a horse near the ocean"],
+    2: ["two dogs playing in the snow", "a couple of dogs run through snow"],
+    3: ["a plate of food with rice and vegetables"],
+}
+RES = {1: "a man rides a horse on the beach", 2: "two dogs run in the snow", 3: "a plate with rice and meat"}
+PYCOCOEVALCAP_CIDER = 3.0733536531251757
+
+
+@pytest.fixture
+def whitespace_tokens(monkeypatch):
+    """Tách token theo khoảng trắng như dữ liệu đầu vào của pycocoevalcap (không cần dữ liệu punkt của nltk)"""
+    monkeypatch.setattr(EvaluationService, "tokenize", staticmethod(str.split))
+
+
+def test_cider_matches_pycocoevalcap(whitespace_tokens):
+    score = EvaluationService.corpus_cider_score([GTS[key] for key in GTS], [RES[key] for key in GTS])
+    assert score == pytest.approx(PYCOCOEVALCAP_CIDER, rel=1e-9)
+
+
+def test_cider_length_penalty_uses_bigram_count(whitespace_tokens):
+    # Cùng n-gram nhưng độ dài khác nhau: điểm giảm theo chênh lệch số bigram
+    references = [["a dog runs on grass"], ["a cat sleeps on a sofa"]]
+    exact = EvaluationService.corpus_cider_score(references, ["a dog runs on grass", "a cat sleeps on a sofa"])
+    longer = EvaluationService.corpus_cider_score(references, ["a dog runs on grass grass grass grass", "a cat sleeps on a sofa"])
+    assert longer < exact
+    assert EvaluationService.corpus_cider_score(references, []) == 0.0
+
+
+def test_corpus_bleu_of_identical_captions_is_one(whitespace_tokens):
+    scores = EvaluationService.corpus_bleu_scores(["a dog runs on the grass"], ["a dog runs on the grass"])
+    assert scores == {name: pytest.approx(1.0) for name in ("bleu1", "bleu2", "bleu3", "bleu4")}
+    assert EvaluationService.corpus_bleu_scores([], []) == {name: 0.0 for name in ("bleu1", "bleu2", "bleu3", "bleu4")}
+
+
+def test_find_reference_reloads_changed_ground_truth(tmp_path, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(EvaluationService, "_indexes", {})
+    path = str(tmp_path / "test.xlsx")
+
+    def write(rows):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["image", "caption"])
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(path)
+
+    write([("Images/Dog_1.JPG", "a dog"), ("cat_2", "a cat")])
+    assert EvaluationService.find_reference(None, "dog_1.jpg", path=path) == "a dog"
+    assert EvaluationService.find_reference("upload/cat_2.png", path=path) == "a cat"
+    assert EvaluationService.find_reference("bird.jpg", path=path) is None
+
+    write([("bird.jpg", "a bird")])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert EvaluationService.find_reference("bird.jpg", path=path) == "a bird"
+    assert EvaluationService.find_reference("dog_1.jpg", path=str(tmp_path / "missing.xlsx")) is None
@@ -0,0 +1,19 @@
+import sys
+
+from tools import export_onnx
+
+
+def run_main(monkeypatch, tmp_path, mismatches):
+    monkeypatch.setattr(export_onnx.ImageCaptionService, "_model_path", classmethod(lambda cls, model_type: str(tmp_path)))
+    monkeypatch.setattr(export_onnx, "load_parity_images", lambda *args, **kwargs: [])
+    monkeypatch.setattr(export_onnx, "check_parity", lambda *args, **kwargs: dict(mismatches))
+    monkeypatch.setattr(sys, "argv", ["export_onnx", "--skip-export"])
+    return export_onnx.main()
+
+
+def test_beam_search_divergence_fails_the_export(monkeypatch, tmp_path):
+    assert run_main(monkeypatch, tmp_path, {1: 0, 5: 2}) == 1
+
+
+def test_matching_captions_pass_the_export(monkeypatch, tmp_path):
+    assert run_main(monkeypatch, tmp_path, {1: 0, 5: 0}) == 0
@@ -0,0 +1,105 @@
+import datetime
+import hashlib
+import io
+import threading
+
+import pytest
+
+from models.image_blob import ImageBlob
+from services import blob_store
+from services.image_blob_service import ImageBlobService
+
+
+@pytest.fixture(params=["mongo", "local"])
+def store(request, mongo, tmp_path, monkeypatch):
+    """Backend lưu dữ liệu ảnh cho test: trong document ImageBlob (mongo) hoặc file trong thư mục tạm (local)"""
+    monkeypatch.setenv("IMAGE_BLOB_STORE", request.param)
+    monkeypatch.setenv("IMAGE_BLOB_DIR", str(tmp_path / "blobs"))
+    monkeypatch.setattr(blob_store, "_stores", {})
+    return blob_store.get_blob_store()
+
+
+def _blob(data):
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def test_read_and_hash_streams_in_chunks(monkeypatch):
+    monkeypatch.setattr(ImageBlobService, "_chunk_size", 3)
+    data = b"0123456789"
+    assert ImageBlobService.read_and_hash(io.BytesIO(data)) == _blob(data)
+
+
+def test_duplicate_upload_only_increments_ref_count(store):
+    sha256, data = _blob(b"image-a")
+    assert ImageBlobService.acquire(sha256, data, "image/png") is True
+    assert ImageBlobService.acquire(sha256, data, "image/png") is False
+
+    blob = ImageBlob.objects(sha256=sha256).first()
+    assert blob.ref_count == 2 and blob.storage == store.name and blob.size == len(data)
+    assert ImageBlobService.read(sha256) == data
+    stats = ImageBlobService.get_stats()
+    assert stats["blobs"] == 1 and stats["references"] == 2
+
+
+def test_blob_deleted_with_last_reference(store):
+    sha256, data = _blob(b"image-b")
+    ImageBlobService.acquire(sha256, data)
+    ImageBlobService.acquire(sha256, data)
+
+    assert ImageBlobService.release(sha256) is False
+    assert ImageBlobService.read(sha256) == data
+    assert ImageBlobService.release(sha256) is True
+    assert ImageBlob.objects(sha256=sha256).count() == 0
+    assert ImageBlobService.read(sha256) is None
+    assert ImageBlobService.release(None) is False
+
+
+def test_upload_during_delete_waits_and_keeps_its_data(store, monkeypatch):
+    sha256, data = _blob(b"image-c")
+    ImageBlobService.acquire(sha256, data)
+
+    deleting = threading.Event()
+    finish_delete = threading.Event()
+    delete = store.delete
+
+    def slow_delete(key):
+        deleting.set()
+        finish_delete.wait(5)
+        delete(key)
+
+    monkeypatch.setattr(store, "delete", slow_delete)
+    monkeypatch.setattr(ImageBlobService, "_tombstone_poll_seconds", 0.01)
+    releaser = threading.Thread(target=ImageBlobService.release, args=(sha256,))
+    releaser.start()
+    assert deleting.wait(5)
+
+    # Upload cùng nội dung trong lúc đang xóa: không được tăng bộ đếm của blob đang bị xóa
+    results = []
+    uploader = threading.Thread(target=lambda: results.append(ImageBlobService.acquire(sha256, data)))
+    uploader.start()
+    uploader.join(0.2)
+    assert uploader.is_alive()
+    assert ImageBlob.objects(sha256=sha256).first().state == "deleting"
+
+    finish_delete.set()
+    releaser.join(5)
+    uploader.join(5)
+    assert results == [True]
+    blob = ImageBlob.objects(sha256=sha256).first()
+    assert blob.ref_count == 1 and blob.state is None
+    assert ImageBlobService.read(sha256) == data
+
+
+def test_stale_tombstone_is_cleaned_up_by_upload(store):
+    sha256, data = _blob(b"image-d")
+    ImageBlobService.acquire(sha256, data)
+    stale = datetime.datetime.now() - datetime.timedelta(seconds=ImageBlobService._stale_delete_seconds + 1)
+    ImageBlob.objects(sha256=sha256).update_one(set__state="deleting", set__deleting_at=stale, set__ref_count=0)
+
+    assert ImageBlobService.acquire(sha256, data) is True
+    blob = ImageBlob.objects(sha256=sha256).first()
+    assert blob.ref_count == 1 and blob.state is None
+    assert ImageBlobService.read(sha256) == data
+    # Blob mới được xóa bình thường khi hết tham chiếu
+    assert ImageBlobService.release(sha256) is True
+    assert ImageBlobService.read(sha256) is None
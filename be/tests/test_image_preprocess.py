@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services import image_preprocess
+from services.image_preprocess import preprocess_image, preprocess_params
+
+transformers = pytest.importorskip("transformers")
+
+
+def _png(width=96, height=80):
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_matches_blip_image_processor():
+    processor = transformers.BlipImageProcessor(size={"height": 64, "width": 64})
+    data = _png()
+
+    expected = processor(Image.open(io.BytesIO(data)).convert("RGB"), return_tensors="np")["pixel_values"]
+    actual = preprocess_image(data, processor)
+    assert actual.shape == expected.shape == (1, 3, 64, 64)
+    assert actual.dtype == np.float32
+    assert np.abs(actual - expected).max() < 0.05
+
+
+def test_params_are_cached_by_config_values(monkeypatch):
+    monkeypatch.setattr(image_preprocess, "_params_cache", {})
+    first = transformers.BlipImageProcessor(size={"height": 64, "width": 64})
+    same = transformers.BlipImageProcessor(size={"height": 64, "width": 64})
+    other = transformers.BlipImageProcessor(size={"height": 32, "width": 32}, image_mean=[0.5, 0.5, 0.5])
+
+    assert preprocess_params(first) is preprocess_params(same)
+    params = preprocess_params(other)
+    assert params["size"] == (32, 32)
+    np.testing.assert_allclose(params["offset"], 0.5 / np.asarray(other.image_std, dtype=np.float32))
+    assert len(image_preprocess._params_cache) == 2
+
+
+def test_processor_wrapper_uses_its_image_processor():
+    image_processor = transformers.BlipImageProcessor(size={"height": 48, "width": 40})
+
+    class Wrapper:
+        pass
+
+    wrapper = Wrapper()
+    wrapper.image_processor = image_processor
+    assert preprocess_params(wrapper)["size"] == (40, 48)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from services.inference_pool import InferencePool, pack_arrays, partition_cores, unpack_arrays
+
+
+def test_cores_are_split_into_contiguous_disjoint_groups():
+    assert partition_cores(3, cores=list(range(8))) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert partition_cores(4, cores=[0, 1]) == [[0], [1], [0], [1]]
+
+
+def test_arrays_round_trip_through_shared_memory():
+    arrays = [
+        np.arange(6, dtype=np.float32).reshape(1, 2, 3),
+        np.ones((1, 5, 7), dtype=np.float16),
+        np.array([1, 2, 3], dtype=np.int64)
+    ]
+    shm, specs = pack_arrays(arrays)
+    shm.close()
+
+    restored = unpack_arrays(shm.name, specs, unlink=True)
+
+    assert all(offset % 64 == 0 for offset, _, _ in specs)
+    for original, copy in zip(arrays, restored):
+        assert copy.dtype == original.dtype
+        np.testing.assert_array_equal(copy, original)
+
+
+@pytest.fixture
+def pool(tiny_blip, tiny_model_type, monkeypatch):
+    """Pool một tiến trình suy luận; tiến trình con đọc mô hình nhỏ qua CAPTION_EXTRA_MODELS"""
+    from services.image_caption_service import ImageCaptionService
+
+    monkeypatch.setenv("CAPTION_EXTRA_MODELS", f"{tiny_model_type}={tiny_blip}")
+    # Tiến trình web chỉ tải processor của mô hình để tiền xử lý ảnh
+    monkeypatch.setitem(ImageCaptionService._extra_model_paths, tiny_model_type, tiny_blip)
+    pool = InferencePool(1, threads_per_worker=1, preload=[tiny_model_type], warmup=False, task_timeout=60)
+    monkeypatch.setattr(ImageCaptionService, "_worker_count", 1)
+    monkeypatch.setattr(ImageCaptionService, "_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_batch_returns_embeddings_for_the_cache(pool, embedding_cache, tiny_model_type):
+    from services.image_caption_service import ImageCaptionService
+
+    processor = ImageCaptionService._get_processor(tiny_model_type)
+    pixel_values = processor(images=[np.full((64, 64, 3), value, dtype=np.uint8) for value in (0, 255)],
+                             return_tensors="np")["pixel_values"]
+    key = (tiny_model_type, 10, 2)
+    items = [("image-a", pixel_values[0:1], None), (None, pixel_values[1:2], None)]
+
+    captions = ImageCaptionService._run_generate_batch(key, items)
+
+    assert len(captions) == 2
+    assert embedding_cache.get_stats()["entries"] == 1
+    cached = embedding_cache.get("image-a")
+    assert cached is not None and cached.dtype == np.float16
+
+    # Batch lấy embedding từ cache chỉ chạy text decoder trong tiến trình con
+    assert len(ImageCaptionService._run_generate_batch(key, [("image-a", None, cached)])) == 1
+    stats = pool.get_stats()
+    assert stats["completed"] == 2
+    assert stats["failed"] == 0
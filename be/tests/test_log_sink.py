@@ -0,0 +1,58 @@
+import json
+import os
+
+from services.log_sink import JsonlLogSink
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_flush_writes_json_lines_in_order(tmp_path):
+    sink = JsonlLogSink(str(tmp_path), prefix="test_log", flush_interval=60, batch_size=2)
+    for index in range(5):
+        sink.emit({"event": "caption", "index": index})
+    sink.flush()
+    assert sink.get_stats()["written"] == 5
+
+    (path,) = tmp_path.glob("test_log_*.jsonl")
+    records = _read(path)
+    assert [record["index"] for record in records] == list(range(5))
+    assert all(record["pid"] == os.getpid() and record["ts"][:10] in path.name for record in records)
+
+
+def test_rotates_when_file_exceeds_max_bytes(tmp_path):
+    sink = JsonlLogSink(str(tmp_path), prefix="test_log", max_bytes=300, flush_interval=60, batch_size=1)
+    for index in range(12):
+        sink.emit({"event": "caption", "text": "x" * 40, "index": index})
+    sink.flush()
+
+    files = sorted(tmp_path.glob("test_log_*.jsonl"))
+    rotated = [path for path in files if path.name.count(".") == 2]
+    assert rotated and sink.get_stats()["rotations"] == len(rotated)
+    assert all(path.stat().st_size <= 300 for path in files)
+    indexes = sorted(record["index"] for path in files for record in _read(path))
+    assert indexes == list(range(12))
+
+
+def test_records_are_grouped_by_day_of_their_timestamp(tmp_path):
+    sink = JsonlLogSink(str(tmp_path), prefix="test_log", flush_interval=60)
+    sink._write_batch([
+        {"ts": "2024-01-01T23:59:59.999", "index": 0},
+        {"ts": "2024-01-02T00:00:00.001", "index": 1},
+    ])
+
+    assert [record["index"] for record in _read(tmp_path / "test_log_2024-01-01.jsonl")] == [0]
+    assert [record["index"] for record in _read(tmp_path / "test_log_2024-01-02.jsonl")] == [1]
+
+
+def test_full_queue_drops_oldest(tmp_path):
+    sink = JsonlLogSink(str(tmp_path), prefix="test_log", flush_interval=60, batch_size=100, max_queue=3)
+    for index in range(5):
+        sink.emit({"index": index})
+
+    assert sink.get_stats()["dropped"] == 2
+    sink.flush()
+    (path,) = tmp_path.glob("test_log_*.jsonl")
+    assert [record["index"] for record in _read(path)] == [2, 3, 4]
@@ -0,0 +1,69 @@
+import pytest
+
+from services.metrics_service import Counter, Gauge, Histogram, MetricsRegistry, MetricsService
+
+
+def test_value_equal_to_bound_lands_in_that_bucket():
+    histogram = Histogram("latency_seconds", "Độ trễ", buckets=(0.1, 0.5, 1.0))
+    for value in (0.1, 0.5, 0.7, 2.0):
+        histogram.observe(value)
+
+    assert histogram._series[()]["counts"] == [1, 1, 1, 1]
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    histogram = Histogram("latency_seconds", "Độ trễ", ("model_type",), buckets=(0.5, 0.1))
+    histogram.observe(0.05, model_type="default")
+    histogram.observe(0.1, model_type="default")
+    histogram.observe(3.0, model_type="default")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Độ trễ",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{model_type="default",le="0.1"} 2',
+        'latency_seconds_bucket{model_type="default",le="0.5"} 2',
+        'latency_seconds_bucket{model_type="default",le="+Inf"} 3',
+        'latency_seconds_sum{model_type="default"} 3.15',
+        'latency_seconds_count{model_type="default"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("requests_total", "Số request", ("path",))
+    counter.inc(path='a"b\\c\nd')
+
+    assert counter.render()[-1] == 'requests_total{path="a\\"b\\\\c\\nd"} 1'
+
+
+def test_missing_label_raises():
+    histogram = Histogram("latency_seconds", "Độ trễ", ("model_type", "language"))
+    with pytest.raises(ValueError):
+        histogram.observe(0.1, model_type="default")
+    with pytest.raises(ValueError):
+        Counter("requests_total", "Số request", ("status",)).inc()
+
+
+def test_gauge_function_errors_are_swallowed():
+    def broken():
+        raise RuntimeError("collector lỗi")
+
+    gauge = Gauge("queue_depth", "Độ dài hàng đợi", ("queue",), function=broken)
+    assert gauge.render() == ["# HELP queue_depth Độ dài hàng đợi", "# TYPE queue_depth gauge"]
+
+    registry = MetricsRegistry()
+    registry.register(gauge)
+    registry.gauge("workers", "Số worker", function=lambda: {(): 4})
+    assert registry.render().endswith("# TYPE workers gauge\nworkers 4\n")
+
+
+def test_metrics_endpoint_uses_prometheus_content_type():
+    flask = pytest.importorskip("flask")
+    from controllers.metrics_controller import metrics_bp
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(metrics_bp)
+    response = app.test_client().get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == MetricsService.registry.CONTENT_TYPE
+    assert "# TYPE caption_total_seconds histogram" in response.get_data(as_text=True)
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from services.micro_batcher import MicroBatcher
+
+
+class RecordingRunner:
+    """run_batch ghi lại từng batch nhận được và trả về item nhân đôi"""
+
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, key, items):
+        with self.lock:
+            self.batches.append((key, list(items)))
+        if self.delay:
+            time.sleep(self.delay)
+        return [item * 2 for item in items]
+
+
+def submit_all(batcher, key, items):
+    return [batcher.submit(key, item) for item in items]
+
+
+def test_full_batch_runs_without_waiting_for_deadline():
+    runner = RecordingRunner()
+    batcher = MicroBatcher(runner, max_batch_size=4, max_wait_ms=10_000)
+
+    started = time.monotonic()
+    futures = submit_all(batcher, "k", [1, 2, 3, 4])
+
+    assert [future.result(timeout=2) for future in futures] == [2, 4, 6, 8]
+    assert time.monotonic() - started < 2
+    assert runner.batches == [("k", [1, 2, 3, 4])]
+
+
+def test_partial_batch_flushes_after_max_wait():
+    runner = RecordingRunner()
+    batcher = MicroBatcher(runner, max_batch_size=8, max_wait_ms=100)
+
+    started = time.monotonic()
+    futures = submit_all(batcher, "k", [1, 2])
+
+    assert [future.result(timeout=2) for future in futures] == [2, 4]
+    assert time.monotonic() - started >= 0.09
+    assert runner.batches == [("k", [1, 2])]
+    stats = batcher.get_stats()
+    assert stats["batches"] == 1
+    assert stats["items"] == 2
+    assert stats["batch_size_histogram"] == {"2": 1}
+
+
+def test_oversized_queue_is_split_into_max_batch_size_chunks():
+    runner = RecordingRunner(delay=0.05)
+    batcher = MicroBatcher(runner, max_batch_size=3, max_wait_ms=20)
+
+    futures = submit_all(batcher, "k", list(range(7)))
+
+    assert [future.result(timeout=2) for future in futures] == [item * 2 for item in range(7)]
+    assert all(len(items) <= 3 for _, items in runner.batches)
+    assert sum(len(items) for _, items in runner.batches) == 7
+
+
+def test_requests_with_different_keys_are_never_mixed():
+    runner = RecordingRunner()
+    batcher = MicroBatcher(runner, max_batch_size=8, max_wait_ms=30)
+
+    futures = submit_all(batcher, "a", [1, 2]) + submit_all(batcher, "b", [3])
+
+    assert [future.result(timeout=2) for future in futures] == [2, 4, 6]
+    assert sorted(runner.batches) == [("a", [1, 2]), ("b", [3])]
+
+
+def test_batch_error_is_raised_for_every_caller():
+    def failing(key, items):
+        raise ValueError("model exploded")
+
+    batcher = MicroBatcher(failing, max_batch_size=2, max_wait_ms=10)
+    futures = submit_all(batcher, "k", [1, 2])
+
+    for future in futures:
+        with pytest.raises(ValueError, match="model exploded"):
+            future.result(timeout=2)
+    assert batcher.get_stats()["errors"] == 1
+
+
+def test_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(lambda key, items: items[:1], max_batch_size=2, max_wait_ms=10)
+    futures = submit_all(batcher, "k", [1, 2])
+
+    with pytest.raises(RuntimeError):
+        futures[0].result(timeout=2)
+
+
+def test_cancelled_requests_are_skipped():
+    runner = RecordingRunner()
+    batcher = MicroBatcher(runner, max_batch_size=8, max_wait_ms=100)
+
+    futures = submit_all(batcher, "k", [1, 2, 3])
+    assert futures[1].cancel()
+
+    assert futures[0].result(timeout=2) == 2
+    assert futures[2].result(timeout=2) == 6
+    assert runner.batches == [("k", [1, 3])]
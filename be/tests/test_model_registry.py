@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+
+from services.model_registry import ModelRegistry, ModelSlot
+
+
+class Loader:
+    """Loader giả lập: đếm số lần tải, có thể chậm hoặc lỗi ở các lần đầu"""
+
+    def __init__(self, value="model", delay=0.0, failures=0):
+        self.value = value
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise RuntimeError("load failed")
+        return f"{self.value}-{self.calls}"
+
+
+def test_concurrent_get_loads_model_once():
+    loader = Loader(delay=0.1)
+    registry = ModelRegistry()
+    registry.register("default", loader)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("default"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.calls == 1
+    assert results == ["model-1"] * 8
+
+
+def test_failed_load_is_reported_and_retried_on_next_get():
+    loader = Loader(failures=1)
+    registry = ModelRegistry()
+    registry.register("default", loader)
+
+    with pytest.raises(RuntimeError):
+        registry.get("default")
+    assert registry.status()["default"]["state"] == ModelSlot.FAILED
+    assert registry.status()["default"]["error"] == "load failed"
+
+    assert registry.get("default") == "model-2"
+    assert registry.status()["default"]["state"] == ModelSlot.READY
+
+
+def test_unknown_model_raises_key_error():
+    with pytest.raises(KeyError):
+        ModelRegistry().get("missing")
+
+
+def test_is_ready_requires_load_and_warmup():
+    warmed = []
+    registry = ModelRegistry()
+    registry.register("default", Loader(), warmup=warmed.append)
+
+    assert not registry.is_ready(["default"])
+    registry.get("default")
+    assert not registry.is_ready(["default"])
+    assert registry.is_ready(["default"], require_warmup=False)
+
+    registry.preload(["default"], warmup=True)
+    assert warmed == ["model-1"]
+    assert registry.is_ready(["default"])
+    assert not registry.is_ready(["default", "travel"])
+
+
+def test_preload_records_failure_instead_of_raising():
+    registry = ModelRegistry()
+    registry.register("default", Loader(failures=5))
+
+    registry.preload(["default"])
+
+    assert not registry.is_ready(["default"])
+    assert registry.status()["default"]["state"] == ModelSlot.FAILED
+
+
+def sized_registry(budget, **kwargs):
+    registry = ModelRegistry(memory_budget_bytes=budget, sizer=lambda value: 100, **kwargs)
+    loaders = {name: Loader(name) for name in ("a", "b", "c")}
+    for name, loader in loaders.items():
+        registry.register(name, loader, estimate=lambda: 100)
+    return registry, loaders
+
+
+def test_least_recently_used_model_is_evicted_to_fit_budget():
+    evicted = []
+    registry, loaders = sized_registry(200, on_evict=lambda: evicted.append(True))
+
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # b trở thành mô hình ít dùng gần đây nhất
+    registry.get("c")
+
+    stats = registry.get_stats()
+    assert sorted(stats["resident_models"]) == ["a", "c"]
+    assert stats["resident_bytes"] == 200
+    assert stats["evictions"] == 1
+    assert registry.status()["b"]["state"] == ModelSlot.UNLOADED
+    assert evicted == [True]
+
+    # Mô hình bị giải phóng được tải lại khi cần
+    assert registry.get("b") == "b-2"
+    assert registry.get_stats()["reloads"] == 1
+
+
+def test_model_in_use_is_not_evicted():
+    registry, _ = sized_registry(100)
+
+    with registry.acquire("a") as value:
+        assert value == "a-1"
+        registry.get("b")
+        # a đang được dùng nên vẫn nằm trong bộ nhớ dù vượt ngân sách
+        assert registry.status()["a"]["state"] == ModelSlot.READY
+
+    registry.get("c")
+    assert registry.status()["a"]["state"] == ModelSlot.UNLOADED
+
+
+def test_idle_models_are_evicted_after_ttl():
+    registry = ModelRegistry(idle_ttl_seconds=0.05)
+    registry.register("a", Loader("a"))
+    registry.register("b", Loader("b"))
+    registry.get("a")
+    time.sleep(0.1)
+    registry.get("b")
+
+    registry.evict_idle()
+
+    assert registry.status()["a"]["state"] == ModelSlot.UNLOADED
+    assert registry.status()["b"]["state"] == ModelSlot.READY
+
+
+def test_evicted_model_stays_ready_but_explicit_unload_does_not():
+    registry = ModelRegistry(idle_ttl_seconds=0.01)
+    registry.register("default", Loader(), warmup=lambda value: None)
+    registry.preload(["default"])
+    assert registry.is_ready(["default"])
+
+    time.sleep(0.05)
+    registry.evict_idle()
+    assert registry.status()["default"]["state"] == ModelSlot.UNLOADED
+    # Request tiếp theo sẽ tự tải lại nên worker vẫn phục vụ được
+    assert registry.is_ready(["default"])
+
+    registry.get("default")
+    registry.unload("default")
+    assert not registry.is_ready(["default"])
+
+
+def test_eviction_before_first_warmup_is_not_ready():
+    registry = ModelRegistry(idle_ttl_seconds=0.01)
+    registry.register("default", Loader(), warmup=lambda value: None)
+    registry.get("default")
+
+    time.sleep(0.05)
+    registry.evict_idle()
+
+    assert not registry.is_ready(["default"])
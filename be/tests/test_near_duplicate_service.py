@@ -0,0 +1,115 @@
+import datetime
+import io
+import random
+
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from models.image import Image
+from services.near_duplicate_service import BKTree, NearDuplicateService, hamming_distance, perceptual_hash
+
+
+def _jpeg(pixels, size=None, quality=90):
+    image = PILImage.fromarray(pixels)
+    if size is not None:
+        image = image.resize(size, PILImage.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _photo(seed):
+    """Ảnh mượt (gradient + vài khối màu) để pHash ổn định như với ảnh chụp thật"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:256, 0:256]
+    pixels = np.stack([(x * rng.uniform(0.3, 1) + y * rng.uniform(0, 0.7)) % 256] * 3, axis=-1)
+    for _ in range(4):
+        top, left = rng.integers(0, 192, 2)
+        pixels[top:top + 64, left:left + 64] = rng.integers(0, 256, 3)
+    return pixels.astype(np.uint8)
+
+
+def test_bktree_search_matches_brute_force():
+    rng = random.Random(0)
+    tree = BKTree()
+    entries = [(rng.getrandbits(64), f"image-{index}") for index in range(300)]
+    # Một số ảnh có cùng hash hoặc chỉ khác vài bit
+    entries += [(entries[0][0], "copy-0"), (entries[1][0] ^ 0b101, "near-1")]
+    for hash_value, value in entries:
+        assert tree.add(hash_value, value)
+    assert not tree.add(entries[0][0], "image-0")
+    assert tree.size == len(entries)
+
+    for query, _ in entries[:20] + [(rng.getrandbits(64), None)]:
+        for max_distance in (0, 3, 12):
+            expected = sorted((hamming_distance(query, hash_value), value) for hash_value, value in entries
+                              if hamming_distance(query, hash_value) <= max_distance)
+            results = tree.search(query, max_distance)
+            assert sorted(results) == expected
+            assert [distance for distance, _ in results] == sorted(distance for distance, _ in results)
+
+
+def test_bktree_discard_keeps_subtree_searchable():
+    tree = BKTree()
+    tree.add(0b0000, "root")
+    tree.add(0b0001, "child")
+    tree.add(0b0011, "grandchild")
+
+    assert tree.discard(0b0000, "root")
+    assert not tree.discard(0b0000, "root")
+    assert not tree.discard(0b1111, "missing")
+    assert tree.size == 2
+    assert tree.search(0b0000, 2) == [(1, "child"), (2, "grandchild")]
+
+
+def test_phash_is_stable_under_recompression_and_resize():
+    pixels = _photo(1)
+    original = int(perceptual_hash(_jpeg(pixels)), 16)
+    recompressed = int(perceptual_hash(_jpeg(pixels, size=(180, 180), quality=40)), 16)
+    other = int(perceptual_hash(_jpeg(_photo(2))), 16)
+
+    assert hamming_distance(original, recompressed) <= 5
+    assert hamming_distance(original, other) > 10
+
+
+@pytest.fixture
+def index(mongo, monkeypatch):
+    """Chỉ mục ảnh gần trùng rỗng, chưa dựng, dùng riêng cho từng test"""
+    for name, value in (("_enabled", True), ("_tree", BKTree()), ("_loaded", False), ("_loading", False),
+                        ("_last_scan_at", None), ("_last_refresh", 0.0), ("_last_full_refresh", 0.0),
+                        ("_stats", dict.fromkeys(NearDuplicateService._stats, 0))):
+        monkeypatch.setattr(NearDuplicateService, name, value)
+    monkeypatch.setattr(NearDuplicateService, "_refresh_overlap", 60.0)
+    return NearDuplicateService
+
+
+def _save_image(image_hash, phash, phash_at=None, created_at=None):
+    return Image(file_name=f"{image_hash}.jpg", content_type="image/jpeg", image_hash=image_hash,
+                 perceptual_hash=phash, phash_at=phash_at, created_at=created_at or datetime.datetime.now()).save()
+
+
+def test_incremental_refresh_picks_up_late_saved_and_backfilled_images(index):
+    now = datetime.datetime.now()
+    _save_image("a" * 64, "0000000000000000", phash_at=now)
+    index.refresh()
+    assert index.find("0000000000000000", exclude=None) == [(0, "a" * 64)]
+
+    # Ảnh của worker khác có created_at cũ (upload chậm hoặc backfill) nhưng phash_at mới
+    _save_image("b" * 64, "0000000000000003", phash_at=now + datetime.timedelta(seconds=1),
+                created_at=now - datetime.timedelta(days=30))
+    # Ảnh được lưu chậm với phash_at hơi trước lần đọc trước vẫn nằm trong khoảng chồng lấn
+    _save_image("c" * 64, "0000000000000001", phash_at=index._last_scan_at - datetime.timedelta(seconds=10))
+    index.refresh()
+
+    assert index.find("0000000000000000", max_distance=2) == [(0, "a" * 64), (1, "c" * 64), (2, "b" * 64)]
+    assert index.find("0000000000000000", max_distance=2, exclude="a" * 64) == [(1, "c" * 64), (2, "b" * 64)]
+    assert index.get_stats()["rebuilds"] == 1
+
+
+def test_remove_drops_image_from_index(index):
+    _save_image("a" * 64, "00000000000000ff", phash_at=datetime.datetime.now())
+    index.refresh()
+    index.remove("00000000000000ff", "a" * 64)
+    assert index.find("00000000000000ff") == []
+    assert index.get_stats()["removed"] == 1
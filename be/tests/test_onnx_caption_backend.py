@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from services.onnx_caption_backend import OnnxCaptionBackend, export_model  # noqa: E402
+from tools.export_onnx import check_parity, load_parity_images  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def exported_blip(tiny_blip):
+    export_model(tiny_blip)
+    return tiny_blip
+
+
+@pytest.mark.parametrize("max_length", [6, 12])
+def test_onnx_captions_match_torch_for_greedy_and_beam_search(exported_blip, max_length):
+    # max_length=6: câu dừng vì max_length cạnh tranh với câu đã kết thúc sớm, phụ thuộc vào cách chuẩn hóa độ dài
+    images = load_parity_images(None, num_samples=4, image_size=64)
+
+    mismatches = check_parity("default", exported_blip, images, num_beams_options=(1, 3, 5), max_length=max_length)
+
+    assert mismatches == {1: 0, 3: 0, 5: 0}
+
+
+def test_generate_returns_one_sequence_per_image(exported_blip):
+    backend = OnnxCaptionBackend(exported_blip)
+    pixel_values = np.random.default_rng(0).standard_normal((3, 3, 64, 64)).astype(np.float32)
+
+    sequences = backend.generate(pixel_values=pixel_values, max_length=10, num_beams=2, min_length=3)
+
+    assert len(sequences) == 3
+    for tokens in sequences:
+        assert tokens[0] == backend.bos_token_id
+        assert 3 <= len(tokens) <= 10
@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from werkzeug.exceptions import NotFound
+
+from models.image import Image
+from services.pagination import decode_cursor, encode_cursor, keyset_paginate, paginate
+
+
+@pytest.fixture
+def images(mongo):
+    """25 ảnh, có nhiều ảnh trùng created_at để kiểm tra việc phân xử theo _id"""
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    saved = []
+    for index in range(25):
+        created_at = base + datetime.timedelta(seconds=index // 3)
+        saved.append(Image(file_name=f"{index}.jpg", content_type="image/jpeg", created_at=created_at).save())
+    # Thứ tự mong đợi: created_at giảm dần, cùng created_at thì _id giảm dần
+    return sorted(saved, key=lambda image: (image.created_at, image.id), reverse=True)
+
+
+def _ids(items):
+    return [image.id for image in items]
+
+
+def test_paginate_pages_and_404(images):
+    queryset = Image.objects.order_by("-created_at", "-id")
+    page = paginate(queryset, page=2, per_page=10)
+
+    assert _ids(page.items) == _ids(images[10:20])
+    assert (page.total, page.pages) == (25, 3)
+    assert page.meta() == {"total": 25, "pages": 3, "page": 2}
+    assert _ids(paginate(queryset, page=3, per_page=10).items) == _ids(images[20:])
+    for bad_page in (0, 4):
+        with pytest.raises(NotFound):
+            paginate(queryset, page=bad_page, per_page=10)
+
+
+def test_cursor_round_trip_and_invalid_cursor(images):
+    cursor = encode_cursor(images[0], "next")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (images[0].created_at, images[0].id, "next")
+    for bad in ("not-a-cursor", encode_cursor(images[0], "next")[:-4], "eyJ0IjoiMjAyNCIsImkiOiJ4IiwiZCI6InVwIn0"):
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
+
+
+def test_keyset_walks_forward_and_back_across_equal_timestamps(images):
+    seen, cursor, pages = [], "", []
+    while cursor is not None:
+        page = keyset_paginate(Image.objects, cursor, per_page=4)
+        pages.append(page)
+        seen.extend(_ids(page.items))
+        cursor = page.next_cursor
+
+    # Mỗi ảnh xuất hiện đúng một lần, đúng thứ tự, kể cả khi ranh giới trang rơi vào giữa các ảnh cùng created_at
+    assert seen == _ids(images)
+    assert pages[0].prev_cursor is None and pages[-1].next_cursor is None
+    assert len(pages) == 7
+
+    # Đi lùi từ trang cuối trả về đúng các trang trước đó
+    back, cursor = [], pages[-1].prev_cursor
+    while cursor is not None:
+        page = keyset_paginate(Image.objects, cursor, per_page=4)
+        back.append(_ids(page.items))
+        cursor = page.prev_cursor
+    assert back == [_ids(page.items) for page in reversed(pages[:-1])]
+
+
+def test_keyset_total_modes(images):
+    assert keyset_paginate(Image.objects, None, per_page=5).total is None
+    assert keyset_paginate(Image.objects, None, per_page=5, total="exact").meta()["total"] == 25
+    filtered = Image.objects(file_name__in=["1.jpg", "2.jpg"])
+    assert keyset_paginate(filtered, None, per_page=5, total="approx").total == 2
+    with pytest.raises(ValueError):
+        keyset_paginate(Image.objects, None, per_page=0)
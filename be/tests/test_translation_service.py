@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from services import translation_service
+from services.micro_batcher import MicroBatcher
+from services.model_registry import ModelRegistry
+from services.translation_service import TranslationService
+
+
+@pytest.fixture
+def translation(monkeypatch):
+    """TranslationService với registry, bộ gom batch, cache và thống kê riêng; mô hình cục bộ và googletrans giả"""
+    loads, remote = [], []
+
+    def broken_loader():
+        loads.append(1)
+        raise OSError("không có mô hình")
+
+    registry = ModelRegistry()
+    registry.register("en-vi", broken_loader)
+    monkeypatch.setattr(TranslationService, "_registry", registry)
+    monkeypatch.setattr(TranslationService, "_batcher", MicroBatcher(
+        run_batch=lambda key, texts: TranslationService._run_batch(key, texts), max_batch_size=4, max_wait_ms=0,
+        name="translation-test"
+    ))
+    monkeypatch.setattr(TranslationService, "_backend", "marian")
+    monkeypatch.setattr(TranslationService, "_cache", translation_service.OrderedDict())
+    monkeypatch.setattr(TranslationService, "_stats", dict.fromkeys(TranslationService._stats, 0))
+    monkeypatch.setattr(TranslationService, "_load_failed_at", None)
+    monkeypatch.setattr(TranslationService, "_retry_seconds", 60.0)
+
+    def fake_remote(text, src_lang, dest_lang):
+        remote.append(text)
+        return f"vi:{text}"
+
+    monkeypatch.setattr(TranslationService, "_translate_remote", staticmethod(fake_remote))
+    return loads, remote
+
+
+def test_fallback_is_off_by_default():
+    # Đọc cấu hình trong tiến trình mới, không có biến môi trường CAPTION_TRANSLATION_FALLBACK
+    env = {name: value for name, value in os.environ.items() if name != "CAPTION_TRANSLATION_FALLBACK"}
+    result = subprocess.run(
+        [sys.executable, "-c", "from services.translation_service import TranslationService as T; print(T._fallback_enabled)"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_untranslated_without_fallback(translation, monkeypatch):
+    loads, remote = translation
+    monkeypatch.setattr(TranslationService, "_fallback_enabled", False)
+
+    assert TranslationService.translate("a dog on a bench") is None
+    assert remote == []
+    assert TranslationService.get_stats()["untranslated"] == 1
+
+
+def test_load_failure_backs_off_before_retrying(translation, monkeypatch):
+    loads, _ = translation
+    monkeypatch.setattr(TranslationService, "_fallback_enabled", False)
+
+    assert TranslationService.translate("a dog") is None
+    assert TranslationService.translate("a cat") is None
+    assert len(loads) == 1
+    stats = TranslationService.get_stats()
+    assert stats["local_backing_off"] and stats["local_skipped"] == 1
+
+    # Hết thời gian chờ thì mô hình được thử tải lại
+    monkeypatch.setattr(TranslationService, "_load_failed_at", TranslationService._load_failed_at - 61)
+    assert TranslationService.translate("a bird") is None
+    assert len(loads) == 2
+
+
+def test_fallback_used_when_enabled(translation, monkeypatch):
+    _, remote = translation
+    monkeypatch.setattr(TranslationService, "_fallback_enabled", True)
+
+    assert TranslationService.translate("a dog") == "vi:a dog"
+    assert TranslationService.translate("a cat") == "vi:a cat"
+    assert remote == ["a dog", "a cat"]
+    assert TranslationService.get_stats()["googletrans"] == 2
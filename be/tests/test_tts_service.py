@@ -0,0 +1,120 @@
+import subprocess
+import threading
+from collections import OrderedDict
+
+import pytest
+
+from services import tts_service
+from services.tts_service import EspeakEngine, TTSService
+
+
+class FakeEngine:
+    name = "fake"
+    extension = ".wav"
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def is_available(self):
+        return True
+
+    def synthesize(self, text, lang):
+        self.calls.append((text, lang))
+        if self.fail:
+            raise RuntimeError("engine lỗi")
+        return f"{lang}:{text}".encode("utf-8")
+
+
+@pytest.fixture
+def tts(tmp_path, monkeypatch):
+    """TTSService với thư mục cache, chỉ mục, khóa và engine riêng cho từng test"""
+    engine = FakeEngine()
+    monkeypatch.setattr(TTSService, "_cache_dir", str(tmp_path))
+    monkeypatch.setattr(TTSService, "_cache_budget", 1024)
+    monkeypatch.setattr(TTSService, "_engines", OrderedDict([("fake", engine)]))
+    monkeypatch.setattr(TTSService, "_engine_name", "fake")
+    monkeypatch.setattr(TTSService, "_index", None)
+    monkeypatch.setattr(TTSService, "_index_bytes", 0)
+    monkeypatch.setattr(TTSService, "_key_locks", {})
+    monkeypatch.setattr(TTSService, "_stats", dict.fromkeys(TTSService._stats, 0))
+    return engine
+
+
+def test_synthesizes_once_and_serves_from_cache(tts):
+    first = TTSService.get_audio("a  dog", "en")
+    second = TTSService.get_audio("a dog", "en")
+
+    assert not first["cached"] and second["cached"]
+    assert first["path"] == second["path"] and first["mimetype"] == "audio/wav"
+    assert tts.calls == [("a dog", "en")]
+    assert TTSService._key_locks == {}
+
+
+def test_cached_only_lookup_does_not_synthesize(tts):
+    with pytest.raises(LookupError):
+        TTSService.get_audio("a horse", "en", synthesize=False)
+    assert tts.calls == []
+
+    TTSService.get_audio("a horse", "en")
+    assert TTSService.get_audio("a horse", "en", synthesize=False)["cached"]
+    assert tts.calls == [("a horse", "en")]
+
+
+def test_key_lock_is_removed_after_synthesis_failure(tts):
+    tts.fail = True
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            TTSService.get_audio("a cat", "en")
+
+    assert TTSService._key_locks == {}
+    assert TTSService.get_stats()["errors"] == 3
+
+
+def test_concurrent_requests_synthesize_once(tts):
+    release = threading.Event()
+    synthesize = tts.synthesize
+
+    def slow_synthesize(text, lang):
+        release.wait(5)
+        return synthesize(text, lang)
+
+    tts.synthesize = slow_synthesize
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(TTSService.get_audio("a bird", "en"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 4 and len(tts.calls) == 1
+    assert TTSService._key_locks == {}
+
+
+def test_cache_evicts_least_recently_used(tts, monkeypatch):
+    monkeypatch.setattr(TTSService, "_cache_budget", 20)
+    old = TTSService.get_audio("one two", "en")
+    TTSService.get_audio("three four", "en")
+    TTSService.get_audio("five six", "en")
+
+    assert TTSService.get_stats()["evictions"] >= 1
+    assert not TTSService.get_audio("one two", "en")["cached"]
+    assert old["key"] in TTSService._index
+
+
+def test_espeak_reads_caption_from_stdin(monkeypatch):
+    calls = []
+
+    def fake_run(args, **kwargs):
+        calls.append((args, kwargs))
+        return subprocess.CompletedProcess(args, 0, stdout=b"RIFF")
+
+    monkeypatch.setattr(tts_service.subprocess, "run", fake_run)
+    engine = EspeakEngine()
+    engine.binary = "espeak-ng"
+
+    assert engine.synthesize("-w/tmp/owned.wav a dog", "en") == b"RIFF"
+    args, kwargs = calls[0]
+    assert args == ["espeak-ng", "-v", "en", "--stdout", "--stdin"]
+    assert kwargs["input"] == "-w/tmp/owned.wav a dog".encode("utf-8")
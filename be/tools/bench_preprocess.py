@@ -0,0 +1,157 @@
+"""
+So sánh thời gian giải mã và bộ nhớ đỉnh của bước tiền xử lý ảnh:
+- baseline: Image.open(...).convert("RGB") rồi đưa cho BlipProcessor (cách cũ)
+- fast: services.image_preprocess.preprocess_image (giải mã JPEG ở chế độ draft + chuẩn hóa bằng NumPy)
+
+Cách dùng (chạy trong thư mục be):
+    python -m tools.bench_preprocess --model default
+    python -m tools.bench_preprocess --model default --images duong_dan/anh_that
+
+Không truyền --images thì công cụ tự tạo ảnh JPEG giả lập 1, 3, 8 và 12 megapixel.
+Bộ nhớ đỉnh được đo trong một tiến trình con riêng cho mỗi (ảnh, phương pháp) để các lần đo không ảnh hưởng nhau.
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+SYNTHETIC_SIZES = {
+    "1MP": (1152, 864),
+    "3MP": (2048, 1536),
+    "8MP": (3264, 2448),
+    "12MP": (4032, 3024)
+}
+
+
+def make_synthetic_jpeg(path, size):
+    """Tạo ảnh JPEG giống ảnh chụp (gradient + nhiễu) với kích thước cho trước"""
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rng = np.random.default_rng(0)
+    channels = [x + 0 * y, y + 0 * x, (x + y) / 2]
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, "JPEG", quality=90)
+
+
+def _reset_peak_rss():
+    """Đặt lại mức bộ nhớ đỉnh (VmHWM) của tiến trình về mức hiện tại (Linux >= 4.0)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss tính bằng KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+def _measure(model_path, image_path, method, repeat, results):
+    """Chạy trong tiến trình con: đo thời gian trung bình và mức tăng bộ nhớ đỉnh của một phương pháp"""
+    from transformers import BlipProcessor
+    from services.image_preprocess import preprocess_image
+
+    processor = BlipProcessor.from_pretrained(model_path)
+    with open(image_path, "rb") as f:
+        image_data = f.read()
+
+    def baseline():
+        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        return processor(image, return_tensors="np")["pixel_values"]
+
+    def fast():
+        return preprocess_image(image_data, processor)
+
+    run = baseline if method == "baseline" else fast
+    # Nếu không đặt lại được mức đỉnh thì số đo chỉ đáng tin khi bước giải mã vượt mức đỉnh lúc import
+    _reset_peak_rss()
+    rss_before = _current_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        pixel_values = run()
+        timings.append(time.perf_counter() - started)
+    peak_delta_mb = _peak_rss_mb() - rss_before
+
+    reference = processor(Image.open(io.BytesIO(image_data)).convert("RGB"), return_tensors="np")["pixel_values"]
+    results.put({
+        "mean_ms": 1000.0 * sum(timings) / len(timings),
+        "peak_delta_mb": peak_delta_mb,
+        "max_abs_diff": float(np.abs(pixel_values - reference).max()),
+        "shape": tuple(pixel_values.shape)
+    })
+
+
+def measure(model_path, image_path, method, repeat):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(model_path, image_path, method, repeat, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiền xử lý ảnh cho BLIP")
+    parser.add_argument("--model", default="default", help="model_type dùng để lấy BlipProcessor")
+    parser.add_argument("--images", default=None, help="Thư mục ảnh thật (mặc định: tạo ảnh JPEG giả lập)")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần lặp cho mỗi ảnh")
+    args = parser.parse_args()
+
+    from services.image_caption_service import ImageCaptionService
+    model_path = ImageCaptionService._model_path(args.model)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.images:
+            cases = [(name, os.path.join(args.images, name)) for name in sorted(os.listdir(args.images))]
+        else:
+            cases = []
+            for label, size in SYNTHETIC_SIZES.items():
+                path = os.path.join(tmp_dir, f"{label}.jpg")
+                make_synthetic_jpeg(path, size)
+                cases.append((label, path))
+
+        print(f"{'Ảnh':<14} {'baseline ms':>12} {'fast ms':>9} {'nhanh hơn':>10} {'baseline MB':>12} {'fast MB':>9} {'sai lệch':>10}")
+        for label, path in cases:
+            baseline = measure(model_path, path, "baseline", args.repeat)
+            fast = measure(model_path, path, "fast", args.repeat)
+            speedup = baseline["mean_ms"] / fast["mean_ms"] if fast["mean_ms"] else 0.0
+            print(
+                f"{label[:14]:<14} {baseline['mean_ms']:>12.1f} {fast['mean_ms']:>9.1f} {speedup:>9.1f}x "
+                f"{baseline['peak_delta_mb']:>12.1f} {fast['peak_delta_mb']:>9.1f} {fast['max_abs_diff']:>10.4f}"
+            )
+    print("Sai lệch: chênh lệch tuyệt đối lớn nhất của pixel_values so với BlipProcessor trên ảnh giải mã đầy đủ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
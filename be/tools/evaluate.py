@@ -0,0 +1,322 @@
+"""
+Đánh giá offline chất lượng và tốc độ tạo caption trên tập test (ảnh + file ground truth dạng test.xlsx):
+- BLEU-1..4 và CIDEr-D trên toàn tập.
+- Thông lượng (ảnh/giây), phân vị độ trễ của từng bước (tiền xử lý, vision encoder, text decoder) theo batch
+  và bộ nhớ đỉnh (RSS) của từng tiến trình.
+
+Cách dùng (chạy trong thư mục be):
+    python -m tools.evaluate --images duong_dan/anh_test --model travel --processes 2 --output fp32.json
+    python -m tools.evaluate --images duong_dan/anh_test --model travel --precision int8 --baseline fp32.json
+    python -m tools.evaluate --images duong_dan/anh_test --model default --backend onnx --preset fast
+
+Ảnh được chia đều cho --processes tiến trình, mỗi tiến trình gắn với một nhóm core riêng, tự tải mô hình
+và suy luận theo batch qua đúng các bước mà server dùng. Với --baseline, công cụ in chênh lệch so với
+kết quả đã lưu và trả về mã thoát khác 0 nếu BLEU-4 giảm quá --max-bleu-drop.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import time
+
+import numpy as np
+
+from services.evaluation_service import EvaluationService
+from services.decoding_preset_service import DecodingPresetService
+from services.inference_pool import partition_cores
+
+STAGES = ("preprocess", "encode", "decode", "batch")
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss tính bằng KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def summarize(values):
+    """Trung bình và phân vị p50/p90/p99 (ms) của danh sách thời gian (giây)"""
+    if not values:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p90_ms": 0.0, "p99_ms": 0.0}
+    values_ms = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        "mean_ms": round(float(values_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(values_ms, 50)), 2),
+        "p90_ms": round(float(np.percentile(values_ms, 90)), 2),
+        "p99_ms": round(float(np.percentile(values_ms, 99)), 2)
+    }
+
+
+def _run_batch(service, model, processor, paths, max_length, num_beams):
+    """Chạy một batch qua các bước của server, trả về (captions, {bước: giây})"""
+    started = time.perf_counter()
+    pixel_values = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pixel_values.append(service._preprocess(f.read(), processor))
+    pixel_values = np.concatenate(pixel_values, axis=0)
+    preprocessed = time.perf_counter()
+    image_embeds = service._encode_images(model, pixel_values)
+    encoded = time.perf_counter()
+    output_ids = service._decode_embeds(model, image_embeds, max_length, num_beams)
+    captions = processor.batch_decode(output_ids, skip_special_tokens=True)
+    decoded = time.perf_counter()
+    return captions, {
+        "preprocess": preprocessed - started,
+        "encode": encoded - preprocessed,
+        "decode": decoded - encoded,
+        "batch": decoded - started
+    }
+
+
+def _evaluate_shard(index, cores, num_threads, config, image_paths, results):
+    """Chạy trong tiến trình con: tải mô hình theo cấu hình và sinh caption cho phần ảnh được giao"""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # Cấu hình theo từng mô hình được đọc khi tải mô hình lần đầu nên phải đặt trước khi tải
+    if config["precision"]:
+        os.environ[f"CAPTION_PRECISION_{config['model'].upper()}"] = config["precision"]
+    if config["backend"]:
+        os.environ[f"CAPTION_BACKEND_{config['model'].upper()}"] = config["backend"]
+
+    import torch
+    torch.set_num_threads(num_threads)
+    from services.image_caption_service import ImageCaptionService
+
+    try:
+        load_started = time.perf_counter()
+        model, processor = ImageCaptionService._get_model(config["model"])
+        load_seconds = time.perf_counter() - load_started
+
+        batch_size = config["batch_size"]
+        if config["warmup"] and image_paths:
+            _run_batch(ImageCaptionService, model, processor, image_paths[:batch_size], config["max_length"], config["num_beams"])
+
+        captions = {}
+        timings = {stage: [] for stage in STAGES}
+        started = time.time()
+        for start in range(0, len(image_paths), batch_size):
+            paths = image_paths[start:start + batch_size]
+            batch_captions, batch_timings = _run_batch(
+                ImageCaptionService, model, processor, paths, config["max_length"], config["num_beams"]
+            )
+            for path, caption in zip(paths, batch_captions):
+                captions[os.path.basename(path)] = caption
+            for stage, seconds in batch_timings.items():
+                timings[stage].append(seconds)
+        finished = time.time()
+
+        results.put({
+            "index": index,
+            "captions": captions,
+            "timings": timings,
+            "load_seconds": load_seconds,
+            "started": started,
+            "finished": finished,
+            "peak_rss_mb": _peak_rss_mb(),
+            "variant": ImageCaptionService._model_variant(config["model"]),
+            "model_path": ImageCaptionService._model_path(config["model"])
+        })
+    except Exception as e:
+        results.put({"index": index, "error": f"{type(e).__name__}: {e}"})
+
+
+def run_evaluation(image_paths, config, processes, threads=None):
+    """Chia ảnh cho các tiến trình, chạy và gộp kết quả của từng tiến trình"""
+    processes = max(1, min(processes, len(image_paths)))
+    core_groups = partition_cores(processes)
+    # Chia xen kẽ để mỗi tiến trình nhận ảnh có kích thước tương tự nhau
+    shards = [image_paths[index::processes] for index in range(processes)]
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(
+            target=_evaluate_shard,
+            args=(index, core_groups[index], threads or len(core_groups[index]), config, shards[index], results)
+        )
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    outputs = []
+    while len(outputs) < len(workers):
+        try:
+            outputs.append(results.get(timeout=1.0))
+        except queue.Empty:
+            # Tiến trình con chết giữa chừng (vd: hết bộ nhớ) thì không bao giờ gửi kết quả
+            reported = {output["index"] for output in outputs}
+            crashed = [
+                index for index, worker in enumerate(workers)
+                if index not in reported and not worker.is_alive() and worker.exitcode != 0
+            ]
+            if crashed:
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError(f"Tiến trình đánh giá {crashed} đã dừng bất thường (mã thoát {workers[crashed[0]].exitcode})")
+    for worker in workers:
+        worker.join()
+
+    errors = [output["error"] for output in outputs if "error" in output]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return sorted(outputs, key=lambda output: output["index"])
+
+
+def build_report(names, references, outputs, config, processes):
+    captions = {}
+    timings = {stage: [] for stage in STAGES}
+    for output in outputs:
+        captions.update(output["captions"])
+        for stage in STAGES:
+            timings[stage].extend(output["timings"][stage])
+
+    hypotheses = [captions[name] for name in names]
+    refs = [references[name] for name in names]
+    scores = {key: round(value, 4) for key, value in EvaluationService.corpus_bleu_scores(refs, hypotheses).items()}
+    scores["cider"] = round(EvaluationService.corpus_cider_score(refs, hypotheses), 4)
+
+    wall_seconds = max(output["finished"] for output in outputs) - min(output["started"] for output in outputs)
+    return {
+        "config": {**config, "processes": processes, "variant": outputs[0]["variant"], "model_path": outputs[0]["model_path"]},
+        "images": len(names),
+        "scores": scores,
+        "images_per_second": round(len(names) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "wall_seconds": round(wall_seconds, 3),
+        "load_seconds": round(max(output["load_seconds"] for output in outputs), 3),
+        "latency": {stage: summarize(values) for stage, values in timings.items()},
+        "per_image_ms": {
+            stage: round(1000.0 * sum(timings[stage]) / len(names), 2) for stage in STAGES
+        },
+        "peak_rss_mb": {
+            "max": round(max(output["peak_rss_mb"] for output in outputs), 1),
+            "total": round(sum(output["peak_rss_mb"] for output in outputs), 1)
+        },
+        "captions": {name: captions[name] for name in names}
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print(
+        f"Mô hình {config['model']} ({config['variant']}, {config['model_path']}), {config['processes']} tiến trình, "
+        f"batch {config['batch_size']}, num_beams={config['num_beams']}, max_length={config['max_length']}"
+    )
+    scores = report["scores"]
+    print(
+        f"BLEU-1 {scores['bleu1']:.4f} | BLEU-2 {scores['bleu2']:.4f} | BLEU-3 {scores['bleu3']:.4f} | "
+        f"BLEU-4 {scores['bleu4']:.4f} | CIDEr {scores['cider']:.4f}"
+    )
+    print(
+        f"{report['images']} ảnh trong {report['wall_seconds']:.2f}s: {report['images_per_second']:.2f} ảnh/giây "
+        f"(tải mô hình {report['load_seconds']:.2f}s, không tính)"
+    )
+    print(f"{'Bước (mỗi batch)':<18} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'ms/ảnh':>9}")
+    for stage in STAGES:
+        latency = report["latency"][stage]
+        per_image = report["per_image_ms"][stage]
+        print(
+            f"{stage:<18} {latency['mean_ms']:>9.1f} {latency['p50_ms']:>9.1f} {latency['p90_ms']:>9.1f} "
+            f"{latency['p99_ms']:>9.1f} {per_image:>9.1f}"
+        )
+    print(f"RSS đỉnh: {report['peak_rss_mb']['max']:.1f} MB/tiến trình, tổng {report['peak_rss_mb']['total']:.1f} MB")
+
+
+def compare(report, baseline, max_bleu_drop):
+    """In chênh lệch so với kết quả cũ; trả về False nếu BLEU-4 giảm quá ngưỡng"""
+    print(f"So với baseline ({baseline['config']['model']}, {baseline['config']['variant']}):")
+    for key in ("bleu1", "bleu2", "bleu3", "bleu4", "cider"):
+        print(f"  {key:<6} {baseline['scores'][key]:.4f} -> {report['scores'][key]:.4f} ({report['scores'][key] - baseline['scores'][key]:+.4f})")
+    speedup = report["images_per_second"] / baseline["images_per_second"] if baseline["images_per_second"] else 0.0
+    print(f"  ảnh/giây {baseline['images_per_second']:.2f} -> {report['images_per_second']:.2f} ({speedup:.2f}x)")
+    print(f"  RSS đỉnh {baseline['peak_rss_mb']['max']:.1f} -> {report['peak_rss_mb']['max']:.1f} MB")
+    identical = sum(
+        1 for name, caption in report["captions"].items() if baseline["captions"].get(name) == caption
+    )
+    print(f"  Caption giống hệt baseline: {identical}/{report['images']}")
+
+    drop = baseline["scores"]["bleu4"] - report["scores"]["bleu4"]
+    if drop > max_bleu_drop:
+        print(f"KHÔNG ĐẠT: BLEU-4 giảm {drop:.4f} (> {max_bleu_drop})")
+        return False
+    print(f"ĐẠT: BLEU-4 giảm {max(drop, 0.0):.4f} (<= {max_bleu_drop})")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá chất lượng (BLEU, CIDEr) và tốc độ tạo caption trên tập test")
+    parser.add_argument("--images", required=True, help="Thư mục chứa ảnh của tập test")
+    parser.add_argument("--references", default=None, help="File ground truth (mặc định: test.xlsx)")
+    parser.add_argument("--model", default="default", help="model_type cần đánh giá")
+    parser.add_argument("--precision", default=None, choices=["fp32", "int8", "bf16"], help="Mặc định: theo CAPTION_PRECISION")
+    parser.add_argument("--backend", default=None, choices=["torch", "onnx"], help="Mặc định: theo CAPTION_BACKEND")
+    parser.add_argument("--preset", default=None, choices=DecodingPresetService.preset_names(), help="Preset giải mã (ghi đè --num-beams, --max-length)")
+    parser.add_argument("--max-length", type=int, default=30)
+    parser.add_argument("--num-beams", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=1, help="Số tiến trình suy luận, mỗi tiến trình dùng một nhóm core riêng")
+    parser.add_argument("--threads", type=int, default=0, help="Số thread torch mỗi tiến trình (mặc định: số core được gán)")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ đánh giá N ảnh đầu tiên (0 = tất cả)")
+    parser.add_argument("--no-warmup", action="store_true", help="Không chạy batch khởi động trước khi đo")
+    parser.add_argument("--output", default=None, help="Lưu kết quả (gồm caption từng ảnh) ra file JSON")
+    parser.add_argument("--baseline", default=None, help="File JSON kết quả cũ để so sánh")
+    parser.add_argument("--max-bleu-drop", type=float, default=0.02, help="Mức giảm BLEU-4 tuyệt đối tối đa so với baseline")
+    args = parser.parse_args()
+
+    index = EvaluationService.get_ground_truth_index(args.references)
+    references = {}
+    for name in sorted(os.listdir(args.images)):
+        reference = EvaluationService.find_reference(name, path=args.references)
+        if reference is not None and os.path.isfile(os.path.join(args.images, name)):
+            references[name] = reference
+    names = sorted(references)[:args.limit or None]
+    if not index or not names:
+        print("Không có ảnh nào trùng tên với ground truth")
+        return 2
+
+    max_length, num_beams = args.max_length, args.num_beams
+    if args.preset:
+        max_length = DecodingPresetService.PRESETS[args.preset]["max_length"]
+        num_beams = DecodingPresetService.PRESETS[args.preset]["num_beams"]
+    config = {
+        "model": args.model,
+        "precision": args.precision,
+        "backend": args.backend,
+        "preset": args.preset,
+        "max_length": max_length,
+        "num_beams": num_beams,
+        "batch_size": max(1, args.batch_size),
+        "warmup": not args.no_warmup
+    }
+
+    image_paths = [os.path.join(args.images, name) for name in names]
+    processes = max(1, min(args.processes, len(names)))
+    print(f"Đánh giá {len(names)} ảnh với mô hình {args.model} trên {processes} tiến trình...")
+    outputs = run_evaluation(image_paths, config, processes, args.threads or None)
+    report = build_report(names, references, outputs, config, processes)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu kết quả vào {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_bleu_drop):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
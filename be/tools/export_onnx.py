@@ -0,0 +1,99 @@
+"""
+Xuất mô hình BLIP sang ONNX (một lần) và kiểm tra caption của backend ONNX khớp với torch.
+
+Cách dùng (chạy trong thư mục be):
+    python -m tools.export_onnx --model default
+    python -m tools.export_onnx --model travel --images duong_dan/anh_test
+
+Artifact được ghi vào pretrain/<mô hình>/onnx. Sau khi xuất, bật backend bằng
+CAPTION_BACKEND=onnx (hoặc CAPTION_BACKEND_<MODEL_TYPE>=onnx).
+Công cụ trả về mã thoát khác 0 nếu caption của hai backend không khớp.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from services.image_caption_service import ImageCaptionService
+from services.onnx_caption_backend import OnnxCaptionBackend, export_model
+
+
+def load_parity_images(images_dir, num_samples, image_size):
+    """Lấy ảnh kiểm tra từ thư mục, hoặc sinh ảnh ngẫu nhiên (cố định seed) nếu không có thư mục"""
+    if images_dir:
+        names = sorted(name for name in os.listdir(images_dir) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+        return [Image.open(os.path.join(images_dir, name)).convert("RGB") for name in names[:num_samples]]
+
+    rng = np.random.default_rng(0)
+    return [
+        Image.fromarray(rng.integers(0, 256, size=(image_size, image_size, 3), dtype=np.uint8))
+        for _ in range(num_samples)
+    ]
+
+
+def check_parity(model_type, model_path, images, num_beams_options, max_length):
+    """So sánh caption của torch (fp32) và ONNX Runtime trên cùng ảnh, trả về {num_beams: số caption không khớp}"""
+    torch_model, processor = ImageCaptionService._load_local_model(model_type, model_path, precision="fp32", backend="torch")
+    onnx_backend = OnnxCaptionBackend(model_path)
+    pixel_values = processor(images, return_tensors="np")["pixel_values"]
+
+    # So sánh trên đúng đường suy luận của server (vision encoder rồi text decoder) cho cả hai backend
+    torch_embeds = ImageCaptionService._encode_images(torch_model, pixel_values)
+    onnx_embeds = ImageCaptionService._encode_images(onnx_backend, pixel_values)
+
+    mismatches = {}
+    for num_beams in num_beams_options:
+        torch_ids = ImageCaptionService._decode_embeds(torch_model, torch_embeds, max_length, num_beams)
+        onnx_ids = ImageCaptionService._decode_embeds(onnx_backend, onnx_embeds, max_length, num_beams)
+
+        torch_captions = processor.batch_decode(torch_ids, skip_special_tokens=True)
+        onnx_captions = processor.batch_decode(onnx_ids, skip_special_tokens=True)
+        matched = 0
+        for index, (expected, actual) in enumerate(zip(torch_captions, onnx_captions)):
+            if expected == actual:
+                matched += 1
+            else:
+                print(f"[num_beams={num_beams}] Ảnh {index}: torch='{expected}' | onnx='{actual}'")
+        mismatches[num_beams] = len(images) - matched
+        print(f"num_beams={num_beams}: {matched}/{len(images)} caption khớp")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất BLIP sang ONNX và kiểm tra tính tương đương với torch")
+    parser.add_argument("--model", default="default", help="model_type cần xuất")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--images", default=None, help="Thư mục ảnh dùng để kiểm tra (mặc định: ảnh ngẫu nhiên)")
+    parser.add_argument("--num-samples", type=int, default=8)
+    parser.add_argument("--max-length", type=int, default=30)
+    parser.add_argument("--skip-export", action="store_true", help="Chỉ kiểm tra artifact đã có")
+    parser.add_argument("--skip-verify", action="store_true", help="Chỉ xuất, không kiểm tra")
+    args = parser.parse_args()
+
+    model_path = ImageCaptionService._model_path(args.model)
+    if not os.path.isdir(model_path):
+        print(f"Không tìm thấy thư mục mô hình {args.model}: {model_path}")
+        return 2
+
+    if not args.skip_export:
+        export_model(model_path, opset=args.opset)
+
+    if args.skip_verify:
+        return 0
+
+    images = load_parity_images(args.images, args.num_samples, image_size=384)
+    mismatches = check_parity(args.model, model_path, images, num_beams_options=(1, 5), max_length=args.max_length)
+    # Mọi cấu hình num_beams (kể cả beam search num_beams=5 mà server dùng mặc định) đều phải khớp
+    failed = {num_beams: count for num_beams, count in mismatches.items() if count}
+    if failed:
+        for num_beams, count in failed.items():
+            print(f"KHÔNG ĐẠT: num_beams={num_beams} có {count} caption của ONNX khác torch")
+        return 1
+    print("ĐẠT: caption của ONNX khớp với torch")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Chuyển dữ liệu ảnh ra khỏi document sang blob storage (IMAGE_BLOB_STORE: gridfs, local hoặc mongo).
+
+Cách dùng (chạy trong thư mục be, MONGODB_URI lấy từ .env):
+    python -m tools.migrate_blobs --dry-run
+    python -m tools.migrate_blobs --target gridfs --batch-size 200
+    python -m tools.migrate_blobs --target local --limit 1000
+
+Hai bước, đều chạy theo batch và có thể dừng/chạy lại bất cứ lúc nào (bản ghi đã chuyển được bỏ qua):
+1. Ảnh cũ còn dữ liệu trong trường image_data của collection images: dữ liệu được lưu vào blob dùng chung
+   (theo SHA-256, ảnh trùng nội dung chỉ tăng ref_count), document chỉ còn image_hash.
+2. Blob đang nằm ở backend khác --target (vd: trường data của image_blobs): dữ liệu được chép sang --target,
+   document trỏ sang backend mới rồi bản cũ mới bị xóa.
+Server có thể chạy trong lúc migrate: ảnh luôn đọc được từ backend ghi trong document.
+"""
+import argparse
+import os
+import sys
+import time
+
+import mongoengine
+from dotenv import load_dotenv
+
+from models.image import Image
+from models.image_blob import ImageBlob
+from services.blob_store import get_blob_store
+from services.caption_cache_service import CaptionCacheService
+from services.image_blob_service import ImageBlobService
+
+
+def migrate_images(batch_size, limit, dry_run):
+    """Bước 1: chuyển image_data của ảnh cũ sang blob dùng chung, trả về số ảnh đã chuyển"""
+    query = Image.objects(image_data__exists=True)
+    if dry_run:
+        print(f"Ảnh còn dữ liệu trong document: {query.count()}")
+        return 0
+
+    migrated = 0
+    last_id = None
+    while not limit or migrated < limit:
+        batch_query = query if last_id is None else query.filter(id__gt=last_id)
+        images = list(batch_query.only("id", "image_data", "content_type").order_by("id").limit(batch_size))
+        if not images:
+            break
+        started = time.time()
+        for image in images:
+            last_id = image.id
+            data = bytes(image.image_data) if image.image_data else None
+            if not data:
+                continue
+            image_hash = CaptionCacheService.hash_image(data)
+            ImageBlobService.acquire(image_hash, data, image.content_type)
+            # Chỉ bỏ image_data nếu ảnh chưa bị xóa/chuyển bởi tiến trình khác
+            if Image.objects(id=image.id, image_data__exists=True).update_one(set__image_hash=image_hash, unset__image_data=True):
+                migrated += 1
+            else:
+                ImageBlobService.release(image_hash)
+        print(f"Đã chuyển {migrated} ảnh ({len(images)} ảnh trong {time.time() - started:.2f}s)")
+    return migrated
+
+
+def migrate_blobs(target, batch_size, limit, dry_run):
+    """Bước 2: chuyển các blob đang ở backend khác sang target, trả về số blob đã chuyển"""
+    query = ImageBlob.objects(storage__ne=target.name)
+    if dry_run:
+        print(f"Blob chưa ở backend {target.name}: {query.count()}")
+        return 0
+
+    moved = 0
+    last_key = None
+    while not limit or moved < limit:
+        batch_query = query if last_key is None else query.filter(sha256__gt=last_key)
+        blobs = list(batch_query.only("sha256", "storage", "content_type").order_by("sha256").limit(batch_size))
+        if not blobs:
+            break
+        started = time.time()
+        for blob in blobs:
+            last_key = blob.sha256
+            if ImageBlobService.move(blob, target):
+                moved += 1
+            else:
+                print(f"Bỏ qua blob {blob.sha256} (không đọc được dữ liệu hoặc đã được chuyển)")
+        print(f"Đã chuyển {moved} blob sang {target.name} ({len(blobs)} blob trong {time.time() - started:.2f}s)")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển dữ liệu ảnh từ document sang blob storage")
+    parser.add_argument("--target", default=None, choices=["gridfs", "local", "mongo"], help="Mặc định: theo IMAGE_BLOB_STORE")
+    parser.add_argument("--batch-size", type=int, default=100, help="Số ảnh/blob mỗi batch")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ chuyển tối đa N bản ghi mỗi bước (0 = tất cả)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm số bản ghi cần chuyển")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.target:
+        # Ảnh cũ ở bước 1 cũng được ghi thẳng vào backend đích
+        os.environ["IMAGE_BLOB_STORE"] = args.target
+    mongoengine.connect(host=os.getenv("MONGODB_URI"))
+    target = get_blob_store()
+    batch_size = max(1, args.batch_size)
+
+    images = migrate_images(batch_size, args.limit, args.dry_run)
+    blobs = migrate_blobs(target, batch_size, args.limit, args.dry_run)
+    if not args.dry_run:
+        print(f"Hoàn tất: {images} ảnh và {blobs} blob đã được chuyển sang {target.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
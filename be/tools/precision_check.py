@@ -0,0 +1,95 @@
+"""
+Kiểm tra độ chính xác của chế độ suy luận int8/bf16 so với fp32 trên tập test.xlsx.
+
+Cách dùng (chạy trong thư mục be):
+    python -m tools.precision_check --images duong_dan/anh_test --model travel --precision int8
+
+Thư mục ảnh chứa các file có tên trùng với cột "image" trong test.xlsx.
+Công cụ trả về mã thoát khác 0 nếu BLEU giảm quá ngưỡng cho phép.
+Khi chạy với int8, bản lượng tử hóa cũng được lưu vào pretrain/<mô hình>/quantized để server dùng lại.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+from PIL import Image
+
+from services.image_caption_service import ImageCaptionService
+from services.evaluation_service import EvaluationService
+
+
+def caption_images(model, processor, image_paths, max_length, num_beams, batch_size):
+    """Sinh caption cho danh sách ảnh theo từng batch, trả về (captions, tổng thời gian generate)"""
+    captions = []
+    generate_seconds = 0.0
+    for start in range(0, len(image_paths), batch_size):
+        images = [Image.open(path).convert("RGB") for path in image_paths[start:start + batch_size]]
+        pixel_values = processor(images, return_tensors="np")["pixel_values"]
+
+        # Chạy đúng đường suy luận của server (vision encoder rồi text decoder) thay vì model.generate
+        started = time.time()
+        image_embeds = ImageCaptionService._encode_images(model, pixel_values)
+        output_ids = ImageCaptionService._decode_embeds(model, image_embeds, max_length, num_beams)
+        generate_seconds += time.time() - started
+        captions.extend(processor.batch_decode(output_ids, skip_special_tokens=True))
+    return captions, generate_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh BLEU của chế độ int8/bf16 với fp32")
+    parser.add_argument("--images", required=True, help="Thư mục chứa ảnh của tập test")
+    parser.add_argument("--references", default=None, help="File ground truth (mặc định: test.xlsx)")
+    parser.add_argument("--model", default="default", help="model_type cần kiểm tra")
+    parser.add_argument("--precision", required=True, choices=["int8", "bf16"])
+    parser.add_argument("--max-length", type=int, default=30)
+    parser.add_argument("--num-beams", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-bleu-drop", type=float, default=0.02, help="Mức giảm BLEU-4 tuyệt đối tối đa cho phép")
+    args = parser.parse_args()
+
+    references = EvaluationService.load_ground_truth(args.references)
+    names = sorted(name for name in os.listdir(args.images) if name in references)
+    if not names:
+        print("Không có ảnh nào trùng tên với ground truth")
+        return 2
+
+    model_path = ImageCaptionService._model_path(args.model)
+    image_paths = [os.path.join(args.images, name) for name in names]
+    refs = [references[name] for name in names]
+    print(f"Đánh giá {len(names)} ảnh với mô hình {args.model} ({model_path})")
+
+    results = {}
+    for mode in ("fp32", args.precision):
+        model, processor = ImageCaptionService._load_local_model(args.model, model_path, precision=mode, backend="torch")
+        captions, seconds = caption_images(model, processor, image_paths, args.max_length, args.num_beams, args.batch_size)
+        results[mode] = {
+            "captions": captions,
+            "seconds": seconds,
+            "scores": EvaluationService.corpus_bleu_scores(refs, captions)
+        }
+        del model
+        gc.collect()
+
+    baseline = results["fp32"]
+    candidate = results[args.precision]
+    identical = sum(1 for a, b in zip(baseline["captions"], candidate["captions"]) if a == b)
+
+    print(f"{'Chế độ':<8} {'BLEU-1':>8} {'BLEU-2':>8} {'BLEU-3':>8} {'BLEU-4':>8} {'ảnh/giây':>10}")
+    for mode in ("fp32", args.precision):
+        scores = results[mode]["scores"]
+        throughput = len(names) / results[mode]["seconds"] if results[mode]["seconds"] else 0.0
+        print(f"{mode:<8} {scores['bleu1']:>8.4f} {scores['bleu2']:>8.4f} {scores['bleu3']:>8.4f} {scores['bleu4']:>8.4f} {throughput:>10.2f}")
+    print(f"Caption giống hệt fp32: {identical}/{len(names)}")
+
+    drop = baseline["scores"]["bleu4"] - candidate["scores"]["bleu4"]
+    if drop > args.max_bleu_drop:
+        print(f"KHÔNG ĐẠT: BLEU-4 giảm {drop:.4f} (> {args.max_bleu_drop})")
+        return 1
+    print(f"ĐẠT: BLEU-4 giảm {max(drop, 0.0):.4f} (<= {args.max_bleu_drop})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -161,6 +161,68 @@ export const imageService = {
     return response.data;
   },
 
+  // Tải ảnh lên và nhận caption dần dần qua server-sent events.
+  // onPartial được gọi với caption tạm thời; gọi cancel() để dừng giải mã trên server.
+  uploadImageStream: async (
+    formData: FormData,
+    onPartial: (caption: string) => void
+  ) => {
+    const token = await AsyncStorage.getItem("token");
+    const xhr = new XMLHttpRequest();
+    let streamId: string | null = null;
+    let parsed = 0;
+
+    const result = new Promise<any>((resolve, reject) => {
+      const handleChunk = () => {
+        const text = xhr.responseText || "";
+        const events = text.slice(parsed).split("\n\n");
+        // Phần cuối có thể là sự kiện chưa nhận đủ
+        const complete = events.slice(0, -1);
+        parsed += complete.reduce((total, block) => total + block.length + 2, 0);
+
+        for (const block of complete) {
+          const eventLine = block.split("\n").find((line) => line.startsWith("event: "));
+          const dataLine = block.split("\n").find((line) => line.startsWith("data: "));
+          if (!eventLine || !dataLine) continue;
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+          if (event === "start") {
+            streamId = data.stream_id;
+          } else if (event === "partial") {
+            onPartial(data.caption);
+          } else if (event === "done") {
+            resolve(data);
+          } else if (event === "error") {
+            reject(new Error(data.error));
+          }
+        }
+      };
+
+      xhr.open("POST", `${API_URL}/image-caption/upload/stream`);
+      if (token) {
+        xhr.setRequestHeader("Authorization", `Bearer ${token}`);
+      }
+      xhr.onprogress = handleChunk;
+      xhr.onload = () => {
+        handleChunk();
+        if (xhr.status >= 400) {
+          reject(new Error(`HTTP ${xhr.status}`));
+        }
+      };
+      xhr.onerror = () => reject(new Error("Network Error"));
+      xhr.send(formData);
+    });
+
+    const cancel = async () => {
+      if (streamId) {
+        await api.post(`/image-caption/stream/${streamId}/cancel`).catch(() => undefined);
+      }
+      xhr.abort();
+    };
+
+    return { result, cancel };
+  },
+
   updateCaption: async (imageId: string, description: string) => {
     const response = await api.put(`/image-caption/caption/${imageId}`, {
       description,
@@ -168,10 +230,19 @@ export const imageService = {
     return response.data;
   },
 
-  regenerateCaption: async (imageId: string, modelType: string = 'default', language: string = 'en') => {
+  // preset: "fast" | "balanced" | "quality"; latencyBudgetMs: ngân sách độ trễ cho server (tùy chọn)
+  regenerateCaption: async (
+    imageId: string,
+    modelType: string = 'default',
+    language: string = 'en',
+    preset?: string,
+    latencyBudgetMs?: number
+  ) => {
     const response = await api.post(`/image-caption/${imageId}/regenerate`, {
       model_type: modelType,
-      language: language
+      language: language,
+      preset,
+      latency_budget_ms: latencyBudgetMs
     });
     return response.data;
   },
@@ -200,6 +271,14 @@ export const imageService = {
     return response.data;
   },
   
+  // URL audio đọc caption (dùng audio_url do server trả về nếu có để được cache lâu dài)
+  getCaptionAudioUrl: (imageId: string, language: string = 'en', audioUrl?: string) => {
+    if (audioUrl) {
+      return `${API_URL}${audioUrl.replace(/^\/api/, "")}`;
+    }
+    return `${API_URL}/image-caption/${imageId}/audio?lang=${language}`;
+  },
+
   // Helper method to get the full image URL
   getImageUrl: (imageId: string) => {
     return API_ENDPOINTS.IMAGE.GET_FILE(imageId);